@@ -1,14 +1,70 @@
 import asyncio
+import hashlib
 import aiohttp
+import json
 import os
+import re
+import uuid
+from contextvars import ContextVar
 import dotenv
 import ssl
-import httpx
-from functions.utils.common import load_proxy_config, load_model_config
+import numpy as np
+from functions.utils.common import load_proxy_config, load_model_config, load_section_config
 
 # Load configurations
 proxy = load_proxy_config()
 model_config = load_model_config()
+index_config = load_section_config('vector_index', {
+    'quantization': 'none',
+    'rescore_factor': 10,
+    'reload_interval': 1.0,
+    'snapshot_release_after': 300,
+    'route_by_course_code': True,
+    'route_top_collections': 0,
+})
+cache_config = load_section_config('cache', {
+    'embedding_cache_size': 2048,
+    'embedding_cache_ttl': 86400,
+    'retrieval_cache_size': 1024,
+    'retrieval_cache_ttl': 3600,
+    'semantic_cache_enabled': True,
+    'semantic_cache_path': 'cache/semantic_answers',
+    'semantic_cache_size': 500,
+    'semantic_cache_threshold': 0.95,
+})
+context_config = load_section_config('context', {
+    'compression': True,
+    'token_budget': 1500,
+    'trim_sentences': True,
+    'sentence_cache_size': 4096,
+})
+diagram_config = load_section_config('diagram', {
+    'cache_size': 256,
+    'cache_ttl': 86400,
+})
+memory_config = load_section_config('memory', {
+    'session_cache_size': 1000,
+    'session_ttl': 86400,
+    'token_budget': 2000,
+    'summarize': True,
+})
+agent_config = load_section_config('agent', {
+    'fast_path': True,
+    'prefetch': True,
+    'prefetch_similarity': 0.9,
+    'stream_idle_timeout': 120,
+    'scratchpad_compaction': True,
+    'compaction_min_chars': 500,
+})
+llm_routing_config = load_section_config('llm_routing', {
+    'hedging': False,
+    'hedge_percentile': 95.0,
+    'hedge_min_delay': 1.0,
+    'min_samples': 20,
+    'fallback_model': '',
+    'fallback_p95_threshold': 0.0,
+    'fallback_cooldown': 300.0,
+})
 
 # Load server configuration for dynamic URLs
 from settings import Settings
@@ -36,14 +92,31 @@ else:
     print("No proxy configuration found or proxy disabled - proxy environment variables cleared")
 
 from langchain_chroma import Chroma
-from langchain.callbacks.base import AsyncCallbackHandler
-from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import ConfigurableField
 from langchain_core.tools import tool
 from langchain.chains import RetrievalQA
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from pydantic import BaseModel, SecretStr
+from functions.vector_index.retriever import KnowledgeBaseRetriever, QuantizedRetriever, SnapshotRetriever
+from functions.vector_index.kb_collections import (
+    KnowledgeBase, MetadataFilter, RetrievalScope, course_codes, current_scope
+)
+from functions.vector_index.snapshots import LiveIndex
+from functions.cache.lru_cache import TTLLRUCache
+from functions.cache.query_cache import CachedEmbeddings, CachedRetriever, normalize_query
+from functions.cache.semantic_cache import SemanticAnswerCache
+from functions.cache.single_flight import SingleFlight
+from functions.diagram.mermaid import FALLBACK_DIAGRAM, check_mermaid, clean_mermaid, validate_mermaid
+from functions.utils.index_version import read_index_version
+from functions.streaming.streamer import QueueCallbackHandler
+from functions.streaming.references import ReferenceSplicer, ScratchpadReferences
+from functions.memory.session_memory import SessionMemory
+from functions.context.compressor import ContextCompressor
+from functions.utils.http_clients import get_async_client, get_sync_client
+from functions.llm.hedged_chat import HedgedChatModel
+from functions.utils.rate_limit import BACKGROUND, priority
 
 # Load parameters from .env file
 dotenv.load_dotenv()
@@ -56,18 +129,9 @@ except AttributeError:
 else:
     ssl._create_default_https_context = _create_unverified_https_context
 
-# Create HTTP client for proxy configuration
-http_client = None
-if proxy and proxy.strip():
-    # Create httpx client with proxy configuration for OpenAI
-    http_client = httpx.Client(
-        proxy=proxy,  # Use 'proxy' instead of 'proxies'
-        verify=False,  # Disable SSL verification for corporate proxies
-        timeout=60.0
-    )
-    print(f"HTTP client configured with proxy: {proxy}")
-else:
-    print("HTTP client created without proxy")
+# One process-wide sync/async client pair (keep-alive pool, proxy if configured) for all OpenAI calls
+http_client = get_sync_client()
+http_async_client = get_async_client()
 
 # Constants and Configuration
 OPENAI_API_KEY = model_config['openai_api_key']
@@ -76,14 +140,29 @@ SERPAPI_API_KEY = SecretStr(os.environ.get("SERPAPI_API_KEY", ""))
 PERSIST_DIR = "chroma_store"
 
 # LLM and Prompt Setup using config
-llm = ChatOpenAI(
-    model=model_config['llm_model'],
-    temperature=model_config['temperature'],
-    streaming=True,
-    api_key=OPENAI_API_KEY_SECRET,
-    base_url=model_config.get('llm_base_url') if model_config.get('llm_base_url') and model_config.get('llm_base_url').strip() else None,
-    http_client=http_client  # Add proxy-configured HTTP client
-).configurable_fields(
+def build_chat_model(model_name: str) -> ChatOpenAI:
+    return ChatOpenAI(
+        model=model_name,
+        temperature=model_config['temperature'],
+        streaming=True,
+        api_key=OPENAI_API_KEY_SECRET,
+        base_url=model_config.get('llm_base_url') if model_config.get('llm_base_url') and model_config.get('llm_base_url').strip() else None,
+        http_client=http_client,
+        http_async_client=http_async_client
+    )
+
+# Primary model with hedged first-token requests and a fallback model when its p95 latency degrades
+routed_llm = HedgedChatModel(
+    primary=build_chat_model(model_config['llm_model']),
+    fallback=build_chat_model(llm_routing_config['fallback_model']) if str(llm_routing_config['fallback_model']).strip() else None,
+    hedging=llm_routing_config['hedging'],
+    hedge_percentile=llm_routing_config['hedge_percentile'],
+    hedge_min_delay=llm_routing_config['hedge_min_delay'],
+    min_samples=llm_routing_config['min_samples'],
+    fallback_threshold=llm_routing_config['fallback_p95_threshold'],
+    fallback_cooldown=llm_routing_config['fallback_cooldown'],
+)
+llm = routed_llm.configurable_fields(
     callbacks=ConfigurableField(
         id="callbacks",
         name="callbacks",
@@ -92,17 +171,113 @@ llm = ChatOpenAI(
 )
 
 # Embedding and chromadb setup using config
-embedding = OpenAIEmbeddings(
+# Query embeddings are cached by normalized question text
+query_embedding_cache = TTLLRUCache(maxsize=cache_config['embedding_cache_size'],
+                                    ttl=cache_config['embedding_cache_ttl'])
+embedding = CachedEmbeddings(OpenAIEmbeddings(
     model=model_config['embedding_model'],
     api_key=model_config.get('embedding_api_key', model_config['openai_api_key']),
     base_url=model_config.get('embedding_base_url') if model_config.get('embedding_base_url') and model_config.get('embedding_base_url').strip() else None,
-    http_client=http_client  # Add proxy-configured HTTP client
-)
-
-vectordb = Chroma(persist_directory=PERSIST_DIR, 
-                  embedding_function=embedding)
+    http_client=http_client,
+    http_async_client=http_async_client
+), query_embedding_cache)
+
+# Use the coarse-to-fine index when quantization or shortened search vectors are enabled
+# and the index has been built for this snapshot
+use_coarse_index = index_config['quantization'] != 'none' or model_config.get('embedding_search_dimensions', 0) > 0
+
+def load_coarse_retriever(store, quantized_index_dir: str):
+    if use_coarse_index and os.path.exists(os.path.join(quantized_index_dir, "meta.json")):
+        print(f"Using {index_config['quantization']} coarse index "
+              f"({model_config.get('embedding_search_dimensions') or 'full'} dims): {quantized_index_dir}")
+        return QuantizedRetriever(vectorstore=store,
+                                  index_dir=quantized_index_dir,
+                                  rescore_factor=index_config['rescore_factor'])
+    return None
+
+def load_snapshot(path: str):
+    """Open one index snapshot: its per-folder collections and the retriever searching them"""
+    knowledge_base = KnowledgeBase(
+        path, embedding,
+        store_factory=lambda name: Chroma(persist_directory=path, collection_name=name, embedding_function=embedding),
+        coarse_factory=load_coarse_retriever,
+        route_by_course_code=index_config['route_by_course_code'],
+        route_top_collections=index_config['route_top_collections'])
+    return knowledge_base, KnowledgeBaseRetriever(knowledge_base=knowledge_base)
+
+# Ingestion publishes new snapshots next to the serving one; queries switch over without a restart
+vectordb = LiveIndex(PERSIST_DIR, load_snapshot, check_interval=index_config['reload_interval'],
+                     release_after=index_config['snapshot_release_after'])
+retriever = SnapshotRetriever(index=vectordb)
+
+# Retrieved chunk ids are cached per index version, which ingestion bumps after each commit
+retrieval_cache = TTLLRUCache(maxsize=cache_config['retrieval_cache_size'],
+                              ttl=cache_config['retrieval_cache_ttl'])
+retriever = CachedRetriever(retriever=retriever,
+                            vectorstore=vectordb,
+                            persist_dir=PERSIST_DIR,
+                            cache=retrieval_cache)
+
+# Final answers keyed by query embedding, persisted across restarts
+semantic_cache = SemanticAnswerCache(path=cache_config['semantic_cache_path'],
+                                     maxsize=cache_config['semantic_cache_size'],
+                                     threshold=cache_config['semantic_cache_threshold']) \
+    if cache_config['semantic_cache_enabled'] else None
+
+# Builds the "stuff" context: deduplicated boilerplate, merged chunks, trimmed to a token budget
+context_compressor = ContextCompressor(embeddings=embedding.embeddings,
+                                       token_budget=context_config['token_budget'],
+                                       trim_sentences=context_config['trim_sentences'],
+                                       cache=TTLLRUCache(maxsize=context_config['sentence_cache_size'])) \
+    if context_config['compression'] else None
+
+async def build_context(query_vector, docs: list) -> list:
+    """Documents to stuff into the prompt for this query (the retrieved ones when compression is off)"""
+    if not context_compressor:
+        return docs
+    return await context_compressor.acompress(query_vector, docs)
+
+# Identical questions in flight at the same time (a whole class pasting the same text)
+# share one embedding call, one vector search and one completion
+embedding_flight = SingleFlight("embedding")
+retrieval_flight = SingleFlight("retrieval")
+answer_flight = SingleFlight("answer")
+diagram_flight = SingleFlight("diagram")
+
+# Validated diagrams by content hash, so repeated requests over the same documents skip the completion
+diagram_cache = TTLLRUCache(maxsize=diagram_config['cache_size'], ttl=diagram_config['cache_ttl'])
+
+def diagram_cache_key(doc_content: str) -> str:
+    normalized = re.sub(r"\s+", " ", doc_content).strip()
+    return hashlib.sha256(f"{model_config['llm_model']}\n{normalized}".encode("utf-8")).hexdigest()
+
+async def embed_query(query: str) -> list[float]:
+    return await embedding_flight.do(normalize_query(query), lambda: embedding.aembed_query(query))
+
+def scope_for(collections: list[str] | None, filters: MetadataFilter | None = None) -> RetrievalScope:
+    """Search scope of a request; None searches the collections chosen by the router"""
+    names = vectordb.resolve(collections) or None if collections else None
+    if filters and filters.courses:
+        # A course filter is a collection selection: only the matching folders are searched at all
+        course_names = vectordb.resolve(list(filters.courses))
+        names = tuple(name for name in names if name in course_names) if names is not None else course_names
+    return RetrievalScope(collections=names, metadata_filter=filters or None)
+
+# Whether the running request has earlier turns in its session (the answer may depend on them)
+current_has_history: ContextVar[bool] = ContextVar("current_has_history", default=False)
+
+def scoped_semantic_cache() -> SemanticAnswerCache | None:
+    """
+    Cached answers are shared across the whole corpus and are keyed on the question
+    alone, so restricted or filtered requests and follow-ups in a conversation skip them
+    """
+    if current_scope.get().explicit or current_has_history.get():
+        return None
+    return semantic_cache
 
-retriever = vectordb.as_retriever()
+async def retrieve(query: str) -> list:
+    key = (normalize_query(query), read_index_version(PERSIST_DIR), current_scope.get().key())
+    return await retrieval_flight.do(key, lambda: retriever.ainvoke(query))
 
 # create the chain to answer questions 
 qa_chain = RetrievalQA.from_chain_type(llm=llm, 
@@ -121,7 +296,7 @@ prompt = ChatPromptTemplate.from_messages([
         "- Bước 1: Gọi project_doccuments để tìm kiếm tài liệu.\n"
         "- Bước 2: Nếu người dùng yêu cầu sơ đồ, gọi generate_diagram với output từ project_doccuments.\n"
         "- Bước 3: Khi đã đầy đủ thông tin, dùng final_answer để trả kết quả cuối cùng.\n\n"
-        "QUAN TRỌNG: Khi gọi final_answer, hãy truyền TOÀN BỘ nội dung từ project_doccuments bao gồm cả các liên kết tải xuống và định dạng markdown. Đừng tóm tắt hay thay đổi định dạng.\n\n"
+        "{copy_instruction}"
         "Lưu ý:\n"
         "- Chỉ trả sơ đồ ở định dạng Mermaid, không thêm giải thích.\n"
         "- Luôn lấy thông tin mới nhất.\n"
@@ -132,6 +307,57 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="agent_scratchpad"),
 ])
 
+# How the agent hands tool output over to final_answer: copied verbatim, or by [[ref:ID]] when the scratchpad is compacted
+COPY_INSTRUCTION = (
+    "QUAN TRỌNG: Khi gọi final_answer, hãy truyền TOÀN BỘ nội dung từ project_doccuments bao gồm cả các liên kết tải xuống và định dạng markdown. Đừng tóm tắt hay thay đổi định dạng.\n\n"
+)
+REFERENCE_INSTRUCTION = (
+    "QUAN TRỌNG: Kết quả dài của công cụ được lưu phía máy chủ và chỉ hiển thị dưới dạng tham chiếu [[ref:ID]] kèm trích đoạn. "
+    "Khi cần đưa TOÀN BỘ nội dung đó (kể cả các liên kết tải xuống) vào final_answer hoặc generate_diagram, "
+    "hãy viết đúng tham chiếu [[ref:ID]] thay vì chép lại; máy chủ sẽ tự chèn nội dung gốc. "
+    "Có thể thêm câu dẫn hoặc nhận xét ngắn trước hoặc sau tham chiếu.\n\n"
+)
+prompt = prompt.partial(copy_instruction=REFERENCE_INSTRUCTION if agent_config['scratchpad_compaction'] else COPY_INSTRUCTION)
+
+# Refusals are never cached: the direct prompt asks for REFUSAL_ANSWER, and the qa_chain "stuff"
+# prompt (LangChain's English default) makes the model say "I don't know." in either language
+REFUSAL_ANSWER = "Tôi không biết."
+REFUSAL_PREFIXES = ("tôi không biết", "i don't know", "i do not know")
+
+def is_refusal(answer: str) -> bool:
+    return answer.strip().lower().replace("’", "'").startswith(REFUSAL_PREFIXES)
+
+# Prompt for the direct-RAG fast path: one grounded completion, no tool calls
+direct_prompt = ChatPromptTemplate.from_messages([
+    ("system", (
+        "Bạn là một trợ lý hữu ích cho một chuyên gia về Cloud, Data Engine, Web Application, Mobile Application.\n"
+        "Chỉ sử dụng các đoạn tài liệu dưới đây để trả lời câu hỏi. "
+        f"Nếu tài liệu không có thông tin, chỉ trả lời đúng câu \"{REFUSAL_ANSWER}\", đừng tự bịa ra câu trả lời.\n"
+        "Trả lời bằng định dạng markdown.\n\n"
+        "Tài liệu:\n{context}"
+    )),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}"),
+])
+
+# Requests that need generate_diagram go through the full agent, everything else can take the fast path
+AGENT_INTENT_KEYWORDS = (
+    "sơ đồ", "biểu đồ", "vẽ", "diagram", "mermaid", "flowchart", "chart", "architecture", "kiến trúc hệ thống",
+)
+
+def needs_agent(query: str) -> bool:
+    """Cheap local intent check: does this request need the tool-using agent?"""
+    text = normalize_query(query)
+    return any(keyword in text for keyword in AGENT_INTENT_KEYWORDS)
+
+def use_fast_path(query: str, mode: str = "auto") -> bool:
+    """Pick the direct-RAG path from an explicit mode ("direct"/"agent") or the intent check"""
+    if mode == "direct":
+        return True
+    if mode == "agent":
+        return False
+    return agent_config['fast_path'] and not needs_agent(query)
+
 # we use the article object for parsing serpapi results later
 class Article(BaseModel):
     title: str
@@ -236,66 +462,62 @@ def get_downloadable_filename(source_path: str) -> str:
         print(f"Error mapping filename: {e}")
         return None
 
-# Tools definition
-# note: we define all tools as async to simplify later code, but only the serpapi
-# tool is actually async
-@tool
-async def project_doccuments(query: str) -> str:
-    """Use this tool to search the doccument in chromadb."""
-    output = ""
-    llm_response = qa_chain(query)
+def collect_sources(source_paths: list[str]) -> list[dict]:
+    """Deduplicate retrieved source paths into display names and download URLs (None if not downloadable)"""
+    # Deduplicate source documents based on source path and display filename
+    seen_sources = set()
+    seen_display_names = set()
+    unique_sources = []
     
-    # Check if we have a valid response with sources
-    if llm_response["result"] and llm_response["result"] != "I don't know.":
-        output += f"""{llm_response["result"]}\n\nSources:"""
+    for source_path in source_paths:
+        # Extract display filename for additional deduplication
+        display_filename = os.path.basename(source_path)
+        if display_filename.endswith('.md'):
+            display_filename = display_filename[:-3]  # Remove .md extension
         
-        # Deduplicate source documents based on source path and display filename
-        seen_sources = set()
-        seen_display_names = set()
-        unique_sources = []
+        # Use both source path and display filename as unique identifiers
+        if source_path not in seen_sources and display_filename not in seen_display_names:
+            seen_sources.add(source_path)
+            seen_display_names.add(display_filename)
+            unique_sources.append(source_path)
+    
+    sources = []
+    for source_path in unique_sources:
+        # Extract just the filename for display
+        filename = os.path.basename(source_path)
+        if 'markdown' in source_path.lower() and filename.endswith('.md'):
+            filename = filename[:-3]  # Remove .md extension for markdown folder sources
         
-        for source in llm_response["source_documents"]:
-            source_path = source.metadata['source']
-            # Extract display filename for additional deduplication
-            display_filename = os.path.basename(source_path)
-            if display_filename.endswith('.md'):
-                display_filename = display_filename[:-3]  # Remove .md extension
-            
-            # Use both source path and display filename as unique identifiers
-            if source_path not in seen_sources and display_filename not in seen_display_names:
-                seen_sources.add(source_path)
-                seen_display_names.add(display_filename)
-                unique_sources.append(source)
+        # Handle data_raw_data_ pattern for display
+        if filename.startswith('data_raw_data_'):
+            filename = filename[len('data_raw_data_'):]
         
-        for source in unique_sources:
-            source_path = source.metadata['source']
-            
-            # Try to find downloadable file
-            downloadable_file = get_downloadable_filename(source_path)
-            if downloadable_file:
-                # Extract just the filename for display
-                filename = os.path.basename(source_path)
-                if 'markdown' in source_path.lower() and filename.endswith('.md'):
-                    filename = filename[:-3]  # Remove .md extension for markdown folder sources
-                
-                # Handle data_raw_data_ pattern for display
-                if filename.startswith('data_raw_data_'):
-                    filename = filename[len('data_raw_data_'):]
-                
-                # Create download link with filename as clickable text
-                download_url = f"{BASE_URL}/download?filename={downloadable_file}"
-                output += f"\n📄 <a href=\"{download_url}\">{filename}</a>"
-            else:
-                # Show filename without link if not downloadable
-                filename = os.path.basename(source_path)
-                if 'markdown' in source_path.lower() and filename.endswith('.md'):
-                    filename = filename[:-3]
-                
-                # Handle data_raw_data_ pattern for display
-                if filename.startswith('data_raw_data_'):
-                    filename = filename[len('data_raw_data_'):]
-                
-                output += f"\n📄 {filename} *(not available for download)*"
+        # Try to find downloadable file
+        downloadable_file = get_downloadable_filename(source_path)
+        download_url = f"{BASE_URL}/download?filename={downloadable_file}" if downloadable_file else None
+        sources.append({"name": filename, "url": download_url})
+
+    return sources
+
+def format_source_links(source_paths: list[str]) -> str:
+    """Render the deduplicated "Sources:" block with download links"""
+    links = "\n\nSources:"
+    for source in collect_sources(source_paths):
+        if source["url"]:
+            # Create download link with filename as clickable text
+            links += f"\n📄 <a href=\"{source['url']}\">{source['name']}</a>"
+        else:
+            # Show filename without link if not downloadable
+            links += f"\n📄 {source['name']} *(not available for download)*"
+    return links
+
+def format_project_answer(query: str, result: str, source_paths: list[str]) -> str:
+    """Render a qa_chain answer with its download links for the agent and the client"""
+    output = ""
+    
+    # Check if we have a valid response with sources
+    if result and result != "I don't know.":
+        output += result + format_source_links(source_paths)
     else:
         # For testing purposes, add a demo response for HelloAI queries
         if "HelloAI" in query or "hello" in query.lower() or "requirement" in query.lower():
@@ -314,7 +536,104 @@ Sources:
 📄 [HelloAIForAMS_Requirement_v0.1.xlsx]({BASE_URL}/download?filename=HelloAIForAMS_Requirement_v0.1.xlsx)
 📄 [HelloAIForAMS_Requirement_v0.2.xlsx]({BASE_URL}/download?filename=HelloAIForAMS_Requirement_v0.2.xlsx)"""
         else:
-            output = llm_response["result"] + "\n\nSources:"
+            output = result + "\n\nSources:"
+
+    return output
+
+class RetrievalPrefetch:
+    """
+    Speculative retrieval for the raw user input, started as soon as /invoke is
+    received so the vector search runs while the agent generates its first tool
+    call. project_doccuments reuses the documents when its query is the same or
+    close enough to the input, otherwise they are discarded.
+    """
+    used = 0
+    discarded = 0
+
+    def __init__(self, query: str):
+        self.query = query
+        self.task = asyncio.create_task(self._retrieve())
+
+    async def _retrieve(self):
+        # errors are reported here, the task may never be awaited when no project_doccuments call follows
+        try:
+            query_vector = await embed_query(self.query)
+            docs = await retrieve(self.query)
+            return query_vector, docs
+        except Exception as e:
+            print(f"Retrieval prefetch failed: {e}")
+            return None
+
+    async def match(self, query: str, query_vector) -> list | None:
+        """Return the prefetched documents if `query` is close enough to the prefetched input"""
+        prefetched = await self.task
+        if prefetched is None:
+            return None
+        prefetched_vector, docs = prefetched
+
+        if normalize_query(query) != normalize_query(self.query):
+            a = np.asarray(query_vector, dtype=np.float32)
+            b = np.asarray(prefetched_vector, dtype=np.float32)
+            similarity = float(a @ b / max(float(np.linalg.norm(a) * np.linalg.norm(b)), 1e-12))
+            if similarity < agent_config['prefetch_similarity']:
+                RetrievalPrefetch.discarded += 1
+                return None
+        RetrievalPrefetch.used += 1
+        return docs
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+current_prefetch: ContextVar[RetrievalPrefetch | None] = ContextVar("current_prefetch", default=None)
+# Streamer of the running request, so tools can send early events (e.g. sources) to the client
+current_streamer: ContextVar[QueueCallbackHandler | None] = ContextVar("current_streamer", default=None)
+
+def emit_sources(source_paths: list[str]) -> None:
+    """Send the retrieved sources to the client before the answer is generated"""
+    streamer = current_streamer.get()
+    if streamer:
+        streamer.emit_event("sources", {"sources": collect_sources(source_paths)})
+
+# Tools definition
+# note: we define all tools as async to simplify later code, but only the serpapi
+# tool is actually async
+@tool
+async def project_doccuments(query: str) -> str:
+    """Use this tool to search the doccument in chromadb."""
+    # Paraphrases of a recently answered question reuse the cached answer
+    query_vector = await embed_query(query)
+    index_version = read_index_version(PERSIST_DIR)
+    answer_cache = scoped_semantic_cache()
+    codes = course_codes(query)
+    cached = answer_cache.lookup(query_vector, index_version, codes) if answer_cache else None
+    if cached:
+        print(f"Semantic cache hit ({cached['similarity']:.3f}): {cached['query']}")
+        emit_sources(cached["sources"])
+        output = format_project_answer(query, cached["answer"], cached["sources"])
+        print(output)
+        return output
+
+    # Retrieval, reusing the documents prefetched while the agent was planning when they match
+    prefetch = current_prefetch.get()
+    docs = await prefetch.match(query, query_vector) if prefetch else None
+    if docs is None:
+        docs = await retrieve(query)
+    source_paths = [source.metadata['source'] for source in docs]
+    emit_sources(source_paths)
+
+    # Same "stuff" step qa_chain runs after its own retrieval
+    async def answer() -> str:
+        context_docs = await build_context(query_vector, docs)
+        result = await qa_chain.combine_documents_chain.ainvoke({"input_documents": context_docs, "question": query})
+        if answer_cache and result["output_text"] and not is_refusal(result["output_text"]):
+            await asyncio.to_thread(answer_cache.store, query, query_vector,
+                                    result["output_text"], source_paths, index_version, codes)
+        return result["output_text"]
+
+    answer_key = ("project_doccuments", normalize_query(query), index_version, tuple(doc.id for doc in docs))
+    llm_response = {"result": await answer_flight.do(answer_key, answer), "source_documents": docs}
+    output = format_project_answer(query, llm_response["result"], source_paths)
 
     print(output)
     return output
@@ -351,47 +670,45 @@ async def generate_diagram(doc_content: str) -> str:
     Generate valid Mermaid syntax only:
     """
 
+    key = diagram_cache_key(doc_content)
+    cached = diagram_cache.get(key)
+    if cached is not None:
+        print("INFO: Diagram cache hit")
+        return cached
+
+    async def generate() -> str:
+        response = await llm.ainvoke(prompt)
+        diagram = clean_mermaid(response.content)
+        errors, fixed = check_mermaid(diagram)
+        if errors:
+            # quoting labels with special characters fixes most errors without another completion
+            diagram = fixed
+            errors = validate_mermaid(diagram)
+        if errors:
+            print(f"WARNING: Invalid Mermaid from LLM, repairing: {errors}")
+            diagram = await repair_diagram(diagram, errors)
+            errors = validate_mermaid(diagram)
+        if errors:
+            print(f"WARNING: Mermaid still invalid after repair: {errors}")
+            return diagram if diagram.count('\n') >= 1 else FALLBACK_DIAGRAM
+        # only valid diagrams are cached
+        diagram_cache.set(key, diagram)
+        return diagram
+
+    return await diagram_flight.do(key, generate)
+
+async def repair_diagram(diagram: str, errors: list[str]) -> str:
+    """One targeted repair completion: fix the listed errors, keep everything else"""
+    prompt = (
+        "The following Mermaid flowchart (version 10.9.4) has syntax errors.\n"
+        "Fix ONLY these errors and keep all nodes, labels and edges otherwise unchanged. "
+        "Wrap labels containing special characters in double quotes. Return only the Mermaid code.\n\n"
+        "Errors:\n" + "\n".join(f"- {error}" for error in errors) + "\n\n"
+        f"Diagram:\n{diagram}"
+    )
     response = await llm.ainvoke(prompt)
-    
-    # Clean up the response to ensure proper Mermaid syntax
-    content = response.content.strip()
-    
-    # Remove markdown code block markers if present
-    if content.startswith('```mermaid'):
-        content = content[10:]
-    if content.startswith('```'):
-        content = content[3:]
-    if content.endswith('```'):
-        content = content[:-3]
-    
-    content = content.strip()
-    
-    # Ensure it starts with graph declaration
-    if not content.startswith('graph'):
-        content = f"graph TD\n{content}"
-    
-    # Basic validation and cleanup
-    lines = content.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        if line:
-            # Ensure proper spacing around arrows
-            line = line.replace('-->', ' --> ')
-            line = line.replace('---', ' --- ')
-            # Remove extra spaces
-            while '  ' in line:
-                line = line.replace('  ', ' ')
-            cleaned_lines.append(line)
-    
-    # Fallback to a simple diagram if something goes wrong
-    if len(cleaned_lines) < 2:
-        return """graph TD
-    A[System] --> B[Component]
-    B --> C[Database]"""
-    
-    return '\n'.join(cleaned_lines)
+    repaired = clean_mermaid(response.content)
+    return check_mermaid(repaired)[1]
 
 # @tool
 # async def serpapi(query: str) -> list[Article]:
@@ -421,48 +738,43 @@ tools = [project_doccuments, generate_diagram, final_answer]
 name2tool = {tool.name: tool.coroutine for tool in tools}
 
 # Streaming Handler
-class QueueCallbackHandler(AsyncCallbackHandler):
-    def __init__(self, queue: asyncio.Queue):
-        self.queue = queue
-        self.final_answer_seen = False
-
-    async def __aiter__(self):
-        while True:
-            if self.queue.empty():
-                await asyncio.sleep(0.1)
-                continue
-            token_or_done = await self.queue.get()
-            if token_or_done == "<<DONE>>":
-                return
-            if token_or_done:
-                yield token_or_done
-    
-    async def on_llm_new_token(self, *args, **kwargs) -> None:
-        chunk = kwargs.get("chunk")
-        if chunk and chunk.message.additional_kwargs.get("tool_calls"):
-            if chunk.message.additional_kwargs["tool_calls"][0]["function"]["name"] == "final_answer":
-                self.final_answer_seen = True
-        self.queue.put_nowait(kwargs.get("chunk"))
-    
-    async def on_llm_end(self, *args, **kwargs) -> None:
-        if self.final_answer_seen:
-            self.queue.put_nowait("<<DONE>>")
-        else:
-            self.queue.put_nowait("<<STEP_END>>")
-
-async def execute_tool(tool_call: AIMessage) -> ToolMessage:
+async def execute_tool(tool_call: AIMessage, references: ScratchpadReferences | None = None) -> ToolMessage:
     tool_name = tool_call.tool_calls[0]["name"]
     tool_args = tool_call.tool_calls[0]["args"]
+    if references:
+        # put back the tool outputs the model referenced instead of copying
+        tool_args = references.expand_args(tool_args)
     tool_out = await name2tool[tool_name](**tool_args)
     return ToolMessage(
         content=f"{tool_out}",
         tool_call_id=tool_call.tool_calls[0]["id"]
     )
 
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system", (
+        "Tóm tắt ngắn gọn cuộc hội thoại giữa người dùng và trợ lý, giữ lại các thông tin, "
+        "tên dự án, tài liệu và yêu cầu quan trọng cho các câu hỏi tiếp theo. "
+        "Chỉ trả về bản tóm tắt, không quá 150 từ."
+    )),
+    ("human", "Tóm tắt hiện tại:\n{summary}\n\nCác lượt hội thoại mới:\n{turns}"),
+])
+
+async def summarize_history(summary: str, messages: list[BaseMessage]) -> str:
+    """Fold conversation turns that no longer fit the session budget into the running summary"""
+    turns = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    with priority(BACKGROUND):
+        response = await llm.ainvoke(summary_prompt.format_messages(summary=summary or "(trống)", turns=turns))
+    return response.content
+
+# Conversation history per client session, bounded in sessions and tokens
+session_memory = SessionMemory(maxsize=memory_config['session_cache_size'],
+                               ttl=memory_config['session_ttl'],
+                               token_budget=memory_config['token_budget'],
+                               summarizer=summarize_history if memory_config['summarize'] else None)
+
 # Agent Executor
 class CustomAgentExecutor:
     def __init__(self, max_iterations: int = 3):
-        self.chat_history: list[BaseMessage] = []
         self.max_iterations = max_iterations
         self.agent = (
             {
@@ -474,12 +786,39 @@ class CustomAgentExecutor:
             | llm.bind_tools(tools, tool_choice="any")
         )
 
-    async def invoke(self, input: str, streamer: QueueCallbackHandler, verbose: bool = False) -> dict:
+    async def invoke(self, input: str, streamer: QueueCallbackHandler, verbose: bool = False,
+                     session_id: str | None = None, collections: list[str] | None = None,
+                     filters: MetadataFilter | None = None) -> dict:
+        scope_token = current_scope.set(scope_for(collections, filters))
+        history_token = current_has_history.set(bool(session_memory.history(session_id)))
+        # Start retrieval for the raw input while the first LLM call plans its tool call
+        prefetch = RetrievalPrefetch(input) if agent_config['prefetch'] else None
+        token = current_prefetch.set(prefetch)
+        streamer_token = current_streamer.set(streamer)
+        try:
+            return await self._run_agent_loop(input, streamer, verbose, session_id)
+        finally:
+            # Also ends the stream when the loop fails before final_answer
+            streamer.finish()
+            current_streamer.reset(streamer_token)
+            current_has_history.reset(history_token)
+            current_prefetch.reset(token)
+            current_scope.reset(scope_token)
+            if prefetch:
+                prefetch.cancel()
+
+    async def _run_agent_loop(self, input: str, streamer: QueueCallbackHandler, verbose: bool = False,
+                              session_id: str | None = None) -> dict:
         # invoke the agent but we do this iteratively in a loop until
         # reaching a final answer
         count = 0
         final_answer: str | None = None
         agent_scratchpad: list[AIMessage | ToolMessage] = []
+        chat_history = session_memory.history(session_id)
+        references = None
+        if agent_config['scratchpad_compaction']:
+            references = ScratchpadReferences(min_chars=agent_config['compaction_min_chars'])
+            streamer.argument_filter = ReferenceSplicer(references)
         # streaming function
         async def stream(query: str) -> list[AIMessage]:
             response = self.agent.with_config(
@@ -491,7 +830,7 @@ class CustomAgentExecutor:
             # now we begin streaming
             async for token in response.astream({
                 "input": query,
-                "chat_history": self.chat_history,
+                "chat_history": chat_history,
                 "agent_scratchpad": agent_scratchpad
             }):
                 tool_calls = token.additional_kwargs.get("tool_calls")
@@ -516,14 +855,18 @@ class CustomAgentExecutor:
             tool_calls = await stream(query=input)
             # gather tool execution coroutines
             tool_obs = await asyncio.gather(
-                *[execute_tool(tool_call) for tool_call in tool_calls]
+                *[execute_tool(tool_call, references) for tool_call in tool_calls]
             )
             # append tool calls and tool observations to the scratchpad in order
             id2tool_obs = {tool_call.tool_call_id: tool_obs for tool_call, tool_obs in zip(tool_calls, tool_obs)}
             for tool_call in tool_calls:
+                observation = id2tool_obs[tool_call.tool_call_id]
+                if references and tool_call.tool_calls[0]["name"] != "final_answer":
+                    # large outputs go back to the LLM as a short [[ref:ID]] instead of in full
+                    observation = references.compact(tool_call.tool_calls[0]["name"], observation)
                 agent_scratchpad.extend([
                     tool_call,
-                    id2tool_obs[tool_call.tool_call_id]
+                    observation
                 ])
             
             count += 1
@@ -534,6 +877,8 @@ class CustomAgentExecutor:
                 if tool_call.tool_calls[0]["name"] == "final_answer":
                     final_answer_call = tool_call.tool_calls[0]
                     final_answer = final_answer_call["args"]["answer"]
+                    if references:
+                        final_answer = references.expand(final_answer)
                     # Get the actual tool execution result which contains both answer and tools_used
                     final_answer_result = tool_obs.content
                     found_final_answer = True
@@ -544,10 +889,7 @@ class CustomAgentExecutor:
                 break
             
         # add the final output to the chat history, we only add the "answer" field
-        self.chat_history.extend([
-            HumanMessage(content=input),
-            AIMessage(content=final_answer if final_answer else "No answer found")
-        ])
+        session_memory.add_turn(session_id, input, final_answer if final_answer else "No answer found")
         # return the final answer result (which should be a dict with answer and tools_used)
         if final_answer_result:
             try:
@@ -564,5 +906,92 @@ class CustomAgentExecutor:
         else:
             return {"answer": "No answer found", "tools_used": []}
 
+    async def invoke_direct(self, input: str, streamer: QueueCallbackHandler, session_id: str | None = None,
+                            collections: list[str] | None = None, filters: MetadataFilter | None = None) -> dict:
+        """
+        Direct-RAG fast path: one retrieval and one grounded completion, streamed to
+        the client as a final_answer step. Skips the tool-selection and final_answer
+        completions of the agent loop.
+        """
+        tools_used = ["project_doccuments"]
+        scope_token = current_scope.set(scope_for(collections, filters))
+        chat_history = session_memory.history(session_id)
+        history_token = current_has_history.set(bool(chat_history))
+        try:
+            streamer.emit_tool_call_chunk("final_answer", '{"answer": "', call_id=f"direct_{uuid.uuid4().hex}")
+
+            query_vector = await embed_query(input)
+            index_version = read_index_version(PERSIST_DIR)
+            answer_cache = scoped_semantic_cache()
+            codes = course_codes(input)
+            cached = answer_cache.lookup(query_vector, index_version, codes) if answer_cache else None
+            if cached:
+                answer, source_paths = cached["answer"], cached["sources"]
+                streamer.emit_event("sources", {"sources": collect_sources(source_paths)})
+                streamer.emit_tool_call_chunk(None, json.dumps(answer, ensure_ascii=False)[1:-1])
+            else:
+                docs = await retrieve(input)
+                source_paths = [doc.metadata.get('source', '') for doc in docs]
+                streamer.emit_event("sources", {"sources": collect_sources(source_paths)})
+
+                async def generate():
+                    context_docs = await build_context(query_vector, docs)
+                    messages = direct_prompt.format_messages(
+                        context="\n\n".join(doc.page_content for doc in context_docs),
+                        chat_history=chat_history,
+                        input=input,
+                    )
+                    text = ""
+                    async for chunk in llm.astream(messages):
+                        if chunk.content:
+                            text += chunk.content
+                            yield chunk.content
+                    if answer_cache and text and not is_refusal(text):
+                        await asyncio.to_thread(answer_cache.store, input, query_vector,
+                                                text, source_paths, index_version, codes)
+
+                # requests with the same question, documents and history share one streamed completion
+                answer_key = ("direct", normalize_query(input), index_version, tuple(doc.id for doc in docs),
+                              tuple((message.type, message.content) for message in chat_history))
+                answer = ""
+                async for content in answer_flight.stream(answer_key, generate):
+                    answer += content
+                    streamer.emit_tool_call_chunk(None, json.dumps(content, ensure_ascii=False)[1:-1])
+
+            # Stream the download links after the answer text
+            output = format_project_answer(input, answer, source_paths)
+            if output.startswith(answer):
+                streamer.emit_tool_call_chunk(None, json.dumps(output[len(answer):], ensure_ascii=False)[1:-1])
+            streamer.emit_tool_call_chunk(None, f'", "tools_used": {json.dumps(tools_used)}}}')
+
+            session_memory.add_turn(session_id, input, output)
+            return {"answer": output, "tools_used": tools_used}
+        finally:
+            current_has_history.reset(history_token)
+            current_scope.reset(scope_token)
+            streamer.finish()
+
+def cache_stats() -> dict:
+    """Hit ratios of the query embedding and retrieval caches"""
+    return {
+        "index_version": read_index_version(PERSIST_DIR),
+        "index_snapshot": vectordb.stats(),
+        "collections": vectordb.current().vectorstore.stats(),
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "semantic_answers": semantic_cache.stats() if semantic_cache else None,
+        "sessions": session_memory.stats(),
+        "retrieval_prefetch": {"used": RetrievalPrefetch.used, "discarded": RetrievalPrefetch.discarded},
+        "scratchpad_references": ScratchpadReferences.stats(),
+        "context": context_compressor.stats() if context_compressor else None,
+        "coalescing": {flight.name: flight.stats()
+                       for flight in (embedding_flight, retrieval_flight, answer_flight, diagram_flight)},
+        "diagrams": diagram_cache.stats(),
+    }
+
+def llm_stats() -> dict:
+    """Hedged requests and fallback state of the chat model"""
+    return routed_llm.stats()
+
 # Initialize agent executor
 agent_executor = CustomAgentExecutor()
\ No newline at end of file
@@ -0,0 +1,97 @@
+# query_cache.py
+import hashlib
+import re
+import unicodedata
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from functions.cache.lru_cache import TTLLRUCache
+from functions.utils.index_version import read_index_version
+from functions.vector_index.kb_collections import current_scope
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a user question: NFC unicode, lower case, collapsed whitespace"""
+    text = unicodedata.normalize("NFC", text)
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    return text.rstrip("?.!。 ")
+
+
+def embedding_key(vector) -> str:
+    """Stable hash of a query embedding, used as part of the retrieval cache key"""
+    return hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model and caches query embeddings by normalized query text,
+    so repeated questions skip the embedding round trip entirely.
+    Document embeddings (ingestion) are passed through uncached.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: TTLLRUCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Caches (index version, query embedding, k, filters, search scope) -> retrieved chunk ids in front of another retriever.
+
+    Hits are resolved with a by-id lookup in Chroma instead of a vector search. The
+    index version is bumped by the ingestor after each commit, so new uploads make
+    stale entries unreachable without any explicit invalidation.
+    """
+    retriever: BaseRetriever
+    vectorstore: Any
+    persist_dir: str
+    cache: Any
+
+    def _search_params(self) -> tuple[int, str]:
+        search_kwargs = getattr(self.retriever, "search_kwargs", {}) or {}
+        k = getattr(self.retriever, "k", None) or search_kwargs.get("k", 4)
+        filters = search_kwargs.get("filter")
+        return k, repr(sorted(filters.items())) if isinstance(filters, dict) else repr(filters)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        k, filters = self._search_params()
+        key = (read_index_version(self.persist_dir), embedding_key(query_vector), k, filters, current_scope.get().key())
+
+        ids = self.cache.get(key)
+        if ids is not None:
+            by_id = {doc.id: doc for doc in self.vectorstore.get_by_ids(ids)}
+            if len(by_id) == len(ids):
+                return [by_id[doc_id] for doc_id in ids]
+
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if docs and all(doc.id for doc in docs):
+            self.cache.set(key, [doc.id for doc in docs])
+        return docs
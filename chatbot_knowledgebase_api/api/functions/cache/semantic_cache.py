@@ -0,0 +1,138 @@
+# semantic_cache.py
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of final answers keyed by query embedding.
+
+    A new question whose embedding is within `threshold` cosine similarity of a
+    cached question built on the same index version (and naming the same course
+    codes, which barely move the embedding) reuses the stored answer and
+    sources, skipping retrieval and the LLM completion. Entries are bounded by an
+    LRU policy and persisted to `path` (answers.json + vectors.npy) so the cache
+    survives restarts.
+    """
+
+    def __init__(self, path: str, maxsize: int = 500, threshold: float = 0.95):
+        self.path = path
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._vectors: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, query_vector, index_version: str, codes: set[str] = frozenset()) -> dict | None:
+        """Return the closest cached entry for this index version and these course codes, or None below the threshold"""
+        query = self._normalize(query_vector)
+        codes = sorted(codes)
+        with self._lock:
+            # entries stored without codes (older cache files) never match
+            keys = [key for key, entry in self._entries.items()
+                    if entry["index_version"] == index_version and entry.get("codes") == codes]
+            if keys:
+                scores = np.stack([self._vectors[key] for key in keys]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return {**self._entries[key], "similarity": float(scores[best])}
+            self.misses += 1
+            return None
+
+    def store(self, query: str, query_vector, answer: str, sources: list[str], index_version: str,
+              codes: set[str] = frozenset()):
+        """Add an answer, drop entries of older index versions and evict beyond maxsize, then persist"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry["index_version"] != index_version]:
+                del self._entries[key]
+                del self._vectors[key]
+
+            key = uuid.uuid4().hex
+            self._entries[key] = {
+                "query": query,
+                "answer": answer,
+                "sources": sources,
+                "index_version": index_version,
+                "codes": sorted(codes),
+                "created_at": time.time(),
+            }
+            self._vectors[key] = self._normalize(query_vector)
+            while len(self._entries) > self.maxsize:
+                old_key, _ = self._entries.popitem(last=False)
+                del self._vectors[old_key]
+            self._save_locked()
+
+    def load(self):
+        answers_path = os.path.join(self.path, "answers.json")
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if not (os.path.exists(answers_path) and os.path.exists(vectors_path)):
+            return
+        try:
+            with open(answers_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            vectors = np.load(vectors_path)
+            if len(vectors) != len(data["entries"]):
+                print(f"WARNING: Semantic cache files in {self.path} are out of sync - starting empty")
+                return
+            for (key, entry), vector in zip(data["entries"], vectors):
+                self._entries[key] = entry
+                self._vectors[key] = vector.astype(np.float32)
+            print(f"INFO: Loaded {len(self._entries)} semantic cache entries from {self.path}")
+        except Exception as e:
+            print(f"WARNING: Could not load semantic cache from {self.path}: {str(e)}")
+            self._entries.clear()
+            self._vectors.clear()
+
+    def _save_locked(self):
+        """Write both files to temp names and rename them so a crash never leaves a torn cache"""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            keys = list(self._entries.keys())
+            vectors_tmp = os.path.join(self.path, "vectors.tmp.npy")
+            answers_tmp = os.path.join(self.path, "answers.json.tmp")
+            if keys:
+                np.save(vectors_tmp, np.stack([self._vectors[key] for key in keys]))
+            else:
+                np.save(vectors_tmp, np.zeros((0, 0), dtype=np.float32))
+            with open(answers_tmp, "w", encoding="utf-8") as f:
+                json.dump({"entries": [[key, self._entries[key]] for key in keys]}, f, ensure_ascii=False)
+            os.replace(vectors_tmp, os.path.join(self.path, "vectors.npy"))
+            os.replace(answers_tmp, os.path.join(self.path, "answers.json"))
+        except Exception as e:
+            print(f"WARNING: Could not persist semantic cache to {self.path}: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors.clear()
+            self._save_locked()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,112 @@
+# single_flight.py
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamCall:
+    def __init__(self):
+        self.chunks: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key starts the
+    computation, callers arriving while it is in flight wait for the same result.
+    Nothing is kept once it finishes (caching is done elsewhere). The computation
+    runs in its own task, so one waiter disconnecting does not cancel it for the
+    others; it is cancelled only when no waiter is left.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: dict[Hashable, _Call] = {}
+        self._streams: dict[Hashable, _StreamCall] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(self._calls, key, call))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Like do() for an async iterator: every waiter receives all chunks, late joiners replay the ones already produced"""
+        call = self._streams.get(key)
+        if call is None:
+            call = _StreamCall()
+            self._streams[key] = call
+            call.task = asyncio.create_task(self._pump(key, call, factory))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            index = 0
+            while True:
+                while index < len(call.chunks):
+                    yield call.chunks[index]
+                    index += 1
+                if call.done:
+                    if call.error:
+                        raise call.error
+                    return
+                call.changed.clear()
+                await call.changed.wait()
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.done:
+                self._forget(self._streams, key, call)
+                call.task.cancel()
+
+    async def _pump(self, key: Hashable, call: _StreamCall, factory: Callable[[], AsyncIterator]):
+        try:
+            async for chunk in factory():
+                call.chunks.append(chunk)
+                call.changed.set()
+        except asyncio.CancelledError:
+            call.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            call.error = e
+        finally:
+            call.done = True
+            call.changed.set()
+            self._forget(self._streams, key, call)
+
+    @staticmethod
+    def _forget(calls: dict, key: Hashable, call):
+        if calls.get(key) is call:
+            del calls[key]
+
+    def stats(self) -> dict:
+        total = self.executed + self.coalesced
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
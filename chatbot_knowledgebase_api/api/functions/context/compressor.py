@@ -0,0 +1,156 @@
+# compressor.py
+import re
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from functions.cache.lru_cache import TTLLRUCache
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?。])\s+|\n+")
+_PAGE_NUMBER = re.compile(r"^(page|trang)?\s*\d+(\s*/\s*\d+)?$", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about 4 characters per token), good enough for budgeting"""
+    return (len(text) + 3) // 4
+
+
+def context_tokens(docs: list[Document]) -> int:
+    return sum(estimate_tokens(doc.page_content) for doc in docs)
+
+
+def _line_key(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _merge_overlap(first: str, second: str, max_overlap: int = 300) -> str:
+    """Concatenate two chunks, dropping the splitter overlap repeated at the start of `second`"""
+    for size in range(min(max_overlap, len(first), len(second)), 10, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+class ContextCompressor:
+    """
+    Builds the "stuff" context from retrieved chunks within a token budget.
+
+    1. lines repeated across chunks (slide headers, page footers, boilerplate) and
+       bare page numbers are kept only once,
+    2. chunks from the same source and page are merged into one, without the
+       splitter overlap,
+    3. while the context is still over `token_budget`, the sentences least similar
+       to the query embedding are dropped (sentence embeddings are cached).
+    Documents stay in retrieval order, so the best match still comes first.
+    """
+
+    def __init__(self, embeddings: Embeddings, token_budget: int = 1500, trim_sentences: bool = True,
+                 cache: TTLLRUCache | None = None):
+        self.embeddings = embeddings
+        self.token_budget = token_budget
+        self.trim_sentences = trim_sentences
+        self.cache = cache or TTLLRUCache(maxsize=4096)
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def remove_repeated_lines(self, docs: list[Document]) -> list[Document]:
+        chunk_counts = Counter()
+        for doc in docs:
+            chunk_counts.update({_line_key(line) for line in doc.page_content.splitlines() if _line_key(line)})
+
+        seen: set[str] = set()
+        result = []
+        for doc in docs:
+            lines = []
+            for line in doc.page_content.splitlines():
+                key = _line_key(line)
+                if not key:
+                    continue
+                if _PAGE_NUMBER.match(key):
+                    continue
+                if chunk_counts[key] > 1:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                lines.append(line)
+            result.append(Document(page_content="\n".join(lines), metadata=doc.metadata, id=doc.id))
+        return result
+
+    def merge_adjacent(self, docs: list[Document]) -> list[Document]:
+        merged: dict[tuple, Document] = {}
+        for doc in docs:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            if key in merged:
+                first = merged[key]
+                merged[key] = Document(page_content=_merge_overlap(first.page_content, doc.page_content),
+                                       metadata=first.metadata, id=first.id)
+            else:
+                merged[key] = doc
+        return [doc for doc in merged.values() if doc.page_content.strip()]
+
+    async def _sentence_vectors(self, sentences: list[str]) -> np.ndarray:
+        unique = list(dict.fromkeys(sentences))
+        vectors = {sentence: self.cache.get(sentence) for sentence in unique}
+        missing = [sentence for sentence, vector in vectors.items() if vector is None]
+        if missing:
+            embedded = await self.embeddings.aembed_documents(missing)
+            for sentence, vector in zip(missing, embedded):
+                vectors[sentence] = vector
+                self.cache.set(sentence, vector)
+        matrix = np.asarray([vectors[sentence] for sentence in sentences], dtype=np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    async def trim_to_budget(self, query_vector, docs: list[Document]) -> list[Document]:
+        if context_tokens(docs) <= self.token_budget:
+            return docs
+
+        doc_sentences = [[s.strip() for s in _SENTENCE_SPLIT.split(doc.page_content) if s.strip()] for doc in docs]
+        flat = [(d, i, sentence) for d, sentences in enumerate(doc_sentences) for i, sentence in enumerate(sentences)]
+        if not flat:
+            return docs
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = await self._sentence_vectors([sentence for _, _, sentence in flat]) @ query
+
+        # drop the least relevant sentences until the rest fits
+        total = sum(estimate_tokens(sentence) for _, _, sentence in flat)
+        dropped = set()
+        for index in np.argsort(scores):
+            if total <= self.token_budget:
+                break
+            dropped.add(int(index))
+            total -= estimate_tokens(flat[index][2])
+
+        kept: list[list[str]] = [[] for _ in docs]
+        for index, (d, _, sentence) in enumerate(flat):
+            if index not in dropped:
+                kept[d].append(sentence)
+        return [Document(page_content="\n".join(sentences), metadata=doc.metadata, id=doc.id)
+                for doc, sentences in zip(docs, kept) if sentences]
+
+    async def acompress(self, query_vector, docs: list[Document]) -> list[Document]:
+        if not docs:
+            return docs
+        compressed = self.merge_adjacent(self.remove_repeated_lines(docs))
+        if self.trim_sentences:
+            try:
+                compressed = await self.trim_to_budget(query_vector, compressed)
+            except Exception as e:
+                print(f"WARNING: Sentence trimming skipped: {str(e)}")
+        self.requests += 1
+        self.tokens_in += context_tokens(docs)
+        self.tokens_out += context_tokens(compressed)
+        return compressed
+
+    def stats(self) -> dict:
+        return {
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "reduction": round(1 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0,
+            "sentence_cache": self.cache.stats(),
+        }
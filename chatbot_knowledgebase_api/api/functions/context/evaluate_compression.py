@@ -0,0 +1,103 @@
+# evaluate_compression.py
+"""
+Offline evaluation of context compression on the current vector store.
+
+For each question the retrieved chunks are stuffed as-is and after compression;
+the report shows prompt tokens before/after and compression time. With
+--answers both contexts are also sent to the chat model: completion latency is
+compared and answer quality is scored as the embedding similarity between the
+answer from the full context and the one from the compressed context.
+
+Questions come from --questions (one per line); without it, the first line of
+randomly sampled chunks is used.
+
+Usage (from the api directory):
+    python -m functions.context.evaluate_compression --questions questions.txt
+    python -m functions.context.evaluate_compression --samples 20 --answers --budget 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+import agent
+from functions.context.compressor import ContextCompressor, context_tokens
+
+
+def sample_questions(count: int) -> list[str]:
+    data = agent.vectordb.get(include=["documents"])
+    lines = [doc.strip().splitlines()[0] for doc in data["documents"] if doc and doc.strip()]
+    random.Random(0).shuffle(lines)
+    return [line[:200] for line in lines[:count]]
+
+
+async def answer(question: str, docs: list) -> tuple[str, float]:
+    started = time.perf_counter()
+    result = await agent.qa_chain.combine_documents_chain.ainvoke({"input_documents": docs, "question": question})
+    return result["output_text"], time.perf_counter() - started
+
+
+def cosine(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return float(a @ b / max(float(np.linalg.norm(a) * np.linalg.norm(b)), 1e-12))
+
+
+async def evaluate(questions: list[str], compressor: ContextCompressor, with_answers: bool):
+    rows = []
+    for question in questions:
+        query_vector = await agent.embedding.aembed_query(question)
+        docs = await agent.retriever.ainvoke(question)
+        started = time.perf_counter()
+        compressed = await compressor.acompress(query_vector, docs)
+        row = {
+            "tokens_before": context_tokens(docs),
+            "tokens_after": context_tokens(compressed),
+            "compress_ms": (time.perf_counter() - started) * 1000,
+        }
+        if with_answers:
+            full_answer, row["full_s"] = await answer(question, docs)
+            short_answer, row["compressed_s"] = await answer(question, compressed)
+            vectors = await agent.embedding.embeddings.aembed_documents([full_answer, short_answer])
+            row["answer_similarity"] = cosine(vectors[0], vectors[1])
+        rows.append(row)
+        print(f"INFO: {row['tokens_before']:>5} -> {row['tokens_after']:>5} tokens  {question[:70]}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate context compression over the current store")
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--budget", type=int, default=agent.context_config['token_budget'])
+    parser.add_argument("--answers", action="store_true", help="also generate answers and compare them")
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = sample_questions(args.samples)
+    if not questions:
+        print("INFO: No questions to evaluate")
+        return
+
+    compressor = ContextCompressor(agent.embedding.embeddings, token_budget=args.budget)
+    rows = asyncio.run(evaluate(questions, compressor, args.answers))
+
+    before = sum(row["tokens_before"] for row in rows)
+    after = sum(row["tokens_after"] for row in rows)
+    print(f"\nquestions:            {len(rows)}")
+    print(f"prompt tokens:        {before} -> {after} ({(1 - after / before) * 100 if before else 0:.1f}% fewer)")
+    print(f"compression p50 ms:   {np.percentile([row['compress_ms'] for row in rows], 50):.1f}")
+    if args.answers:
+        print(f"completion p50 s:     {np.percentile([row['full_s'] for row in rows], 50):.2f} -> "
+              f"{np.percentile([row['compressed_s'] for row in rows], 50):.2f}")
+        print(f"answer similarity:    mean {np.mean([row['answer_similarity'] for row in rows]):.3f}, "
+              f"min {min(row['answer_similarity'] for row in rows):.3f}")
+
+
+if __name__ == "__main__":
+    main()
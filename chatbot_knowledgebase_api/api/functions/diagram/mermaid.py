@@ -0,0 +1,188 @@
+# mermaid.py
+import re
+
+FALLBACK_DIAGRAM = """graph TD
+    A[System] --> B[Component]
+    B --> C[Database]"""
+
+_HEADER = re.compile(r"^(graph|flowchart)(\s+(TD|TB|BT|RL|LR))?\s*;?$")
+_NODE_ID = re.compile(r"[A-Za-z0-9_][\w.]*")
+# (opener, closer), longest openers first
+_SHAPES = [
+    ("(((", ")))"), ("((", "))"), ("([", "])"), ("[[", "]]"), ("[(", ")]"), ("{{", "}}"),
+    ("[/", "/]"), ("[/", "\\]"), ("[\\", "\\]"), ("[\\", "/]"), ("[", "]"), ("(", ")"), ("{", "}"), (">", "]"),
+]
+_ARROW = r"<?(?:-{2,}>|-{3,}|={2,}>|={3,}|-\.+->|-\.+-|--[ox]|==[ox])"
+_TEXT_ARROW = r"<?(?:--|==|-\.)\s+[^|\s][^|]*?\s+(?:-{2,}>|-{3,}|={2,}>|={3,}|\.->|\.-)"
+_EDGE = re.compile(rf"\s*(?:{_ARROW}|{_TEXT_ARROW})\s*(?:\|[^|]*\|)?\s*")
+_AMPERSAND = re.compile(r"\s*&\s*")
+_CLASS_SUFFIX = re.compile(r":::[\w-]+")
+_SPECIAL_LABEL_CHARS = set("()[]{}<>|\"")
+_DIRECTIVES = {
+    "subgraph": re.compile(r"^subgraph\s+\S.*$"),
+    "end": re.compile(r"^end\s*;?$"),
+    "direction": re.compile(r"^direction\s+(TD|TB|BT|RL|LR)\s*;?$"),
+    "classDef": re.compile(r"^classDef\s+[\w,-]+\s+\S.*$"),
+    "class": re.compile(r"^class\s+[\w,.-]+\s+[\w-]+\s*;?$"),
+    "style": re.compile(r"^style\s+[\w.-]+\s+\S.*$"),
+    "linkStyle": re.compile(r"^linkStyle\s+(default|[\d,\s]+)\s+\S.*$"),
+    "click": re.compile(r"^click\s+[\w.-]+\s+\S.*$"),
+}
+
+
+def strip_code_fence(text: str) -> str:
+    """Remove ```mermaid fences around an LLM answer"""
+    content = text.strip()
+    if content.startswith('```mermaid'):
+        content = content[10:]
+    if content.startswith('```'):
+        content = content[3:]
+    if content.endswith('```'):
+        content = content[:-3]
+    return content.strip()
+
+
+def _find_closer(line: str, start: int, closer: str) -> int:
+    """Position of the closer that ends the node: the first one followed by an edge, '&', ':::', ';' or end of line"""
+    candidates = [m.start() for m in re.finditer(re.escape(closer), line[start:])]
+    for candidate in candidates:
+        rest = line[start + candidate + len(closer):]
+        if not rest.strip() or rest.strip() == ";" or _EDGE.match(rest) or _AMPERSAND.match(rest) \
+                or rest.startswith(":::"):
+            return start + candidate
+    return start + candidates[0] if candidates else -1
+
+
+def _parse_node(line: str, pos: int, line_no: int, errors: list[str]) -> tuple[int, str] | None:
+    """Parse one node at `pos`; returns (end position, node text with labels quoted when needed)"""
+    match = _NODE_ID.match(line, pos)
+    if not match:
+        errors.append(f"line {line_no}: expected a node id at '{line[pos:pos + 20]}'")
+        return None
+    node_id = match.group(0)
+    if node_id == "end":
+        errors.append(f"line {line_no}: 'end' cannot be used as a node id")
+    pos = match.end()
+    text = node_id
+
+    for opener, closer in _SHAPES:
+        if not line.startswith(opener, pos):
+            continue
+        label_start = pos + len(opener)
+        if line.startswith('"', label_start):
+            quote_end = line.find('"', label_start + 1)
+            if quote_end == -1 or not line.startswith(closer, quote_end + 1):
+                continue
+            text += line[pos:quote_end + 1 + len(closer)]
+            pos = quote_end + 1 + len(closer)
+            break
+        close = _find_closer(line, label_start, closer)
+        if close == -1:
+            continue
+        label = line[label_start:close]
+        if any(char in _SPECIAL_LABEL_CHARS for char in label):
+            errors.append(f"line {line_no}: label of node {node_id} has unquoted special characters: {label}")
+            label = '"' + label.replace('"', "#quot;") + '"'
+        text += f"{opener}{label}{closer}"
+        pos = close + len(closer)
+        break
+    else:
+        if pos < len(line) and line[pos] in "[({>":
+            errors.append(f"line {line_no}: unclosed shape for node {node_id}")
+            return None
+
+    class_match = _CLASS_SUFFIX.match(line, pos)
+    if class_match:
+        text += class_match.group(0)
+        pos = class_match.end()
+    return pos, text
+
+
+def _parse_statement(line: str, line_no: int, errors: list[str]) -> str:
+    """Validate a node/edge statement and return it with labels quoted when needed"""
+    pos = 0
+    parts = []
+    while True:
+        node = _parse_node(line, pos, line_no, errors)
+        if node is None:
+            return line
+        pos, text = node
+        parts.append(text)
+        rest = line[pos:]
+        if not rest.strip() or rest.strip() == ";":
+            return "".join(parts)
+        separator = _EDGE.match(line, pos) or _AMPERSAND.match(line, pos)
+        if not separator:
+            errors.append(f"line {line_no}: unexpected text '{rest.strip()[:30]}'")
+            return line
+        pos = separator.end()
+        if pos >= len(line) or not line[pos:].strip():
+            errors.append(f"line {line_no}: edge without a target node")
+            return line
+        parts.append(f" {separator.group(0).strip()} ")
+
+
+def check_mermaid(code: str) -> tuple[list[str], str]:
+    """
+    Validate a Mermaid flowchart: header, node and edge syntax, bracket/label
+    quoting and subgraph/end balance. Returns (errors, code with special-character
+    labels quoted), the second being a local fix for the most common LLM mistake.
+    """
+    errors: list[str] = []
+    lines = [line.strip() for line in code.strip().splitlines()]
+    fixed: list[str] = []
+    header_seen = False
+    depth = 0
+    for line_no, line in enumerate(lines, start=1):
+        if not line or line.startswith("%%"):
+            fixed.append(line)
+            continue
+        if not header_seen:
+            if not _HEADER.match(line):
+                errors.append(f"line {line_no}: diagram must start with 'graph' or 'flowchart' and a direction")
+            header_seen = True
+            fixed.append(line)
+            continue
+
+        keyword = line.split()[0]
+        if keyword in _DIRECTIVES:
+            if not _DIRECTIVES[keyword].match(line):
+                errors.append(f"line {line_no}: invalid {keyword} declaration")
+            depth += keyword == "subgraph"
+            if keyword == "end":
+                depth -= 1
+                if depth < 0:
+                    errors.append(f"line {line_no}: 'end' without subgraph")
+                    depth = 0
+            fixed.append(line)
+            continue
+        fixed.append(_parse_statement(line, line_no, errors))
+
+    if not header_seen:
+        errors.append("diagram is empty")
+    if depth > 0:
+        errors.append(f"{depth} subgraph(s) not closed with 'end'")
+    return errors, "\n".join(fixed)
+
+
+def validate_mermaid(code: str) -> list[str]:
+    return check_mermaid(code)[0]
+
+
+def clean_mermaid(text: str) -> str:
+    """Normalize an LLM answer into Mermaid code (fences removed, graph header, tidy spacing)"""
+    content = strip_code_fence(text)
+
+    # Ensure it starts with graph declaration
+    if not content.startswith(('graph', 'flowchart')):
+        content = f"graph TD\n{content}"
+
+    cleaned_lines = []
+    for line in content.split('\n'):
+        line = line.strip()
+        if line:
+            # Remove extra spaces
+            while '  ' in line:
+                line = line.replace('  ', ' ')
+            cleaned_lines.append(line)
+    return '\n'.join(cleaned_lines)
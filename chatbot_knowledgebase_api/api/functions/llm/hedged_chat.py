@@ -0,0 +1,181 @@
+# hedged_chat.py
+import asyncio
+import time
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from functions.utils.metrics import get_latency
+
+
+def _model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or model._llm_type
+
+
+async def _close(iterator, task: asyncio.Task | None = None):
+    """Stop a losing stream: cancel its pending read and close the underlying HTTP response"""
+    if task and not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+    try:
+        await iterator.aclose()
+    except Exception:
+        pass
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Chat model wrapper adding request hedging and latency-based fallback.
+
+    Hedging: when the first chunk has not arrived within the `hedge_percentile`
+    of recent time-to-first-token (at least `hedge_min_delay` seconds, and only
+    once `min_samples` are known), a duplicate request is started and whichever
+    stream produces its first chunk first is used; the other one is cancelled.
+
+    Fallback: when the rolling p95 time-to-first-token of the primary model goes
+    above `fallback_threshold` seconds, new requests use `fallback` for
+    `fallback_cooldown` seconds; the primary's window is then reset and it is
+    tried again.
+    """
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+    hedging: bool = False
+    hedge_percentile: float = 95
+    hedge_min_delay: float = 1.0
+    min_samples: int = 20
+    fallback_threshold: float = 0
+    fallback_cooldown: float = 300
+
+    _fallback_until: float = PrivateAttr(default=0.0)
+    _hedged: int = PrivateAttr(default=0)
+    _hedge_wins: int = PrivateAttr(default=0)
+    _fallback_activations: int = PrivateAttr(default=0)
+    _fallback_requests: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        # same OpenAI tool format for both models, so reuse the primary's conversion
+        return self.bind(**self.primary.bind_tools(tools, **kwargs).kwargs)
+
+    def _ttft(self, model: BaseChatModel):
+        return get_latency(f"llm_{_model_name(model)}_ttft")
+
+    def _select_model(self) -> BaseChatModel:
+        if self.fallback is not None and time.monotonic() < self._fallback_until:
+            self._fallback_requests += 1
+            return self.fallback
+        return self.primary
+
+    def _hedge_deadline(self, model: BaseChatModel) -> float | None:
+        if not self.hedging:
+            return None
+        latency = self._ttft(model).percentile(self.hedge_percentile, min_samples=self.min_samples)
+        if latency is None:
+            return None
+        return max(self.hedge_min_delay, latency)
+
+    def _observe_ttft(self, model: BaseChatModel, seconds: float):
+        stats = self._ttft(model)
+        stats.observe(seconds)
+        if model is not self.primary or self.fallback is None or self.fallback_threshold <= 0:
+            return
+        if (stats.percentile(95, min_samples=self.min_samples) or 0) > self.fallback_threshold:
+            self._fallback_until = time.monotonic() + self.fallback_cooldown
+            self._fallback_activations += 1
+            stats.reset()
+            print(f"WARNING: {_model_name(self.primary)} p95 first-token latency above {self.fallback_threshold}s - "
+                  f"using {_model_name(self.fallback)} for {self.fallback_cooldown}s")
+
+    async def _first_chunk(self, model, messages, stop, kwargs):
+        """Start the stream (and a hedge if it is slow); returns (iterator, first chunk or None)"""
+        started = time.perf_counter()
+        primary = model._astream(messages, stop=stop, **kwargs).__aiter__()
+        first = asyncio.ensure_future(primary.__anext__())
+        candidates = {first: primary}
+
+        deadline = self._hedge_deadline(model)
+        if deadline is not None:
+            done, _ = await asyncio.wait({first}, timeout=deadline)
+            if not done:
+                self._hedged += 1
+                hedge = model._astream(messages, stop=stop, **kwargs).__aiter__()
+                candidates[asyncio.ensure_future(hedge.__anext__())] = hedge
+
+        pending = set(candidates)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None and not isinstance(task.exception(), StopAsyncIteration):
+                        if pending:
+                            continue  # the other request may still succeed
+                        raise task.exception()
+                    winner = candidates[task]
+                    if task is not first:
+                        self._hedge_wins += 1
+                    for other, iterator in candidates.items():
+                        if other is not task:
+                            await _close(iterator, other)
+                    self._observe_ttft(model, time.perf_counter() - started)
+                    chunk = None if isinstance(task.exception(), StopAsyncIteration) else task.result()
+                    return winner, chunk
+        except BaseException:
+            for task, iterator in candidates.items():
+                await _close(iterator, task)
+            raise
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        model = self._select_model()
+        iterator, chunk = await self._first_chunk(model, messages, stop, kwargs)
+        try:
+            if chunk is None:
+                return
+            # only the winning stream reaches the callbacks (on_llm_new_token, as ChatOpenAI streaming did)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            async for chunk in iterator:
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            await _close(iterator)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        # sync callers (none on the request path) go straight to the selected model
+        yield from self._select_model()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return self._select_model()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "primary": _model_name(self.primary),
+            "fallback": _model_name(self.fallback) if self.fallback is not None else None,
+            "hedging": self.hedging,
+            "hedge_deadline_s": self._hedge_deadline(self.primary),
+            "hedged": self._hedged,
+            "hedge_wins": self._hedge_wins,
+            "fallback_active": time.monotonic() < self._fallback_until,
+            "fallback_activations": self._fallback_activations,
+            "fallback_requests": self._fallback_requests,
+        }
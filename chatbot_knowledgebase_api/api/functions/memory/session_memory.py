@@ -0,0 +1,142 @@
+# session_memory.py
+import asyncio
+import secrets
+import threading
+from typing import Awaitable, Callable
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from functions.cache.lru_cache import TTLLRUCache
+
+# (previous summary, turns being dropped) -> new summary
+Summarizer = Callable[[str, list[BaseMessage]], Awaitable[str]]
+
+
+class SessionHistory:
+    """Recent turns of one conversation plus a running summary of the older ones"""
+
+    def __init__(self):
+        self.summary = ""
+        self.turns: list[tuple[HumanMessage, AIMessage]] = []
+        self.lock = threading.Lock()
+        # summaries of one session are produced one after another so none is lost
+        self.summary_lock = asyncio.Lock()
+
+    def messages(self) -> list[BaseMessage]:
+        with self.lock:
+            messages: list[BaseMessage] = []
+            if self.summary:
+                messages.append(SystemMessage(content=f"Tóm tắt cuộc hội thoại trước đó:\n{self.summary}"))
+            for human, ai in self.turns:
+                messages.extend([human, ai])
+            return messages
+
+
+class SessionMemory:
+    """
+    Conversation history per client session, kept in a bounded LRU with TTL.
+
+    Each session is held under `token_budget` (approximate tokens of summary + turns).
+    When a new turn pushes it over, the oldest turns are removed right away so the
+    next prompt stays within budget; if a `summarizer` is set they are folded into
+    the session summary in the background instead of being forgotten.
+
+    Session ids are issued by the server (create / resolve) and are unguessable;
+    an id the server did not issue, or one that has expired, never gets a
+    session, so a client cannot read or extend someone else's conversation.
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 86400, token_budget: int = 2000,
+                 summarizer: Summarizer | None = None):
+        self.sessions = TTLLRUCache(maxsize=maxsize, ttl=ttl)
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.trimmed_turns = 0
+        self.summaries = 0
+        self.rejected_ids = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    def create(self) -> str:
+        """Start an empty session under a new server-issued id"""
+        session_id = secrets.token_urlsafe(32)
+        self.sessions.set(session_id, SessionHistory())
+        return session_id
+
+    def resolve(self, session_id: str | None) -> str:
+        """Session id to use for a request: the given one when it is live, otherwise a newly issued one"""
+        if session_id and self.sessions.get(session_id) is not None:
+            return session_id
+        if session_id:
+            self.rejected_ids += 1
+        return self.create()
+
+    def history(self, session_id: str | None) -> list[BaseMessage]:
+        """Messages to put in the prompt's chat_history ([] for requests without a session)"""
+        if not session_id:
+            return []
+        session = self.sessions.get(session_id)
+        return session.messages() if session else []
+
+    def add_turn(self, session_id: str | None, question: str, answer: str):
+        if not session_id:
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            # not issued by resolve(), or expired during the request
+            return
+        with session.lock:
+            session.turns.append((HumanMessage(content=question), AIMessage(content=answer)))
+            dropped = self._trim_locked(session)
+        # set after every turn so active sessions stay fresh in the LRU/TTL
+        self.sessions.set(session_id, session)
+
+        if dropped and self.summarizer:
+            task = asyncio.create_task(self._summarize(session, dropped))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _tokens_locked(self, session: SessionHistory) -> int:
+        messages = [message for turn in session.turns for message in turn]
+        summary_tokens = count_tokens_approximately([SystemMessage(content=session.summary)]) if session.summary else 0
+        return summary_tokens + count_tokens_approximately(messages)
+
+    def _trim_locked(self, session: SessionHistory) -> list[BaseMessage]:
+        """Drop the oldest turns (always keeping the newest) until the session fits its budget"""
+        dropped: list[BaseMessage] = []
+        while len(session.turns) > 1 and self._tokens_locked(session) > self.token_budget:
+            dropped.extend(session.turns.pop(0))
+            self.trimmed_turns += 1
+        return dropped
+
+    async def _summarize(self, session: SessionHistory, dropped: list[BaseMessage]):
+        async with session.summary_lock:
+            with session.lock:
+                previous = session.summary
+            try:
+                summary = await self.summarizer(previous, dropped)
+            except Exception as e:
+                print(f"WARNING: Could not summarize conversation history: {str(e)}")
+                return
+            self._apply_summary(session, summary)
+
+    def _apply_summary(self, session: SessionHistory, summary: str):
+        with session.lock:
+            session.summary = summary.strip()
+            # a long summary must not push the session over budget either
+            while session.summary and self._tokens_locked(session) > self.token_budget:
+                if len(session.turns) > 1:
+                    session.turns.pop(0)
+                    self.trimmed_turns += 1
+                else:
+                    session.summary = session.summary[:len(session.summary) // 2]
+        self.summaries += 1
+
+    def stats(self) -> dict:
+        return {
+            **self.sessions.stats(),
+            "token_budget": self.token_budget,
+            "trimmed_turns": self.trimmed_turns,
+            "summaries": self.summaries,
+            "rejected_ids": self.rejected_ids,
+        }
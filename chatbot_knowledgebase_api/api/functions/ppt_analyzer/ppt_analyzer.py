@@ -5,6 +5,7 @@ import ssl
 import re
 
 from langchain_openai import ChatOpenAI
+from functions.utils.http_clients import get_async_client, get_sync_client
 from langchain_community.document_loaders import UnstructuredPowerPointLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
@@ -23,7 +24,9 @@ class PPTAnalyzer:
         self.prompt_md_path = prompt_md_path
         os.environ["OPENAI_API_KEY"] = openai_api_key
 
-        self.llm = ChatOpenAI(model=model_name, temperature=0.3, request_timeout=300)
+        # shared connection pool instead of a new client (and TLS handshake) per analyzer
+        self.llm = ChatOpenAI(model=model_name, temperature=0.3, request_timeout=300,
+                              http_client=get_sync_client(), http_async_client=get_async_client())
 
     def load_prompt_from_md(self):
         """Đọc prompt từ file markdown"""
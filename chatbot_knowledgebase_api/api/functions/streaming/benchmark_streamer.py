@@ -0,0 +1,92 @@
+# benchmark_streamer.py
+"""
+Inter-token latency of the /invoke streamer under concurrent streams.
+
+Each simulated stream receives tokens at LLM-like intervals; the delay between
+a token being queued and the consumer receiving it is measured for the previous
+polling iterator (checks queue.empty() and sleeps 100 ms) and for the current
+event-driven QueueCallbackHandler. No model or vector store is used.
+
+Usage (from the api directory):
+    python -m functions.streaming.benchmark_streamer
+    python -m functions.streaming.benchmark_streamer --streams 50 --tokens 100 --interval-ms 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from functions.streaming.streamer import STREAM_DONE, QueueCallbackHandler
+
+
+class PollingQueueIterator:
+    """Previous QueueCallbackHandler.__aiter__, kept as the benchmark baseline"""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def __aiter__(self):
+        while True:
+            if self.queue.empty():
+                await asyncio.sleep(0.1)
+                continue
+            token_or_done = await self.queue.get()
+            if token_or_done == STREAM_DONE:
+                return
+            if token_or_done:
+                yield token_or_done
+
+
+async def produce(queue: asyncio.Queue, tokens: int, interval: float, rng: random.Random):
+    for _ in range(tokens):
+        await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+        queue.put_nowait(time.perf_counter())
+    queue.put_nowait(STREAM_DONE)
+
+
+async def consume(stream, delays: list[float]):
+    async for queued_at in stream:
+        delays.append(time.perf_counter() - queued_at)
+
+
+async def run(mode: str, streams: int, tokens: int, interval: float) -> dict:
+    rng = random.Random(0)
+    delays: list[float] = []
+    jobs = []
+    started = time.perf_counter()
+    for _ in range(streams):
+        queue: asyncio.Queue = asyncio.Queue()
+        stream = PollingQueueIterator(queue) if mode == "polling" else QueueCallbackHandler(queue)
+        jobs.append(produce(queue, tokens, interval, rng))
+        jobs.append(consume(stream, delays))
+    await asyncio.gather(*jobs)
+    samples = np.array(delays) * 1000
+    return {
+        "mode": mode,
+        "tokens": len(samples),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "max_ms": float(samples.max()),
+        "wall_s": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streamer latency under concurrent streams")
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--interval-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    print(f"INFO: {args.streams} concurrent streams, {args.tokens} tokens each, ~{args.interval_ms} ms between tokens")
+    print(f"{'mode':>8} {'tokens':>7} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'wall_s':>7}")
+    for mode in ("polling", "event"):
+        result = asyncio.run(run(mode, args.streams, args.tokens, args.interval_ms / 1000))
+        print(f"{result['mode']:>8} {result['tokens']:>7} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['max_ms']:>8.2f} {result['wall_s']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
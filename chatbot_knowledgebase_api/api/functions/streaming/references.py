@@ -0,0 +1,112 @@
+# references.py
+import json
+import re
+
+from langchain_core.messages import ToolMessage
+
+REFERENCE_PATTERN = re.compile(r"\[\[ref:(\w+)\]\]")
+_REFERENCE_PREFIX = "[[ref:"
+_MAX_REFERENCE_LENGTH = 64
+
+
+class ScratchpadReferences:
+    """
+    Large tool outputs of one agent run, kept server-side.
+
+    compact() stores a tool output and returns a short ToolMessage for the
+    scratchpad; the model writes [[ref:ID]] wherever it wants the full content,
+    and expand() / ReferenceSplicer put it back before tools run and while the
+    final answer streams, so the content is neither re-sent to nor re-generated
+    by the LLM.
+    """
+    compacted = 0
+    compacted_chars = 0
+    spliced = 0
+
+    def __init__(self, min_chars: int = 500, excerpt_chars: int = 300):
+        self.min_chars = min_chars
+        self.excerpt_chars = excerpt_chars
+        self.contents: dict[str, str] = {}
+
+    def compact(self, tool_name: str, message: ToolMessage) -> ToolMessage:
+        content = f"{message.content}"
+        if len(content) < self.min_chars:
+            return message
+        ref_id = f"{tool_name}_{len(self.contents) + 1}"
+        self.contents[ref_id] = content
+        ScratchpadReferences.compacted += 1
+        ScratchpadReferences.compacted_chars += len(content)
+        excerpt = content[:self.excerpt_chars].rstrip()
+        return ToolMessage(
+            content=(f"[[ref:{ref_id}]] ({len(content)} ký tự, đã lưu phía máy chủ)\n"
+                     f"Trích đoạn:\n{excerpt}..."),
+            tool_call_id=message.tool_call_id,
+        )
+
+    def resolve(self, ref_id: str) -> str | None:
+        content = self.contents.get(ref_id)
+        if content is not None:
+            ScratchpadReferences.spliced += 1
+        return content
+
+    def expand(self, text: str) -> str:
+        def replace(match: re.Match) -> str:
+            content = self.resolve(match.group(1))
+            return content if content is not None else match.group(0)
+        return REFERENCE_PATTERN.sub(replace, text)
+
+    def expand_args(self, args: dict) -> dict:
+        return {key: self.expand(value) if isinstance(value, str) else value for key, value in args.items()}
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"compacted": cls.compacted, "compacted_chars": cls.compacted_chars, "spliced": cls.spliced}
+
+
+class ReferenceSplicer:
+    """
+    Replaces [[ref:ID]] in streamed tool-call arguments with the JSON-escaped
+    referenced content. Text that may be the start of a reference split across
+    fragments is held back until it can be resolved.
+    """
+
+    def __init__(self, references: ScratchpadReferences):
+        self.references = references
+        self._buffer = ""
+
+    def feed(self, fragment: str) -> str:
+        text = self._buffer + fragment
+        self._buffer = ""
+        out = []
+        pos = 0
+        while True:
+            start = text.find("[", pos)
+            if start == -1:
+                out.append(text[pos:])
+                break
+            out.append(text[pos:start])
+            rest = text[start:]
+            match = REFERENCE_PATTERN.match(rest)
+            if match:
+                content = self.references.resolve(match.group(1))
+                out.append(json.dumps(content, ensure_ascii=False)[1:-1] if content is not None else match.group(0))
+                pos = start + match.end()
+            elif self._may_complete(rest):
+                self._buffer = rest
+                break
+            else:
+                out.append("[")
+                pos = start + 1
+        return "".join(out)
+
+    def flush(self) -> str:
+        text, self._buffer = self._buffer, ""
+        return text
+
+    @staticmethod
+    def _may_complete(text: str) -> bool:
+        if len(text) <= len(_REFERENCE_PREFIX):
+            return _REFERENCE_PREFIX.startswith(text)
+        if not text.startswith(_REFERENCE_PREFIX) or len(text) > _MAX_REFERENCE_LENGTH:
+            return False
+        return re.fullmatch(r"\w*\]?", text[len(_REFERENCE_PREFIX):]) is not None
@@ -0,0 +1,104 @@
+# streamer.py
+import asyncio
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+
+# Queue markers shared by the agent executor and the /invoke generators
+STEP_END = "<<STEP_END>>"
+STREAM_DONE = "<<DONE>>"
+
+
+class QueueCallbackHandler(AsyncCallbackHandler):
+    """
+    Bridges LLM callbacks to the /invoke response through an asyncio.Queue.
+
+    Iteration awaits the queue directly, so each token is forwarded as soon as it
+    is produced and an idle stream does not wake the event loop. The stream ends
+    on STREAM_DONE, or after `idle_timeout` seconds without any item (then
+    `timed_out` is set so the caller can cancel the producer). `disconnected`
+    is set by /invoke when the client went away, and `token_count` counts the
+    chunks streamed so far for the cancellation metrics. When `argument_filter`
+    is set (see ReferenceSplicer), streamed tool-call arguments pass through it.
+    """
+
+    def __init__(self, queue: asyncio.Queue, idle_timeout: float | None = None):
+        self.queue = queue
+        self.idle_timeout = idle_timeout or None
+        self.final_answer_seen = False
+        self.timed_out = False
+        self.disconnected = False
+        self.token_count = 0
+        self.argument_filter = None
+
+    async def __aiter__(self):
+        while True:
+            try:
+                token_or_done = await asyncio.wait_for(self.queue.get(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out = True
+                print(f"WARNING: No token received for {self.idle_timeout}s - closing stream")
+                return
+            if token_or_done == STREAM_DONE:
+                return
+            if token_or_done:
+                yield token_or_done
+
+    async def on_llm_new_token(self, *args, **kwargs) -> None:
+        chunk = kwargs.get("chunk")
+        if chunk and chunk.message.additional_kwargs.get("tool_calls"):
+            if chunk.message.additional_kwargs["tool_calls"][0]["function"]["name"] == "final_answer":
+                self.final_answer_seen = True
+            if self.argument_filter:
+                chunk = self._filter_arguments(chunk)
+        self.token_count += 1
+        self.queue.put_nowait(chunk)
+
+    def _filter_arguments(self, chunk: ChatGenerationChunk) -> ChatGenerationChunk:
+        tool_call = chunk.message.additional_kwargs["tool_calls"][0]
+        function = tool_call["function"]
+        arguments = self.argument_filter.feed(function.get("arguments") or "")
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content=chunk.message.content,
+            additional_kwargs={"tool_calls": [{**tool_call, "function": {**function, "arguments": arguments}}]},
+        ))
+
+    async def on_llm_end(self, *args, **kwargs) -> None:
+        if self.argument_filter:
+            if pending := self.argument_filter.flush():
+                self.emit_tool_call_chunk(None, pending)
+        if self.final_answer_seen:
+            self.finish()
+        else:
+            self.queue.put_nowait(STEP_END)
+
+    def finish(self) -> None:
+        """Signal end of stream; safe to call more than once"""
+        self.queue.put_nowait(STREAM_DONE)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.timed_out or self.disconnected
+
+    def discard(self) -> None:
+        """Drop queued tokens nobody will read after the stream was cancelled"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def emit_event(self, event: str, data: dict) -> None:
+        """Queue a named out-of-band event (e.g. sources) for clients that accept event streams"""
+        self.queue.put_nowait({"event": event, "data": data})
+
+    def emit_tool_call_chunk(self, name: str | None, arguments: str, call_id: str | None = None) -> None:
+        """Queue a tool-call chunk produced server-side, so it streams like the agent's own tool calls"""
+        self.token_count += 1
+        self.queue.put_nowait(ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            additional_kwargs={"tool_calls": [{
+                "index": 0,
+                "id": call_id,
+                "type": "function",
+                "function": {"name": name, "arguments": arguments},
+            }]},
+        )))
@@ -0,0 +1,137 @@
+# admission.py
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from functions.utils.metrics import LatencyStats
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted slot; release() is idempotent so every exit path may call it"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.perf_counter() - self._started)
+
+
+class AdmissionController:
+    """
+    Concurrency limiter for /invoke with a bounded, per-client fair wait queue.
+
+    At most `max_concurrent` requests run at once. Others wait in a per-client FIFO
+    and freed slots are handed out round-robin across clients, so one client
+    sending many requests cannot starve the rest. A request is rejected right away
+    when the queue (or its client's share of it) is full, or after waiting
+    `max_wait` seconds; the rejection carries a Retry-After estimate.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 32, max_queue_per_client: int = 4,
+                 max_wait: float = 30):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.rejected: dict[str, int] = {}
+        self.wait_time = LatencyStats()
+        self.service_time = LatencyStats()
+
+    def retry_after(self) -> int:
+        """Seconds until a queued request would likely get a slot, from the recent service time"""
+        service = self.service_time.percentile(50) or 5.0
+        return max(1, math.ceil(service * (self.queued + 1) / max(self.max_concurrent, 1)))
+
+    def _reject(self, reason: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, client_id: str) -> AdmissionTicket:
+        started = time.perf_counter()
+        if self.active < self.max_concurrent and not self.queued:
+            return self._admit(started)
+
+        if self.queued >= self.max_queue:
+            self._reject("queue_full")
+        waiters = self._waiters.get(client_id)
+        if waiters and len(waiters) >= self.max_queue_per_client:
+            self._reject("client_queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # the slot was granted just as we gave up: hand it to the next waiter
+                self._release(None)
+            else:
+                future.cancel()
+                self._remove_waiter(client_id, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject("wait_timeout")
+        return self._admit(started, counted=True)
+
+    def _admit(self, started: float, counted: bool = False) -> AdmissionTicket:
+        if not counted:
+            self.active += 1
+        self.admitted += 1
+        self.wait_time.observe(time.perf_counter() - started)
+        return AdmissionTicket(self)
+
+    def _remove_waiter(self, client_id: str, future: asyncio.Future):
+        waiters = self._waiters.get(client_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters:
+                del self._waiters[client_id]
+
+    def _release(self, service_seconds: float | None):
+        if service_seconds is not None:
+            self.service_time.observe(service_seconds)
+        # hand the slot straight to the next client in round-robin order
+        while self._waiters:
+            client_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiters.move_to_end(client_id)
+            else:
+                del self._waiters[client_id]
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_clients": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait": self.wait_time.stats(),
+            "service": self.service_time.stats(),
+        }
@@ -49,6 +49,17 @@ def load_proxy_config():
         print(f"Error reading proxy config: {e} - proxy disabled")
         return None
 
+def get_int_option(config: configparser.ConfigParser, section: str, key: str, default: int = 0) -> int:
+    """Integer option read on its own: an invalid value falls back to `default` with a warning"""
+    raw = config.get(section, key, fallback='').strip()
+    if raw == '':
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        print(f"WARNING: Invalid value {raw!r} for {key} in [{section}] config - using default {default!r}")
+        return default
+
 def load_model_config():
     """Load model configuration from ./config/config file"""
     import os
@@ -84,6 +95,8 @@ def load_model_config():
         embedding_model = config.get('embedding_model', 'model', fallback='text-embedding-3-small')
         embedding_base_url = config.get('embedding_model', 'base_url', fallback='')
         embedding_api_key = config.get('embedding_model', 'openai_api_key', fallback='')
+        # Shortened vector size used for the coarse search stage (0 = full size)
+        embedding_search_dimensions = get_int_option(config, 'embedding_model', 'search_dimensions', 0)
         
         # Fall back to environment variable if not in config
         if not llm_api_key:
@@ -96,6 +109,7 @@ def load_model_config():
             'llm_base_url': llm_base_url,
             'embedding_model': embedding_model,
             'embedding_base_url': embedding_base_url,
+            'embedding_search_dimensions': embedding_search_dimensions,
             'temperature': temperature,
             'openai_api_key': llm_api_key,
             'embedding_api_key': embedding_api_key
@@ -107,7 +121,52 @@ def load_model_config():
             'llm_base_url': '',
             'embedding_model': 'text-embedding-3-small',
             'embedding_base_url': '',
+            'embedding_search_dimensions': 0,
             'temperature': 0.0,
             'openai_api_key': os.environ.get("OPENAI_API_KEY", ""),
             'embedding_api_key': os.environ.get("OPENAI_API_KEY", "")
-        }
\ No newline at end of file
+        }
+
+def load_section_config(section: str, defaults: dict):
+    """
+    Load one section of ./config/config, coercing values to the types of `defaults`
+    (a value that cannot be coerced falls back to its default, the other keys are kept)
+    """
+    import os
+    values = dict(defaults)
+    try:
+        config = configparser.ConfigParser()
+        config_paths = [
+            './config/config',           # When running from api directory
+            './api/config/config',       # When running from parent directory
+            'api/config/config',         # Alternative path
+            os.path.join(os.path.dirname(__file__), '../../config/config')  # Relative to this file
+        ]
+
+        for config_path in config_paths:
+            if os.path.exists(config_path):
+                config.read(config_path)
+                break
+
+        if not config.has_section(section):
+            return values
+
+        for key, default in defaults.items():
+            raw = config.get(section, key, fallback='').strip()
+            if raw == '':
+                continue
+            try:
+                if isinstance(default, bool):
+                    values[key] = raw.lower() in ('1', 'true', 'yes', 'on')
+                elif isinstance(default, int):
+                    values[key] = int(raw)
+                elif isinstance(default, float):
+                    values[key] = float(raw)
+                else:
+                    values[key] = raw
+            except ValueError:
+                print(f"WARNING: Invalid value {raw!r} for {key} in [{section}] config - using default {default!r}")
+        return values
+    except Exception as e:
+        print(f"Error reading [{section}] config: {e} - using defaults")
+        return dict(defaults)
@@ -0,0 +1,187 @@
+# file_response.py
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from functions.utils.common import load_section_config
+
+# Course material types, registered explicitly so the result does not depend on the host's mime.types / registry
+for _extension, _media_type in {
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".ppt": "application/vnd.ms-powerpoint",
+    ".pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    ".xls": "application/vnd.ms-excel",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv",
+    ".md": "text/markdown",
+    ".txt": "text/plain",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}.items():
+    mimetypes.add_type(_media_type, _extension)
+
+
+# Types served with their own media type and shown inline on request: a browser cannot run script from them.
+# Anything else (HTML, SVG, XML, Office files, ...) is sent as an application/octet-stream attachment, since
+# uploads are not restricted by extension and the files are served from the API origin.
+SAFE_MEDIA_TYPES = {"application/pdf", "image/png", "image/jpeg", "text/plain"}
+
+
+def load_download_config() -> dict:
+    return load_section_config('download', {
+        'cache_max_age': 0,
+        'chunk_size': 262144,
+        'accel_redirect_header': '',
+        'accel_redirect_prefix': '/protected/public_data/',
+    })
+
+
+def media_type_for(filename: str) -> str:
+    media_type, _ = mimetypes.guess_type(filename)
+    if media_type is None:
+        return "application/octet-stream"
+    if media_type.startswith("text/") and "charset" not in media_type:
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def download_media_type(filename: str, inline: bool = False) -> tuple[str, bool]:
+    """Media type and inline flag actually sent for a download (see SAFE_MEDIA_TYPES)"""
+    media_type = media_type_for(filename)
+    if media_type.split(";")[0] in SAFE_MEDIA_TYPES:
+        return media_type, inline
+    return "application/octet-stream", False
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong validator from size and nanosecond mtime (no file read; changes whenever the file is rewritten)"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for this header)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+def is_not_modified(headers: Headers, etag: str, mtime: float) -> bool:
+    """Conditional GET: If-None-Match wins; If-Modified-Since is only used without it"""
+    if "if-none-match" in headers:
+        return etag_matches(headers["if-none-match"], etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def content_disposition(filename: str, inline: bool = False) -> str:
+    disposition = "inline" if inline else "attachment"
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+class DownloadResponse(FileResponse):
+    """
+    FileResponse with a strong ETag, 304 answers to conditional requests and
+    zero-copy transfer when the ASGI server offers it.
+
+    Range / If-Range handling (206, multipart ranges, 416) comes from Starlette.
+    Servers advertising `http.response.zerocopysend` get the file descriptor
+    with offset and count (sendfile); `http.response.pathsend` is used by
+    Starlette for full responses; otherwise the file is streamed in `chunk_size`
+    reads.
+    """
+
+    def __init__(self, path: str, stat_result: os.stat_result, filename: str, inline: bool = False,
+                 cache_max_age: int = 0, chunk_size: int = 262144, **kwargs):
+        media_type, inline = download_media_type(filename, inline)
+        headers = {"content-disposition": content_disposition(filename, inline),
+                   "cache-control": f"public, max-age={cache_max_age}" if cache_max_age > 0 else "no-cache",
+                   "x-content-type-options": "nosniff"}
+        super().__init__(path, headers=headers, media_type=media_type, filename=filename,
+                         stat_result=stat_result, **kwargs)
+        self.chunk_size = chunk_size
+        self._zerocopy = False
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        self.headers.setdefault("etag", file_etag(stat_result))
+        super().set_stat_headers(stat_result)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        headers = Headers(scope=scope)
+        if is_not_modified(headers, self.headers["etag"], self.stat_result.st_mtime):
+            not_modified = Response(status_code=304, headers={
+                key: self.headers[key] for key in ("etag", "last-modified", "cache-control", "x-content-type-options")
+                if key in self.headers
+            })
+            await not_modified(scope, receive, send)
+            if self.background is not None:
+                await self.background()
+            return
+        self._zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _send_zerocopy(self, send: Send, offset: int, count: int) -> None:
+        fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            await send({"type": "http.response.zerocopysend", "file": fd, "offset": offset, "count": count,
+                        "more_body": False})
+        finally:
+            os.close(fd)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool, send_pathsend: bool) -> None:
+        if self._zerocopy and not send_header_only:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await self._send_zerocopy(send, 0, self.stat_result.st_size)
+            return
+        await super()._handle_simple(send, send_header_only, send_pathsend)
+
+    async def _handle_single_range(self, send: Send, start: int, end: int, file_size: int,
+                                   send_header_only: bool) -> None:
+        if self._zerocopy and not send_header_only:
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+            self.headers["content-length"] = str(end - start)
+            await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+            await self._send_zerocopy(send, start, end - start)
+            return
+        await super()._handle_single_range(send, start, end, file_size, send_header_only)
+
+
+def accel_redirect_response(header: str, prefix: str, path: str, relpath: str, stat_result: os.stat_result,
+                            filename: str, inline: bool = False, cache_max_age: int = 0) -> Response:
+    """
+    Hand the transfer to the reverse proxy, which serves the file with sendfile and
+    answers Range and conditional requests itself: nginx X-Accel-Redirect gets
+    `prefix` + the public_data path (an internal location), Apache / lighttpd
+    X-Sendfile the absolute file path.
+    """
+    if header.lower() == "x-accel-redirect":
+        target = prefix.rstrip("/") + "/" + quote(relpath.lstrip("/"))
+    else:
+        target = os.path.abspath(path)
+    media_type, inline = download_media_type(filename, inline)
+    return Response(status_code=200, media_type=media_type, headers={
+        header: target,
+        "content-disposition": content_disposition(filename, inline),
+        "x-content-type-options": "nosniff",
+        "etag": file_etag(stat_result),
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": f"public, max-age={cache_max_age}" if cache_max_age > 0 else "no-cache",
+    })
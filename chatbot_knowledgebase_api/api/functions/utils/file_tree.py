@@ -0,0 +1,290 @@
+# file_tree.py
+import asyncio
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+
+from functions.utils.common import load_section_config
+
+SORT_KEYS = ("name", "size", "modified", "type")
+
+
+def load_file_index_config() -> dict:
+    return load_section_config('file_index', {
+        'watch': True,
+        'page_size': 500,
+        'max_page_size': 5000,
+    })
+
+
+@dataclass
+class FileEntry:
+    name: str
+    path: str  # relative to the index root, "/"-separated ("" for the root)
+    is_dir: bool
+    size: int | None = None
+    modified: float | None = None
+    children: dict[str, "FileEntry"] | None = None
+    version: int = 0  # generation of the last change of this directory's listing
+
+    def to_dict(self) -> dict:
+        if self.is_dir:
+            return {"name": self.name, "type": "directory", "path": self.path, "size": None, "modified": None,
+                    "extension": None, "children_count": len(self.children or {})}
+        return {"name": self.name, "type": "file", "path": self.path, "size": self.size, "modified": self.modified,
+                "extension": os.path.splitext(self.name)[1].lower()}
+
+
+@dataclass
+class Page:
+    items: list[dict]
+    total: int
+    directories: int
+    files: int
+    etag: str
+
+
+def _sort_key(sort: str, by_path: bool = False):
+    if sort == "size":
+        return lambda e: (e.size if e.size is not None else -1, e.name)
+    if sort == "modified":
+        return lambda e: (e.modified or 0.0, e.name)
+    if sort == "type":
+        return lambda e: (not e.is_dir, os.path.splitext(e.name)[1].lower(), e.name)
+    return (lambda e: e.path) if by_path else (lambda e: e.name)
+
+
+def _page(view: list[FileEntry], offset: int, limit: int | None) -> list[dict]:
+    return [entry.to_dict() for entry in (view[offset:] if limit is None else view[offset:offset + limit])]
+
+
+class FileTreeIndex:
+    """
+    In-memory index of a directory tree (public_data) for the listing endpoints.
+
+    The tree is scanned once; afterwards only the paths reported through
+    notify() (upload, move, delete, or the watchfiles watcher) are stat'ed again.
+    Sorted views are cached per directory and dropped when the directory
+    changes, so serving a page is a slice of a cached list. Every change bumps a
+    generation counter, which makes the ETag of a listing change exactly when
+    its content can have changed.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._instance = uuid.uuid4().hex[:8]
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._files_version = 0
+        self._tree: FileEntry | None = None
+        self._views: dict[tuple, tuple[int, list[FileEntry], int]] = {}
+        self.scans = 0
+        self.updates = 0
+
+    # building and updating
+
+    def _scan(self, path: str, name: str, relpath: str) -> FileEntry:
+        entry = FileEntry(name=name, path=relpath, is_dir=True, children={}, version=self._generation)
+        try:
+            with os.scandir(path) as it:
+                for item in it:
+                    child_rel = f"{relpath}/{item.name}" if relpath else item.name
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            entry.children[item.name] = self._scan(item.path, item.name, child_rel)
+                        else:
+                            stat = item.stat()
+                            entry.children[item.name] = FileEntry(item.name, child_rel, False, stat.st_size,
+                                                                  stat.st_mtime)
+                    except OSError:
+                        entry.children[item.name] = FileEntry(item.name, child_rel, False, 0, 0.0)
+        except OSError as e:
+            print(f"WARNING: Could not scan {path}: {str(e)}")
+        return entry
+
+    def build(self) -> "FileTreeIndex":
+        with self._lock:
+            self._generation += 1
+            self._tree = self._scan(self.root, "", "")
+            self._files_version = self._generation
+            self._views.clear()
+            self.scans += 1
+        print(f"INFO: Indexed {self.root} ({self.count_files()} files)")
+        return self
+
+    def _ensure_built(self):
+        if self._tree is None:
+            self.build()
+
+    def _relpath(self, path: str) -> str | None:
+        """Index path of a filesystem path (None when it is outside the root)"""
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        if rel == os.curdir:
+            return ""
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        return rel.replace(os.sep, "/")
+
+    def _touch(self, directory: FileEntry):
+        """Mark a directory listing as changed, and its parent's (which shows its children_count)"""
+        directory.version = self._generation
+        if directory.path:
+            grandparent = self._parent(directory.path, create=False)
+            if grandparent is not None:
+                grandparent.version = self._generation
+
+    def _parent(self, relpath: str, create: bool) -> FileEntry | None:
+        node = self._tree
+        parts = relpath.split("/")[:-1]
+        for i, part in enumerate(parts):
+            child = node.children.get(part)
+            if child is None or not child.is_dir:
+                if not create:
+                    return None
+                child = FileEntry(part, "/".join(parts[:i + 1]), True, children={}, version=self._generation)
+                node.children[part] = child
+                self._touch(node)
+            node = child
+        return node
+
+    def notify(self, path: str):
+        """Re-read one path after it was created, modified, moved or deleted (a directory is rescanned)"""
+        relpath = self._relpath(path)
+        if relpath is None:
+            return
+        with self._lock:
+            self._ensure_built()
+            if relpath == "":
+                self.build()
+                return
+            self._generation += 1
+            self.updates += 1
+            name = relpath.rsplit("/", 1)[-1]
+            full_path = os.path.join(self.root, *relpath.split("/"))
+            try:
+                is_dir = os.path.isdir(full_path) and not os.path.islink(full_path)
+                stat = None if is_dir else os.stat(full_path)
+            except OSError:
+                self._remove(relpath)
+                return
+            parent = self._parent(relpath, create=True)
+            if is_dir:
+                parent.children[name] = self._scan(full_path, name, relpath)
+            else:
+                existing = parent.children.get(name)
+                if existing is not None and not existing.is_dir \
+                        and (existing.size, existing.modified) == (stat.st_size, stat.st_mtime):
+                    return
+                parent.children[name] = FileEntry(name, relpath, False, stat.st_size, stat.st_mtime)
+            self._touch(parent)
+            self._files_version = self._generation
+
+    def notify_many(self, paths):
+        for path in paths:
+            self.notify(path)
+
+    def _remove(self, relpath: str):
+        parent = self._parent(relpath, create=False)
+        if parent is not None and parent.children.pop(relpath.rsplit("/", 1)[-1], None) is not None:
+            self._touch(parent)
+            self._files_version = self._generation
+
+    def remove(self, path: str):
+        """Drop a deleted path (and everything below it)"""
+        relpath = self._relpath(path)
+        if not relpath:
+            return
+        with self._lock:
+            self._ensure_built()
+            self._generation += 1
+            self.updates += 1
+            self._remove(relpath)
+
+    async def watch(self):
+        """Apply filesystem events from watchfiles until cancelled (changes made outside the API)"""
+        try:
+            from watchfiles import awatch
+        except ImportError as e:
+            print(f"WARNING: watchfiles not available, {self.root} changes outside the API are not indexed: {str(e)}")
+            return
+        os.makedirs(self.root, exist_ok=True)
+        print(f"INFO: Watching {self.root} for changes")
+        async for changes in awatch(self.root):
+            await asyncio.to_thread(self.notify_many, sorted({path for _, path in changes}))
+
+    # queries
+
+    def get(self, relpath: str) -> FileEntry | None:
+        with self._lock:
+            self._ensure_built()
+            node = self._tree
+            for part in [p for p in relpath.split("/") if p]:
+                if not node.is_dir or part not in node.children:
+                    return None
+                node = node.children[part]
+            return node
+
+    def _iter_files(self, node: FileEntry):
+        for child in node.children.values():
+            if child.is_dir:
+                yield from self._iter_files(child)
+            else:
+                yield child
+
+    def count_files(self) -> int:
+        with self._lock:
+            return sum(1 for _ in self._iter_files(self._tree)) if self._tree else 0
+
+    def _view(self, key: tuple, version: int, entries) -> tuple[list[FileEntry], int]:
+        """Sorted entries (and how many are directories), recomputed only after the listing changed"""
+        cached = self._views.get(key)
+        if cached is None or cached[0] != version:
+            kind, _, sort, reverse = key
+            view = sorted(entries(), key=_sort_key(sort, by_path=kind == "files"), reverse=reverse)
+            cached = (version, view, sum(1 for entry in view if entry.is_dir))
+            self._views[key] = cached
+        return cached[1], cached[2]
+
+    def _etag(self, version: int, *params) -> str:
+        return f'W/"{self._instance}-{version}-{"-".join(str(p) for p in params)}"'
+
+    def list_dir(self, relpath: str, sort: str = "name", order: str = "asc",
+                 offset: int = 0, limit: int | None = 500) -> Page | None:
+        """One page of a directory listing (all of it when `limit` is None); None when the directory is not indexed"""
+        with self._lock:
+            node = self.get(relpath)
+            if node is None or not node.is_dir:
+                return None
+            view, directories = self._view(("dir", node.path, sort, order == "desc"), node.version,
+                                           lambda: node.children.values())
+            return Page(items=_page(view, offset, limit), total=len(view),
+                        directories=directories, files=len(view) - directories,
+                        etag=self._etag(node.version, sort, order, offset, limit))
+
+    def list_files(self, relpath: str = "", recursive: bool = False, sort: str = "name", order: str = "asc",
+                   offset: int = 0, limit: int | None = 500) -> Page | None:
+        """One page of the files of a directory (or of its whole subtree)"""
+        with self._lock:
+            node = self.get(relpath)
+            if node is None or not node.is_dir:
+                return None
+            if recursive:
+                version = self._files_version
+                view, _ = self._view(("files", node.path, sort, order == "desc"), version,
+                                     lambda: self._iter_files(node))
+            else:
+                version = node.version
+                view, _ = self._view(("dir_files", node.path, sort, order == "desc"), version,
+                                     lambda: (child for child in node.children.values() if not child.is_dir))
+            return Page(items=_page(view, offset, limit), total=len(view),
+                        directories=0, files=len(view),
+                        etag=self._etag(version, recursive, sort, order, offset, limit))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"root": self.root, "built": self._tree is not None, "generation": self._generation,
+                    "scans": self.scans, "updates": self.updates, "cached_views": len(self._views)}
+
+
+public_files = FileTreeIndex("data/public_data")
@@ -0,0 +1,132 @@
+# http_clients.py
+import importlib.util
+import threading
+
+import httpx
+
+from functions.utils.common import load_proxy_config, load_section_config
+from functions.utils.rate_limit import rate_limiter
+
+# Process-wide clients shared by the agent LLM, embeddings, ingestion and the analyzers
+_sync_client: httpx.Client | None = None
+_async_client: httpx.AsyncClient | None = None
+_lock = threading.Lock()
+
+
+class ConnectionStats:
+    """Requests vs. newly opened connections / TLS handshakes, from httpcore trace events"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def _on_trace(self, event_name: str):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def sync_trace(self, event_name: str, info: dict):
+        self._on_trace(event_name)
+
+    async def async_trace(self, event_name: str, info: dict):
+        self._on_trace(event_name)
+
+    def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self.sync_trace
+
+    async def aon_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self.async_trace
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reuse_ratio": round(1 - self.new_connections / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+connection_stats = ConnectionStats()
+
+
+def load_http_config() -> dict:
+    return load_section_config('http', {
+        'max_connections': 20,
+        'max_keepalive_connections': 10,
+        'keepalive_expiry': 60,
+        'http2': False,
+        'timeout': 60,
+        'connect_timeout': 10,
+    })
+
+
+def _client_kwargs() -> dict:
+    config = load_http_config()
+    http2 = config['http2']
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("WARNING: http2 is enabled but the 'h2' package is not installed - using HTTP/1.1")
+        http2 = False
+
+    kwargs = {
+        "limits": httpx.Limits(max_connections=config['max_connections'],
+                               max_keepalive_connections=config['max_keepalive_connections'],
+                               keepalive_expiry=config['keepalive_expiry']),
+        "timeout": httpx.Timeout(config['timeout'], connect=config['connect_timeout']),
+        "http2": http2,
+    }
+    proxy = load_proxy_config()
+    if proxy and proxy.strip():
+        kwargs["proxy"] = proxy
+        kwargs["verify"] = False  # Disable SSL verification for corporate proxies
+    return kwargs
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            kwargs = _client_kwargs()
+            _sync_client = httpx.Client(event_hooks={"request": [rate_limiter.acquire, connection_stats.on_request],
+                                                     "response": [rate_limiter.on_response]}, **kwargs)
+            print(f"HTTP client created (http2={kwargs['http2']}, proxy={'proxy' in kwargs})")
+        return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(event_hooks={"request": [rate_limiter.aacquire, connection_stats.aon_request],
+                                                           "response": [rate_limiter.aon_response]},
+                                              **_client_kwargs())
+        return _async_client
+
+
+def _pool_size(client) -> int | None:
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    return len(connections) if connections is not None else None
+
+
+def http_client_stats() -> dict:
+    return {
+        **connection_stats.stats(),
+        "sync_pool_connections": _pool_size(_sync_client),
+        "async_pool_connections": _pool_size(_async_client),
+    }
+
+
+async def aclose_clients():
+    """Close the shared clients on shutdown"""
+    global _sync_client, _async_client
+    with _lock:
+        sync_client, async_client = _sync_client, _async_client
+        _sync_client = _async_client = None
+    if sync_client:
+        sync_client.close()
+    if async_client:
+        await async_client.aclose()
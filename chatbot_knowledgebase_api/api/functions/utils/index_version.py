@@ -0,0 +1,41 @@
+import os
+import time
+
+INDEX_VERSION_FILE = "index_version"
+
+# persist_dir -> (mtime, version); avoids re-reading the file on every query
+_version_cache: dict[str, tuple[float, str]] = {}
+
+
+def read_index_version(persist_dir: str) -> str:
+    """Return the current index version of a vector store ("0" if it was never bumped)"""
+    path = os.path.join(persist_dir, INDEX_VERSION_FILE)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return "0"
+
+    cached = _version_cache.get(persist_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = f.read().strip() or "0"
+    except OSError:
+        return "0"
+    _version_cache[persist_dir] = (mtime, version)
+    return version
+
+
+def bump_index_version(persist_dir: str) -> str:
+    """Publish a new index version after ingestion commits; caches keyed on the old version become stale"""
+    os.makedirs(persist_dir, exist_ok=True)
+    version = f"{time.time_ns()}"
+    path = os.path.join(persist_dir, INDEX_VERSION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, path)
+    print(f"INFO: Index version bumped to {version}")
+    return version
@@ -0,0 +1,92 @@
+import re
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class IncrementalJSONStringField:
+    """
+    Decode one string field of a JSON object that arrives in fragments.
+
+    Used on streamed tool-call arguments such as '{"answer": "Xin ch' + 'ào\\n..."}':
+    each feed() returns only the newly decoded characters of the field's value, so
+    the text can be forwarded to the client as it is generated. Escapes split
+    across fragments (including \\uXXXX surrogate pairs) are held back until complete.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._key_pattern = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._state = "search"  # search -> value -> done
+        self._buffer = ""
+        self._pending_escape = ""
+        self._high_surrogate: int | None = None
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, fragment: str) -> str:
+        if self._state == "done" or not fragment:
+            return ""
+        if self._state == "search":
+            self._buffer += fragment
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return ""
+            fragment = self._buffer[match.end():]
+            self._buffer = ""
+            self._state = "value"
+        return self._decode(fragment)
+
+    def _decode(self, text: str) -> str:
+        text = self._pending_escape + text
+        self._pending_escape = ""
+        out = []
+        i = 0
+        while i < len(text):
+            ch = text[i]
+            if ch == '"':
+                self._state = "done"
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+
+            # Escape sequence: wait for the rest if it was split across fragments
+            if i + 1 >= len(text):
+                self._pending_escape = text[i:]
+                break
+            escape = text[i + 1]
+            if escape != 'u':
+                out.append(_SIMPLE_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(text):
+                self._pending_escape = text[i:]
+                break
+            try:
+                code = int(text[i + 2:i + 6], 16)
+            except ValueError:
+                code = 0xFFFD
+            i += 6
+            if 0xD800 <= code < 0xDC00:
+                self._high_surrogate = code
+                continue
+            if 0xDC00 <= code < 0xE000:
+                if self._high_surrogate is None:
+                    code = 0xFFFD
+                else:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            out.append(chr(code))
+        return "".join(out)
@@ -0,0 +1,105 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class LatencyStats:
+    """Rolling window of latency samples (seconds) with percentile summaries"""
+
+    def __init__(self, window: int = 500):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def reset(self):
+        """Forget the samples (the total count is kept)"""
+        with self._lock:
+            self._samples.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float, min_samples: int = 1) -> float | None:
+        """Percentile of the window, or None while it holds fewer than `min_samples` samples"""
+        with self._lock:
+            if not self._samples or len(self._samples) < min_samples:
+                return None
+            return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), p))
+
+    def stats(self) -> dict:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "count": self.count,
+            "window": len(self),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+_latencies: dict[str, LatencyStats] = {}
+_latencies_lock = threading.Lock()
+
+
+def get_latency(name: str) -> LatencyStats:
+    with _latencies_lock:
+        if name not in _latencies:
+            _latencies[name] = LatencyStats()
+        return _latencies[name]
+
+
+def observe_latency(name: str, seconds: float):
+    get_latency(name).observe(seconds)
+
+
+def latency_stats() -> dict:
+    with _latencies_lock:
+        names = sorted(_latencies)
+    return {name: get_latency(name).stats() for name in names}
+
+
+class CancellationStats:
+    """
+    Requests cancelled before completion (client disconnect or idle timeout).
+
+    Tokens saved are estimated per route as the rolling mean of tokens streamed by
+    completed requests minus the tokens already streamed when the request was cancelled.
+    """
+
+    def __init__(self, window: int = 500):
+        self._completed_tokens: dict[str, deque[int]] = {}
+        self._window = window
+        self._lock = threading.Lock()
+        self.cancelled: dict[str, int] = {}
+        self.tokens_saved: dict[str, int] = {}
+
+    def record_completed(self, route: str, tokens: int):
+        with self._lock:
+            self._completed_tokens.setdefault(route, deque(maxlen=self._window)).append(tokens)
+
+    def record_cancelled(self, route: str, reason: str, tokens_streamed: int) -> int:
+        with self._lock:
+            completed = self._completed_tokens.get(route)
+            expected = sum(completed) / len(completed) if completed else 0
+            saved = max(0, int(expected - tokens_streamed))
+            key = f"{route}_{reason}"
+            self.cancelled[key] = self.cancelled.get(key, 0) + 1
+            self.tokens_saved[route] = self.tokens_saved.get(route, 0) + saved
+            return saved
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cancelled": dict(self.cancelled),
+                "estimated_tokens_saved": dict(self.tokens_saved),
+            }
+
+
+cancellations = CancellationStats()
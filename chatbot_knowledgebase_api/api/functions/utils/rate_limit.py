@@ -0,0 +1,310 @@
+# rate_limit.py
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+from functions.utils.common import load_section_config
+from functions.utils.metrics import get_latency
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Priority class of the OpenAI calls made from the current context (thread or asyncio task)
+rate_limit_priority: ContextVar[str] = ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(value: str):
+    """Run a block (e.g. ingestion, analyzers, summaries) in the given priority class"""
+    token = rate_limit_priority.set(value)
+    try:
+        yield
+    finally:
+        rate_limit_priority.reset(token)
+
+
+def load_rate_limit_config() -> dict:
+    return load_section_config('rate_limit', {
+        'enabled': True,
+        'rpm': 500,
+        'tpm': 200000,
+        'key_budgets': '',
+        'background_reserve': 0.2,
+        'busy_reserve': 0.6,
+        'interactive_window': 10.0,
+        'max_interactive_wait': 10.0,
+        'completion_tokens': 1000,
+        'state_path': 'cache/rate_limit.sqlite3',
+    })
+
+
+def estimate_request_tokens(request: httpx.Request, completion_tokens: int) -> int:
+    """Rough token cost of an OpenAI request: ~4 bytes per prompt token plus the expected completion"""
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        return completion_tokens
+    tokens = len(body) // 4
+    if request.url.path.endswith("/chat/completions"):
+        try:
+            payload = json.loads(body)
+            tokens += int(payload.get("max_completion_tokens") or payload.get("max_tokens") or completion_tokens)
+        except (ValueError, TypeError, AttributeError):
+            tokens += completion_tokens
+    return max(tokens, 1)
+
+
+class TokenBucketRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget per API key, shared by every
+    process using the same state file (the API and ingest.py).
+
+    Each key has two token buckets refilled continuously at rpm/60 and tpm/60 per
+    second. Interactive calls take from the buckets whenever they can (waiting at
+    most `max_interactive_wait` seconds, then going ahead and leaving it to the
+    server). Background calls must leave `background_reserve` of both buckets for
+    interactive traffic, or `busy_reserve` while interactive calls were seen in the
+    last `interactive_window` seconds, so ingestion yields to chat automatically.
+    Remaining-quota headers and 429 Retry-After answers from the server tighten
+    the local buckets.
+    """
+
+    def __init__(self, config: dict | None = None):
+        config = config or load_rate_limit_config()
+        self.enabled = config['enabled']
+        self.rpm = config['rpm']
+        self.tpm = config['tpm']
+        self.key_budgets = self._parse_key_budgets(config['key_budgets'])
+        self.background_reserve = config['background_reserve']
+        self.busy_reserve = config['busy_reserve']
+        self.interactive_window = config['interactive_window']
+        self.max_interactive_wait = config['max_interactive_wait']
+        self.completion_tokens = config['completion_tokens']
+        path = config['state_path']
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(__file__), '..', '..', path)
+        self.path = os.path.normpath(path)
+        self.waits: dict[str, int] = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.requests: dict[str, int] = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.throttled = 0
+        self._initialized = False
+
+    @staticmethod
+    def _parse_key_budgets(raw: str) -> list[tuple[str, int, int]]:
+        """'<key suffix>=<rpm>/<tpm>, ...' -> [(suffix, rpm, tpm)]"""
+        budgets = []
+        for item in raw.split(','):
+            if '=' not in item:
+                continue
+            suffix, limits = item.split('=', 1)
+            rpm, _, tpm = limits.partition('/')
+            budgets.append((suffix.strip(), int(rpm), int(tpm)))
+        return budgets
+
+    def _budget(self, api_key: str) -> tuple[int, int]:
+        for suffix, rpm, tpm in self.key_budgets:
+            if suffix and api_key.endswith(suffix):
+                return rpm, tpm
+        return self.rpm, self.tpm
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL,
+                blocked_until REAL DEFAULT 0, last_interactive REAL DEFAULT 0)""")
+            self._initialized = True
+        return conn
+
+    def _try_take(self, key: str, rpm: int, tpm: int, cost: int, priority_class: str) -> float:
+        """Take one request and `cost` tokens if allowed; returns 0 on success or seconds to wait"""
+        cost = min(cost, tpm)  # a single request larger than the budget takes the whole bucket
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT requests, tokens, updated, blocked_until, last_interactive FROM buckets WHERE key = ?",
+                               (key,)).fetchone()
+            if row is None:
+                requests, tokens, blocked_until, last_interactive = float(rpm), float(tpm), 0.0, 0.0
+            else:
+                requests, tokens, updated, blocked_until, last_interactive = row
+                elapsed = max(0.0, now - updated)
+                requests = min(float(rpm), requests + elapsed * rpm / 60)
+                tokens = min(float(tpm), tokens + elapsed * tpm / 60)
+
+            if priority_class == INTERACTIVE:
+                last_interactive = now
+                reserve = 0.0
+            elif now - last_interactive < self.interactive_window:
+                reserve = self.busy_reserve
+            else:
+                reserve = self.background_reserve
+
+            need_requests = 1 + reserve * rpm
+            need_tokens = cost + reserve * tpm
+            wait = max(blocked_until - now,
+                       (need_requests - requests) * 60 / rpm,
+                       (need_tokens - tokens) * 60 / tpm, 0.0)
+            if wait <= 0:
+                requests -= 1
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, requests, tokens, now, blocked_until, last_interactive))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _request_key(self, request: httpx.Request) -> tuple[str, str] | None:
+        auth = request.headers.get("authorization", "")
+        if not auth.lower().startswith("bearer "):
+            return None
+        api_key = auth[7:].strip()
+        return hashlib.sha256(api_key.encode()).hexdigest()[:16], api_key
+
+    def _plan(self, request: httpx.Request):
+        if not self.enabled:
+            return None
+        keys = self._request_key(request)
+        if keys is None:
+            return None
+        key, api_key = keys
+        rpm, tpm = self._budget(api_key)
+        return key, rpm, tpm, estimate_request_tokens(request, self.completion_tokens), rate_limit_priority.get()
+
+    def _step(self, plan, started: float) -> float:
+        """One attempt; returns 0 when the request may go, else how long to sleep before retrying"""
+        key, rpm, tpm, cost, priority_class = plan
+        try:
+            wait = self._try_take(key, rpm, tpm, cost, priority_class)
+        except sqlite3.Error as e:
+            print(f"WARNING: Rate limit state unavailable ({str(e)}) - not throttling")
+            return 0.0
+        if wait <= 0:
+            return 0.0
+        if priority_class == INTERACTIVE and time.perf_counter() - started + wait > self.max_interactive_wait:
+            print(f"WARNING: Interactive request exceeded the local rate limit wait ({self.max_interactive_wait}s) - sending anyway")
+            return 0.0
+        return min(wait, 1.0)  # re-check often: budget freed by other processes shows up in the shared state
+
+    def _record(self, plan, started: float, waited: bool):
+        priority_class = plan[4]
+        self.requests[priority_class] = self.requests.get(priority_class, 0) + 1
+        if waited:
+            self.waits[priority_class] = self.waits.get(priority_class, 0) + 1
+        get_latency(f"rate_limit_wait_{priority_class}").observe(time.perf_counter() - started)
+
+    def acquire(self, request: httpx.Request):
+        """httpx request hook for the sync client (blocks the calling thread)"""
+        plan = self._plan(request)
+        if plan is None:
+            return
+        started = time.perf_counter()
+        waited = False
+        while (delay := self._step(plan, started)) > 0:
+            waited = True
+            time.sleep(delay)
+        self._record(plan, started, waited)
+
+    async def aacquire(self, request: httpx.Request):
+        """httpx request hook for the async client (the sqlite transaction runs in a worker thread)"""
+        plan = self._plan(request)
+        if plan is None:
+            return
+        started = time.perf_counter()
+        waited = False
+        while (delay := await asyncio.to_thread(self._step, plan, started)) > 0:
+            waited = True
+            await asyncio.sleep(delay)
+        self._record(plan, started, waited)
+
+    def _update_from_headers(self, request: httpx.Request, response: httpx.Response):
+        if not self.enabled:
+            return
+        keys = self._request_key(request)
+        if keys is None:
+            return
+        key = keys[0]
+        headers = response.headers
+        blocked_until = 0.0
+        if response.status_code == 429:
+            self.throttled += 1
+            try:
+                blocked_until = time.time() + float(headers.get("retry-after", "1"))
+            except ValueError:
+                blocked_until = time.time() + 1
+        remaining = {}
+        for name, column in (("x-ratelimit-remaining-requests", "requests"),
+                             ("x-ratelimit-remaining-tokens", "tokens")):
+            try:
+                remaining[column] = float(headers[name])
+            except (KeyError, ValueError):
+                pass
+        if not remaining and not blocked_until:
+            return
+        try:
+            conn = self._connect()
+            try:
+                for column, value in remaining.items():
+                    conn.execute(f"UPDATE buckets SET {column} = MIN({column}, ?) WHERE key = ?", (value, key))
+                if blocked_until:
+                    conn.execute("UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE key = ?",
+                                 (blocked_until, key))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not update rate limit state: {str(e)}")
+
+    def on_response(self, response: httpx.Response):
+        self._update_from_headers(response.request, response)
+
+    async def aon_response(self, response: httpx.Response):
+        await asyncio.to_thread(self._update_from_headers, response.request, response)
+
+    def stats(self) -> dict:
+        buckets = []
+        if self.enabled and os.path.exists(self.path):
+            try:
+                conn = self._connect()
+                try:
+                    now = time.time()
+                    for key, requests, tokens, updated, blocked_until, last_interactive in conn.execute(
+                            "SELECT key, requests, tokens, updated, blocked_until, last_interactive FROM buckets"):
+                        buckets.append({
+                            "key": key,
+                            "requests_available": round(requests, 1),
+                            "tokens_available": int(tokens),
+                            "blocked_for_s": round(max(0.0, blocked_until - now), 1),
+                            "interactive_active": now - last_interactive < self.interactive_window,
+                        })
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+        return {
+            "enabled": self.enabled,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests": dict(self.requests),
+            "waited": dict(self.waits),
+            "throttled_429": self.throttled,
+            "buckets": buckets,
+        }
+
+
+rate_limiter = TokenBucketRateLimiter()
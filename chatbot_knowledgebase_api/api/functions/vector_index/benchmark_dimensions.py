@@ -0,0 +1,67 @@
+# benchmark_dimensions.py
+"""
+Latency/recall trade-off of the coarse search dimension over the current corpus.
+
+For each dimension the coarse stage searches truncated vectors, then the
+shortlist is rescored with the full vectors; recall is measured against exact
+full-size search. The vectors of every collection are benchmarked together
+(or only those given with --collection). Nothing is written to the store.
+
+Usage (from the api directory):
+    python -m functions.vector_index.benchmark_dimensions
+    python -m functions.vector_index.benchmark_dimensions --dimensions 256 512 1536 --method int8
+"""
+import argparse
+
+import numpy as np
+
+from functions.utils.common import load_section_config
+from functions.vector_index.kb_collections import list_collections
+from functions.vector_index.snapshots import snapshot_path
+from functions.vector_index.quantized_index import QuantizedIndex, load_chroma_embeddings, recall_report
+
+
+def main():
+    index_config = load_section_config('vector_index', {
+        'quantization': 'none',
+        'pq_subspaces': 384,
+    })
+    parser = argparse.ArgumentParser(description="Benchmark coarse-to-fine search at several embedding sizes")
+    parser.add_argument("--persist-dir", default="chroma_store")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1536])
+    parser.add_argument("--method", choices=["none", "int8", "pq"], default=index_config['quantization'])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--collection", action="append",
+                        help="Only this collection (repeatable); every collection of the snapshot by default")
+    args = parser.parse_args()
+
+    store_dir = snapshot_path(args.persist_dir)
+    ids, parts = [], []
+    for collection_name, _ in list_collections(store_dir):
+        if args.collection and collection_name not in args.collection:
+            continue
+        collection_ids, collection_vectors = load_chroma_embeddings(store_dir, collection_name)
+        if collection_ids:
+            ids.extend(collection_ids)
+            parts.append(collection_vectors)
+    vectors = np.vstack(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+    if len(ids) < 2:
+        print("INFO: Not enough vectors to benchmark")
+        return
+    print(f"INFO: {len(ids)} vectors of {vectors.shape[1]} dimensions, method={args.method}, k={args.k}")
+
+    print(f"{'dims':>6} {'rescore':>8} {'recall@' + str(args.k):>10} {'latency_ms':>11} {'coarse_MB':>10}")
+    for dim in args.dimensions:
+        index = QuantizedIndex.build(ids, vectors, method=args.method,
+                                     pq_subspaces=index_config['pq_subspaces'], search_dim=dim)
+        report = recall_report(index, num_queries=args.queries, k=args.k)
+        coarse_mb = report["memory"]["compressed_bytes"] / (1024 * 1024)
+        for run in report["runs"]:
+            print(f"{index.search_dim:>6} {run['rescore_factor']:>8} {run[f'recall@{args.k}']:>10} "
+                  f"{run['latency_ms']:>11} {coarse_mb:>10.2f}")
+    print(f"INFO: exact float32 full-size search: {report['float32_latency_ms']} ms/query")
+
+
+if __name__ == "__main__":
+    main()
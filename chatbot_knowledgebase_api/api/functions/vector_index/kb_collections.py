@@ -0,0 +1,408 @@
+# kb_collections.py
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+import numpy as np
+from langchain_core.documents import Document
+
+from functions.vector_index.quantized_index import DEFAULT_COLLECTION, index_dir_for
+
+RAW_DATA_DIR = "data/raw_data"
+PUBLIC_DATA_DIR = "data/public_data"
+MARKDOWN_DIR = "markdown"  # analyzer output inside raw_data, "<original file>.md"
+PARTITION_ROOT = "data"    # course / project folders live under data/public_data/data/
+COLLECTION_PREFIX = "kb_"
+
+COURSE_CODE_PATTERN = re.compile(r"\b([A-Za-z]{2,4})\s?(\d{3})\b")
+
+# Normalized chunk metadata written at ingest time (filterable through /invoke)
+COURSE_KEY = "course"
+EXTENSION_KEY = "extension"
+CONTENT_HASH_KEY = "content_hash"
+INGESTED_AT_KEY = "ingested_at"
+
+
+def normalize_path(path: str) -> str:
+    path = path.replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path
+
+
+def source_to_relpath(source: str) -> str | None:
+    """Path of the file a chunk came from, relative to public_data (None if it is outside the data dirs)"""
+    source = normalize_path(source)
+    markdown_prefix = f"{RAW_DATA_DIR}/{MARKDOWN_DIR}/"
+    if source.startswith(markdown_prefix):
+        rel = source[len(markdown_prefix):]
+        return rel[:-3] if rel.endswith(".md") else rel
+    for prefix in (f"{RAW_DATA_DIR}/", f"{PUBLIC_DATA_DIR}/"):
+        if source.startswith(prefix):
+            return source[len(prefix):]
+    return None
+
+
+def folder_for_source(source: str) -> str:
+    """Course / project folder of a chunk ("" for files outside data/public_data/data/<folder>/)"""
+    parts = (source_to_relpath(source) or "").split("/")
+    if len(parts) >= 3 and parts[0] == PARTITION_ROOT:
+        return parts[1]
+    return ""
+
+
+def collection_name_for(folder: str) -> str:
+    """Chroma collection of a folder: kb_<ascii slug>, or the default collection for unpartitioned files"""
+    if not folder:
+        return DEFAULT_COLLECTION
+    ascii_name = unicodedata.normalize("NFKD", folder.replace("đ", "d").replace("Đ", "D"))
+    ascii_name = ascii_name.encode("ascii", "ignore").decode("ascii").lower()
+    slug = re.sub(r"[^a-z0-9]+", "-", ascii_name).strip("-") or "folder"
+    return f"{COLLECTION_PREFIX}{slug}"[:63].rstrip("-")
+
+
+def course_codes(text: str) -> set[str]:
+    return {f"{letters}{digits}".upper() for letters, digits in COURSE_CODE_PATTERN.findall(text)}
+
+
+def file_extension(source: str) -> str:
+    """Lower-case extension of the original file, without the dot ("pdf", "png" for an analyzed image, ...)"""
+    relpath = source_to_relpath(source) or normalize_path(source)
+    return os.path.splitext(relpath)[1].lstrip(".").lower()
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_metadata(source: str, ingested_at: float, hashes: dict[str, str] | None = None) -> dict:
+    """
+    Normalized metadata of a chunk: course folder, file extension, content hash
+    of the original file and ingest time. `hashes` memoizes the hash per source
+    file (keyed by its normalized path), since every chunk of a file gets the same
+    one; uploads pre-fill it with the hash computed while the file was written.
+    """
+    hashes = {} if hashes is None else hashes
+    relpath = source_to_relpath(source)
+    original = normalize_path(f"{RAW_DATA_DIR}/{relpath}" if relpath else source)
+    if original not in hashes:
+        try:
+            hashes[original] = content_hash(original if os.path.exists(original) else source)
+        except OSError:
+            hashes[original] = ""
+    return {
+        COURSE_KEY: folder_for_source(source),
+        EXTENSION_KEY: file_extension(source),
+        CONTENT_HASH_KEY: hashes[original],
+        INGESTED_AT_KEY: float(ingested_at),
+    }
+
+
+def list_collections(path: str) -> list[tuple[str, str]]:
+    """(collection name, folder) of every collection in a persisted Chroma store"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=path)
+    result = []
+    for collection in client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        metadata = {} if isinstance(collection, str) else (collection.metadata or {})
+        result.append((name, metadata.get("folder", "")))
+    return sorted(result)
+
+
+def _timestamp(value: Any) -> float:
+    """Epoch seconds from a number or an ISO 8601 date / datetime (local time when no offset is given)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}")
+
+
+def _strings(value: Any) -> tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(sorted({str(item).strip() for item in value if str(item).strip()}))
+
+
+@dataclass(frozen=True)
+class MetadataFilter:
+    """
+    Filter on the normalized chunk metadata. Courses select collections (each
+    course folder is one); the other fields become a Chroma `where` clause, or a
+    mask over the coarse index, so the search only ever scores matching vectors.
+    """
+    courses: tuple[str, ...] = ()
+    extensions: tuple[str, ...] = ()
+    content_hashes: tuple[str, ...] = ()
+    ingested_after: float | None = None
+    ingested_before: float | None = None
+
+    FIELDS = ("course", "extension", "content_hash", "ingested_after", "ingested_before")
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "MetadataFilter":
+        unknown = set(values) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown filter field(s): {', '.join(sorted(unknown))} (supported: {', '.join(cls.FIELDS)})")
+        return cls(
+            courses=_strings(values.get("course")),
+            extensions=tuple(sorted({ext.lower().lstrip(".") for ext in _strings(values.get("extension"))})),
+            content_hashes=tuple(sorted({h.lower() for h in _strings(values.get("content_hash"))})),
+            ingested_after=_timestamp(values["ingested_after"]) if values.get("ingested_after") is not None else None,
+            ingested_before=_timestamp(values["ingested_before"]) if values.get("ingested_before") is not None else None,
+        )
+
+    @property
+    def has_metadata_conditions(self) -> bool:
+        return bool(self.extensions or self.content_hashes
+                    or self.ingested_after is not None or self.ingested_before is not None)
+
+    def __bool__(self) -> bool:
+        return bool(self.courses) or self.has_metadata_conditions
+
+    def where(self) -> dict | None:
+        """Chroma `where` clause of the metadata conditions (None when there are none)"""
+        conditions = []
+        if self.extensions:
+            conditions.append({EXTENSION_KEY: {"$in": list(self.extensions)}})
+        if self.content_hashes:
+            conditions.append({CONTENT_HASH_KEY: {"$in": list(self.content_hashes)}})
+        if self.ingested_after is not None:
+            conditions.append({INGESTED_AT_KEY: {"$gte": self.ingested_after}})
+        if self.ingested_before is not None:
+            conditions.append({INGESTED_AT_KEY: {"$lte": self.ingested_before}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def mask(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        """Rows of a MetadataColumns table matching the metadata conditions"""
+        mask = np.ones(len(columns[INGESTED_AT_KEY]), dtype=bool)
+        if self.extensions:
+            mask &= np.isin(columns[EXTENSION_KEY], self.extensions)
+        if self.content_hashes:
+            mask &= np.isin(columns[CONTENT_HASH_KEY], self.content_hashes)
+        # Chunks ingested before the metadata existed have NaN and never match a date condition
+        if self.ingested_after is not None:
+            mask &= columns[INGESTED_AT_KEY] >= self.ingested_after
+        if self.ingested_before is not None:
+            mask &= columns[INGESTED_AT_KEY] <= self.ingested_before
+        return mask
+
+
+@dataclass(frozen=True)
+class RetrievalScope:
+    """Per-request restriction of the search (set from /invoke, read by the retriever)"""
+    collections: tuple[str, ...] | None = None
+    metadata_filter: MetadataFilter | None = None
+
+    def key(self) -> str:
+        return repr((self.collections, self.metadata_filter))
+
+    @property
+    def explicit(self) -> bool:
+        return self.collections is not None or bool(self.metadata_filter)
+
+
+current_scope: ContextVar[RetrievalScope] = ContextVar("current_scope", default=RetrievalScope())
+
+
+def _cosine_distance(distance: float, space: str) -> float:
+    # Chroma returns squared L2 by default; on unit vectors that is 2 * cosine distance
+    return distance / 2 if space == "l2" else distance
+
+
+class KnowledgeBaseCollection:
+    def __init__(self, name: str, folder: str, store: Any, coarse_retriever: Any = None):
+        self.name = name
+        self.folder = folder
+        self.store = store
+        self.coarse_retriever = coarse_retriever
+        self.centroid: np.ndarray | None = None
+        metadata = getattr(store._collection, "metadata", None) or {}
+        self.space = metadata.get("hnsw:space", "l2")
+        self._columns: tuple[Any, dict[str, np.ndarray]] | None = None
+        self._columns_lock = threading.Lock()
+
+    def metadata_columns(self, index: Any, batch_size: int = 5000) -> dict[str, np.ndarray]:
+        """
+        Filterable metadata of the coarse index rows, one array per field in index
+        order. Loaded once per index (on the first filtered query) so a filter is a
+        vectorized mask instead of a metadata lookup per candidate.
+        """
+        with self._columns_lock:
+            if self._columns is not None and self._columns[0] is index:
+                return self._columns[1]
+            metadatas: dict[str, dict] = {}
+            for start in range(0, len(index.ids), batch_size):
+                batch = self.store._collection.get(ids=index.ids[start:start + batch_size], include=["metadatas"])
+                metadatas.update(zip(batch["ids"], batch["metadatas"]))
+            rows = [metadatas.get(doc_id) or {} for doc_id in index.ids]
+            columns = {
+                EXTENSION_KEY: np.array([row.get(EXTENSION_KEY, "") for row in rows], dtype=object),
+                CONTENT_HASH_KEY: np.array([row.get(CONTENT_HASH_KEY, "") for row in rows], dtype=object),
+                INGESTED_AT_KEY: np.array([row.get(INGESTED_AT_KEY, np.nan) for row in rows], dtype=np.float64),
+            }
+            self._columns = (index, columns)
+            return columns
+
+    def search(self, query_vector: list[float], k: int,
+               metadata_filter: MetadataFilter | None = None) -> list[tuple[Document, float]]:
+        """Top-k documents with their cosine distance, through the coarse index when there is one"""
+        conditions = metadata_filter is not None and metadata_filter.has_metadata_conditions
+        if self.coarse_retriever is not None:
+            index = self.coarse_retriever.get_index()
+            mask = metadata_filter.mask(self.metadata_columns(index)) if conditions else None
+            hits = index.search(np.asarray(query_vector, dtype=np.float32), k=k,
+                                rescore_factor=self.coarse_retriever.rescore_factor, mask=mask)
+            if not hits:
+                return []
+            by_id = {doc.id: doc for doc in self.store.get_by_ids([doc_id for doc_id, _ in hits])}
+            return [(by_id[doc_id], 1 - score) for doc_id, score in hits if doc_id in by_id]
+        results = self.store.similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=k, filter=metadata_filter.where() if conditions else None)
+        return [(doc, _cosine_distance(distance, self.space)) for doc, distance in results]
+
+
+class KnowledgeBase:
+    """
+    All collections of one index snapshot: one per course / project folder plus the
+    default collection for unpartitioned (and pre-partitioning) documents.
+
+    A search runs only on the selected collections and merges their results by
+    cosine distance. Without an explicit selection the router picks collections
+    whose folder names carry a course code mentioned in the question (plus the
+    default collection); with `route_top_collections` > 0 questions without a
+    code go to the collections whose centroid is closest to the question.
+    """
+
+    def __init__(self, path: str, embeddings: Any, store_factory, coarse_factory=None,
+                 route_by_course_code: bool = True, route_top_collections: int = 0):
+        self.path = path
+        self.embeddings = embeddings
+        self.route_by_course_code = route_by_course_code
+        self.route_top_collections = route_top_collections
+        self.collections: dict[str, KnowledgeBaseCollection] = {}
+        for name, folder in list_collections(path) or [(DEFAULT_COLLECTION, "")]:
+            store = store_factory(name)
+            coarse = coarse_factory(store, index_dir_for(path, name)) if coarse_factory else None
+            self.collections[name] = KnowledgeBaseCollection(name, folder, store, coarse)
+        if route_top_collections > 0:
+            self._compute_centroids()
+
+    def _compute_centroids(self, batch_size: int = 5000):
+        for collection in self.collections.values():
+            raw = collection.store._collection
+            total, vector_sum = raw.count(), None
+            for offset in range(0, total, batch_size):
+                vectors = np.asarray(raw.get(include=["embeddings"], limit=batch_size, offset=offset)["embeddings"],
+                                     dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                batch_sum = vectors.sum(axis=0)
+                vector_sum = batch_sum if vector_sum is None else vector_sum + batch_sum
+            if vector_sum is not None:
+                collection.centroid = vector_sum / max(float(np.linalg.norm(vector_sum)), 1e-12)
+
+    def resolve(self, selectors: list[str]) -> tuple[str, ...]:
+        """Collection names for user-facing selectors: collection names, folder names or course codes"""
+        names = []
+        for selector in selectors:
+            selector = selector.strip()
+            if not selector:
+                continue
+            codes = course_codes(selector)
+            for collection in self.collections.values():
+                if selector in (collection.name, collection.folder) \
+                        or collection_name_for(selector) == collection.name \
+                        or (codes and codes <= course_codes(collection.folder)):
+                    names.append(collection.name)
+        if not names:
+            print(f"WARNING: No collection matches {selectors}")
+        return tuple(dict.fromkeys(names))
+
+    def route(self, query: str, query_vector: list[float]) -> list[str]:
+        """Cheap query-side routing; every collection when nothing narrows the question down"""
+        if len(self.collections) <= 1:
+            return list(self.collections)
+        if self.route_by_course_code:
+            codes = course_codes(query)
+            matched = [c.name for c in self.collections.values() if codes & course_codes(c.folder)]
+            if matched:
+                if DEFAULT_COLLECTION in self.collections and DEFAULT_COLLECTION not in matched:
+                    matched.append(DEFAULT_COLLECTION)
+                return matched
+        centroids = [c for c in self.collections.values() if c.centroid is not None and c.folder]
+        if self.route_top_collections > 0 and len(centroids) > self.route_top_collections:
+            query = np.asarray(query_vector, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            ranked = sorted(centroids, key=lambda c: -float(c.centroid @ query))
+            names = [c.name for c in ranked[:self.route_top_collections]]
+            if DEFAULT_COLLECTION in self.collections:
+                names.append(DEFAULT_COLLECTION)
+            return names
+        return list(self.collections)
+
+    def select(self, query: str, query_vector: list[float]) -> list[str]:
+        scope = current_scope.get()
+        if scope.collections is not None:
+            return [name for name in scope.collections if name in self.collections]
+        return self.route(query, query_vector)
+
+    @staticmethod
+    def _merge(results: list[list[tuple[Document, float]]], k: int) -> list[Document]:
+        merged = sorted((pair for result in results for pair in result), key=lambda pair: pair[1])
+        return [doc for doc, _ in merged[:k]]
+
+    def search(self, query_vector: list[float], names: list[str], k: int) -> list[Document]:
+        metadata_filter = current_scope.get().metadata_filter
+        return self._merge([self.collections[name].search(query_vector, k, metadata_filter) for name in names], k)
+
+    async def asearch(self, query_vector: list[float], names: list[str], k: int) -> list[Document]:
+        metadata_filter = current_scope.get().metadata_filter
+        results = await asyncio.gather(*(asyncio.to_thread(self.collections[name].search, query_vector, k,
+                                                           metadata_filter)
+                                         for name in names))
+        return self._merge(list(results), k)
+
+    def get_by_ids(self, ids: list[str]) -> list[Document]:
+        found: dict[str, Document] = {}
+        for collection in self.collections.values():
+            missing = [doc_id for doc_id in ids if doc_id not in found]
+            if not missing:
+                break
+            for doc in collection.store.get_by_ids(missing):
+                found[doc.id] = doc
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+
+    def get(self, **kwargs) -> dict:
+        """Chroma-style get() over every collection (results concatenated)"""
+        merged: dict[str, list] = {}
+        for collection in self.collections.values():
+            for key, values in collection.store.get(**kwargs).items():
+                if isinstance(values, list):
+                    merged.setdefault(key, []).extend(values)
+        return merged
+
+    def stats(self) -> list[dict]:
+        return [{"name": c.name, "folder": c.folder, "vectors": c.store._collection.count(),
+                 "coarse_index": c.coarse_retriever is not None} for c in self.collections.values()]
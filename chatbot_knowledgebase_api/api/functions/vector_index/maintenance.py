@@ -0,0 +1,344 @@
+# maintenance.py
+"""
+Vector index maintenance: remove a deleted file's vectors, report orphaned /
+duplicate / stale vectors and compact the store into a fresh snapshot.
+
+Usage (from the api directory):
+    python -m functions.vector_index.maintenance              # report only
+    python -m functions.vector_index.maintenance --compact    # drop orphans, duplicates and stale vectors
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from functions.utils.common import load_model_config, load_section_config
+from functions.utils.index_version import bump_index_version
+from functions.vector_index.kb_collections import (
+    CONTENT_HASH_KEY, INGESTED_AT_KEY, MARKDOWN_DIR, PUBLIC_DATA_DIR, RAW_DATA_DIR, list_collections, normalize_path,
+    source_to_relpath
+)
+from functions.vector_index.quantized_index import build_index_from_store, index_dir_for
+from functions.vector_index.snapshots import build_snapshot, snapshot_path
+
+
+def open_collections(path: str) -> list:
+    """Every Chroma collection of a snapshot (one per course / project folder)"""
+    import chromadb
+
+    client = chromadb.PersistentClient(path=path)
+    return [client.get_collection(name) for name, _ in list_collections(path)]
+
+
+def _iter_records(collection, include: list[str], batch_size: int = 2000):
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=include, limit=batch_size, offset=offset)
+        for i, doc_id in enumerate(batch["ids"]):
+            yield doc_id, {key: batch[key][i] for key in include}
+
+
+def ids_for_file(collection, relpath: str) -> list[str]:
+    """Ids of every chunk whose source is this public_data file (directly or through its analyzer markdown)"""
+    return ids_for_files(collection, [relpath])
+
+
+def ids_for_files(collection, relpaths: list[str]) -> list[str]:
+    """Ids of every chunk whose source is one of these public_data files (one pass over the collection)"""
+    relpaths = {normalize_path(relpath) for relpath in relpaths}
+    return [doc_id for doc_id, record in _iter_records(collection, ["metadatas"])
+            if source_to_relpath((record["metadatas"] or {}).get("source", "")) in relpaths]
+
+
+def has_indexed_content(root: str, relpath: str, content_hash: str) -> bool:
+    """True when the serving snapshot already holds chunks of this file (same path) with this content hash"""
+    relpath = normalize_path(relpath)
+    sources = [f"{RAW_DATA_DIR}/{relpath}", f"{RAW_DATA_DIR}/{MARKDOWN_DIR}/{relpath}.md"]
+    where = {"$and": [{"source": {"$in": sources}}, {CONTENT_HASH_KEY: content_hash}]}
+    return any(collection.get(where=where, limit=1, include=[])["ids"]
+               for collection in open_collections(snapshot_path(root)))
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def query_latency(collections: list, queries: int = 50, k: int = 4, seed: int = 42) -> dict:
+    """p50/p95 of an unrouted search (every collection's HNSW segment), using stored vectors as queries"""
+    collections = [collection for collection in collections if collection.count() > 0]
+    if not collections:
+        return {"queries": 0, "p50_ms": None, "p95_ms": None}
+    rng = np.random.default_rng(seed)
+    timings = []
+    for _ in range(queries):
+        source = collections[int(rng.integers(len(collections)))]
+        offset = int(rng.integers(source.count()))
+        vector = source.get(include=["embeddings"], limit=1, offset=offset)["embeddings"][0]
+        start = time.perf_counter()
+        for collection in collections:
+            collection.query(query_embeddings=[vector], n_results=min(k, collection.count()))
+        timings.append(time.perf_counter() - start)
+    return {
+        "queries": len(timings),
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(timings, 95)) * 1000, 2),
+    }
+
+
+def analyze(path: str, public_dir: str = PUBLIC_DATA_DIR, raw_dir: str = RAW_DATA_DIR) -> dict:
+    """
+    Classify the vectors of one snapshot.
+
+    orphaned: the source file exists in neither public_data nor raw_data
+    duplicate: same source and same chunk text as an earlier vector (re-ingested)
+    stale: the source file was modified after the vector was ingested (needs `ingested_at` metadata)
+    """
+    report = {"path": path, "total": 0, "orphaned": [], "duplicate": [], "stale": [], "unknown_age": 0,
+              "orphaned_sources": set(), "stale_sources": set(), "collections": {}, "coarse_index_vectors": None,
+              "coarse_index_orphaned": None}
+    seen = set()
+    exists: dict[str, float | None] = {}
+    for collection in open_collections(path):
+        report["collections"][collection.name] = collection.count()
+        _analyze_collection(collection, report, seen, exists, public_dir, raw_dir)
+    return report
+
+
+def _analyze_collection(collection, report: dict, seen: set, exists: dict, public_dir: str, raw_dir: str):
+    for doc_id, record in _iter_records(collection, ["metadatas", "documents"]):
+        report["total"] += 1
+        metadata = record["metadatas"] or {}
+        source = metadata.get("source", "")
+        relpath = source_to_relpath(source)
+
+        if relpath is not None:
+            if relpath not in exists:
+                mtime = None
+                for base in (public_dir, raw_dir):
+                    try:
+                        mtime = os.path.getmtime(os.path.join(base, relpath))
+                        break
+                    except OSError:
+                        continue
+                exists[relpath] = mtime
+            if exists[relpath] is None:
+                report["orphaned"].append(doc_id)
+                report["orphaned_sources"].add(relpath)
+                continue
+            ingested_at = metadata.get(INGESTED_AT_KEY)
+            if ingested_at is None:
+                report["unknown_age"] += 1
+            elif exists[relpath] > float(ingested_at):
+                report["stale"].append(doc_id)
+                report["stale_sources"].add(relpath)
+                continue
+
+        key = hashlib.sha256(f"{normalize_path(source)}\n{record['documents'] or ''}".encode("utf-8")).hexdigest()
+        if key in seen:
+            report["duplicate"].append(doc_id)
+        else:
+            seen.add(key)
+
+    # Coarse index entries whose vector is no longer in Chroma (index not rebuilt after a delete)
+    ids_path = os.path.join(index_dir_for(report["path"], collection.name), "ids.json")
+    if os.path.exists(ids_path):
+        with open(ids_path, "r", encoding="utf-8") as f:
+            index_ids = json.load(f)
+        report["coarse_index_vectors"] = (report["coarse_index_vectors"] or 0) + len(index_ids)
+        report["coarse_index_orphaned"] = (report["coarse_index_orphaned"] or 0) + \
+            len(set(index_ids) - set(collection.get(include=[])["ids"]))
+
+
+def summarize(report: dict) -> dict:
+    """JSON-friendly view of an analyze() report (counts and a sample of the affected sources)"""
+    return {
+        "path": report["path"],
+        "total": report["total"],
+        "collections": report["collections"],
+        "orphaned": len(report["orphaned"]),
+        "duplicate": len(report["duplicate"]),
+        "stale": len(report["stale"]),
+        "unknown_age": report["unknown_age"],
+        "orphaned_sources": sorted(report["orphaned_sources"])[:50],
+        "stale_sources": sorted(report["stale_sources"])[:50],
+        "coarse_index_vectors": report.get("coarse_index_vectors"),
+        "coarse_index_orphaned": report.get("coarse_index_orphaned"),
+        "size_bytes": directory_size(report["path"]),
+    }
+
+
+def rebuild_coarse_index(path: str):
+    """Re-encode the coarse search index of a snapshot when it is enabled (same rule as ingestion)"""
+    index_config = load_section_config('vector_index', {'quantization': 'none', 'pq_subspaces': 384})
+    search_dim = load_model_config().get('embedding_search_dimensions', 0)
+    if index_config['quantization'] != 'none' or search_dim > 0:
+        for collection_name, _ in list_collections(path):
+            build_index_from_store(path, method=index_config['quantization'], pq_subspaces=index_config['pq_subspaces'],
+                                   search_dim=search_dim or None, collection_name=collection_name)
+
+
+def _keep_snapshots() -> int:
+    return load_section_config('vector_index', {'keep_snapshots': 2})['keep_snapshots']
+
+
+def remove_file_vectors(root: str, relpath: str) -> int:
+    """Publish a snapshot without the vectors of a deleted public_data file; returns how many were removed"""
+    return remove_files_vectors(root, [relpath])
+
+
+def remove_files_vectors(root: str, relpaths: list[str]) -> int:
+    """Publish one snapshot without the vectors of several deleted public_data files; returns how many were removed"""
+    if not any(ids_for_files(collection, relpaths) for collection in open_collections(snapshot_path(root))):
+        return 0
+    removed = 0
+    with build_snapshot(root, keep=_keep_snapshots()) as path:
+        for target in open_collections(path):
+            ids = ids_for_files(target, relpaths)
+            for start in range(0, len(ids), 5000):
+                target.delete(ids=ids[start:start + 5000])
+            removed += len(ids)
+        rebuild_coarse_index(path)
+    bump_index_version(root)
+    print(f"INFO: Removed {removed} vectors of deleted file(s) {', '.join(relpaths)}")
+    return removed
+
+
+class VectorRemovalQueue:
+    """
+    Deleted files whose vectors still have to be removed from the index.
+
+    A delete request only queues the file; one background task removes the
+    vectors of everything queued so far in a single snapshot (the store is copied
+    once per batch, not per file) and waits for the ingest lock off the request
+    path. Vectors left behind by a failed batch are orphans, which compaction
+    removes. Used from the event loop only.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._pending: set[str] = set()
+        self._task: asyncio.Task | None = None
+        self.batches = 0
+        self.removed = 0
+        self.failed = 0
+
+    def submit(self, relpath: str):
+        self._pending.add(normalize_path(relpath))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending:
+            batch = sorted(self._pending)
+            self._pending.clear()
+            try:
+                self.removed += await asyncio.to_thread(remove_files_vectors, self.root, batch)
+                self.batches += 1
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"WARNING: Could not remove vectors of {', '.join(batch)} (compaction will drop them): {str(e)}")
+
+    async def aclose(self):
+        if self._task is not None and not self._task.done():
+            await self._task
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "running": self._task is not None and not self._task.done(),
+                "batches": self.batches, "removed": self.removed, "failed": self.failed}
+
+
+def compact(root: str, remove_orphaned: bool = True, remove_duplicate: bool = True, remove_stale: bool = True,
+            batch_size: int = 1000) -> dict:
+    """
+    Rewrite the serving snapshot into fresh collections without the dropped vectors.
+
+    Chroma only marks deleted vectors in the HNSW segment, so the new snapshot is
+    built by re-adding the kept records (with their stored embeddings, no API
+    calls) into an empty store; the graph is rebuilt without tombstones.
+
+    The serving snapshot is read under the ingest lock, so no snapshot published
+    by an ingestion or a file delete in the meantime is overwritten.
+    """
+    import chromadb
+
+    with build_snapshot(root, keep=_keep_snapshots(), copy=False) as path:
+        # CURRENT only changes under the ingest lock, which build_snapshot holds here
+        before_path = snapshot_path(root)
+        before = analyze(before_path)
+        before_collections = open_collections(before_path)
+        before_latency = query_latency(before_collections)
+        before_size = directory_size(before_path)
+        drop = set()
+        if remove_orphaned:
+            drop.update(before["orphaned"])
+        if remove_duplicate:
+            drop.update(before["duplicate"])
+        if remove_stale:
+            drop.update(before["stale"])
+
+        client = chromadb.PersistentClient(path=path)
+        targets = []
+        for source in before_collections:
+            target = client.create_collection(source.name, metadata=source.metadata or None)
+            targets.append(target)
+            batch = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+            for doc_id, record in _iter_records(source, ["embeddings", "documents", "metadatas"]):
+                if doc_id in drop:
+                    continue
+                batch["ids"].append(doc_id)
+                batch["embeddings"].append(record["embeddings"])
+                batch["documents"].append(record["documents"])
+                batch["metadatas"].append(record["metadatas"] or None)
+                if len(batch["ids"]) >= batch_size:
+                    target.add(**batch)
+                    batch = {key: [] for key in batch}
+            if batch["ids"]:
+                target.add(**batch)
+        rebuild_coarse_index(path)
+        after_latency = query_latency(targets)
+        after_size = directory_size(path)
+    bump_index_version(root)
+
+    result = {
+        "removed": {"orphaned": len(before["orphaned"]) if remove_orphaned else 0,
+                    "duplicate": len(before["duplicate"]) if remove_duplicate else 0,
+                    "stale": len(before["stale"]) if remove_stale else 0},
+        "before": {"vectors": before["total"], "size_bytes": before_size, "latency": before_latency},
+        "after": {"vectors": before["total"] - len(drop), "size_bytes": after_size, "latency": after_latency},
+    }
+    print(f"INFO: Compacted index: {result['before']['vectors']} -> {result['after']['vectors']} vectors, "
+          f"{result['before']['size_bytes']} -> {result['after']['size_bytes']} bytes")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on and compact the Chroma vector store")
+    parser.add_argument("--persist-dir", default="chroma_store")
+    parser.add_argument("--compact", action="store_true", help="Write a compacted snapshot and publish it")
+    parser.add_argument("--keep-orphaned", action="store_true")
+    parser.add_argument("--keep-duplicate", action="store_true")
+    parser.add_argument("--keep-stale", action="store_true")
+    args = parser.parse_args()
+
+    report = summarize(analyze(snapshot_path(args.persist_dir)))
+    report["latency"] = query_latency(open_collections(snapshot_path(args.persist_dir)))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.compact:
+        result = compact(args.persist_dir, remove_orphaned=not args.keep_orphaned,
+                         remove_duplicate=not args.keep_duplicate, remove_stale=not args.keep_stale)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# quantize_store.py
+"""
+Re-encode an existing chroma_store into quantized indexes (one per collection) and print a recall report.
+
+Usage (from the api directory):
+    python -m functions.vector_index.quantize_store --method int8
+    python -m functions.vector_index.quantize_store --method pq --pq-subspaces 384 --report-only
+    python -m functions.vector_index.quantize_store --collection kb_ltcb-a-ct101
+"""
+import argparse
+import json
+
+import numpy as np
+
+from functions.utils.common import load_model_config, load_section_config
+from functions.vector_index.kb_collections import list_collections
+from functions.vector_index.snapshots import snapshot_path
+from functions.vector_index.quantized_index import (
+    QuantizedIndex, build_index_from_store, chroma_vector_source, index_dir_for, open_chroma_collection,
+    recall_report
+)
+
+
+def main():
+    index_config = load_section_config('vector_index', {
+        'quantization': 'int8',
+        'pq_subspaces': 384,
+    })
+    model_config = load_model_config()
+    parser = argparse.ArgumentParser(description="Build a quantized copy of the Chroma vector store")
+    parser.add_argument("--persist-dir", default="chroma_store")
+    parser.add_argument("--method", choices=["none", "int8", "pq"], default=index_config['quantization'])
+    parser.add_argument("--pq-subspaces", type=int, default=index_config['pq_subspaces'])
+    parser.add_argument("--search-dimensions", type=int, default=model_config.get('embedding_search_dimensions', 0),
+                        help="Truncate vectors to this size for the coarse stage (0 = full size)")
+    parser.add_argument("--report-only", action="store_true", help="Skip re-encoding and report on the saved index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--collection", action="append",
+                        help="Only this collection (repeatable); every collection of the snapshot by default")
+    args = parser.parse_args()
+    store_dir = snapshot_path(args.persist_dir)
+
+    names = [name for name, _ in list_collections(store_dir) if not args.collection or name in args.collection]
+    if not names:
+        print(f"INFO: No matching collection in {store_dir}")
+        return
+
+    reports = {}
+    for collection_name in names:
+        vectors = None
+        if args.report_only:
+            # Served the same way as by the API: codes in memory, rescoring from Chroma
+            fetch = chroma_vector_source(open_chroma_collection(store_dir, collection_name))
+            index = QuantizedIndex.load(index_dir_for(store_dir, collection_name), vector_source=fetch)
+            if len(index) >= 2:
+                vectors = np.vstack([fetch(index.ids[start:start + 5000], index.dim) for start in range(0, len(index), 5000)])
+        else:
+            index = build_index_from_store(store_dir, method=args.method, pq_subspaces=args.pq_subspaces,
+                                           search_dim=args.search_dimensions or None,
+                                           collection_name=collection_name)
+
+        if len(index) < 2:
+            print(f"INFO: Not enough vectors in {collection_name} for a recall report")
+            continue
+        reports[collection_name] = recall_report(index, num_queries=args.queries, k=args.k, vectors=vectors)
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# quantized_index.py
+import json
+import os
+import time
+
+import numpy as np
+
+from functions.vector_index.quantizer import QUANTIZERS, create_quantizer
+
+INDEX_DIR_NAME = "quantized_index"
+DEFAULT_COLLECTION = "langchain"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that inner product equals cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class QuantizedIndex:
+    """
+    Compressed in-memory copy of the Chroma embeddings.
+
+    Candidates are scored against the coarse codes (the first `search_dim`
+    dimensions, optionally quantized), then the top `k * rescore_factor` are
+    rescored with their full-precision vectors. A saved index holds only the
+    codes: the full vectors of the candidates are fetched from the Chroma
+    collection (`vector_source`), which stores them anyway. A freshly built
+    index keeps the vectors it was built from (`full_vectors`) so that reports
+    and benchmarks can rescore without a store.
+    """
+
+    def __init__(self, ids: list[str], codes: np.ndarray, quantizer, dim: int, search_dim: int | None = None,
+                 full_vectors: np.ndarray | None = None, vector_source=None):
+        self.ids = ids
+        self.codes = codes
+        self.quantizer = quantizer
+        self.dim = dim
+        self.search_dim = search_dim or self.dim
+        self.full_vectors = full_vectors
+        self.vector_source = vector_source
+
+    @classmethod
+    def build(cls, ids: list[str], vectors: np.ndarray, method: str = "int8", pq_subspaces: int = 384,
+              search_dim: int | None = None) -> "QuantizedIndex":
+        vectors = normalize(vectors)
+        search_dim = min(search_dim or vectors.shape[1], vectors.shape[1])
+        # text-embedding-3 vectors can be shortened by truncating and re-normalizing
+        coarse = normalize(vectors[:, :search_dim])
+        quantizer = create_quantizer(method, pq_subspaces=pq_subspaces, dim=search_dim).fit(coarse)
+        codes = quantizer.encode(coarse)
+        dim = vectors.shape[1] if len(vectors) else 0
+        return cls(list(ids), codes, quantizer, dim, search_dim=search_dim, full_vectors=vectors)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query: np.ndarray, k: int = 4, rescore_factor: int = 10,
+               mask: np.ndarray | None = None) -> list[tuple[str, float]]:
+        """Return the `k` nearest ids with their cosine similarity (only rows where `mask` is True, if given)"""
+        if not self.ids:
+            return []
+        query = normalize(query)
+        approx = self.quantizer.scores(normalize(query[:self.search_dim]), self.codes)
+        allowed = len(self.ids)
+        if mask is not None:
+            allowed = int(mask.sum())
+            if allowed == 0:
+                return []
+            approx = np.where(mask, approx, -np.inf)
+
+        k = min(k, allowed)
+        n_candidates = min(allowed, max(k, k * rescore_factor))
+        if n_candidates < len(self.ids):
+            candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        else:
+            candidates = np.arange(len(self.ids))
+
+        full = self._full_vectors(candidates) if rescore_factor > 0 else None
+        exact = full @ query if full is not None else approx[candidates]
+        # ids no longer in the vector source come back as NaN rows; their documents cannot be loaded either
+        present = ~np.isnan(exact)
+        if not present.all():
+            candidates, exact = candidates[present], exact[present]
+
+        order = np.argsort(-exact)[:k]
+        return [(self.ids[candidates[i]], float(exact[i])) for i in order]
+
+    def _full_vectors(self, positions: np.ndarray) -> np.ndarray | None:
+        """Normalized full-size vectors of the given rows (None when there is nothing to rescore with)"""
+        if self.full_vectors is not None:
+            return np.asarray(self.full_vectors[positions], dtype=np.float32)
+        if self.vector_source is not None:
+            return normalize(self.vector_source([self.ids[i] for i in positions], self.dim))
+        return None
+
+    def memory_bytes(self) -> dict:
+        """Resident memory of the index (codes, quantizer and any full vectors held) compared with a float32 copy"""
+        quantizer_bytes = sum(v.nbytes for v in self.quantizer.state().values())
+        compressed = self.codes.nbytes + quantizer_bytes
+        full_bytes = self.full_vectors.nbytes if self.full_vectors is not None else 0
+        float32 = len(self.ids) * self.dim * 4
+        return {
+            "vectors": len(self.ids),
+            "dimensions": self.dim,
+            "search_dimensions": self.search_dim,
+            "compressed_bytes": int(compressed),
+            "full_vectors_bytes": int(full_bytes),
+            "resident_bytes": int(compressed + full_bytes),
+            "float32_bytes": int(float32),
+            "compression_ratio": round(float32 / compressed, 2) if compressed else 0.0,
+        }
+
+    def save(self, index_dir: str):
+        """
+        Write the codes next to the Chroma store (the full vectors stay in Chroma only);
+        meta.json is written last so readers never see a partial index
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "codes.npy"), self.codes)
+        # Indexes saved before rescoring read from Chroma kept a float32 copy here
+        stale_vectors = os.path.join(index_dir, "full_vectors.npy")
+        if os.path.exists(stale_vectors):
+            os.remove(stale_vectors)
+        np.savez(os.path.join(index_dir, "quantizer.npz"), **self.quantizer.state())
+        with open(os.path.join(index_dir, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        # Footprint once loaded, i.e. without the vectors this index was built from
+        meta = {**self.memory_bytes(), "full_vectors_bytes": 0}
+        meta["resident_bytes"] = meta["compressed_bytes"]
+        with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"method": self.quantizer.method, "built_at": time.time(), **meta}, f)
+
+    @classmethod
+    def load(cls, index_dir: str, vector_source=None) -> "QuantizedIndex":
+        """Load the codes; `vector_source(ids, dim)` returns the full vectors used for rescoring (NaN rows for unknown ids)"""
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "ids.json"), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+        with np.load(os.path.join(index_dir, "quantizer.npz")) as state:
+            quantizer = QUANTIZERS[meta["method"]].from_state(dict(state))
+        codes = np.load(os.path.join(index_dir, "codes.npy"))
+        return cls(ids, codes, quantizer, meta["dimensions"], search_dim=meta.get("search_dimensions"),
+                   vector_source=vector_source)
+
+
+def index_dir_for(persist_dir: str, collection_name: str = DEFAULT_COLLECTION) -> str:
+    """Coarse index directory of a collection (the default collection keeps the original location)"""
+    if collection_name == DEFAULT_COLLECTION:
+        return os.path.join(persist_dir, INDEX_DIR_NAME)
+    return os.path.join(persist_dir, INDEX_DIR_NAME, collection_name)
+
+
+def chroma_vector_source(collection):
+    """Fetch embeddings by id from a Chroma collection, in the order of the ids asked for"""
+    def fetch(ids: list[str], dim: int) -> np.ndarray:
+        batch = collection.get(ids=ids, include=["embeddings"])
+        by_id = {doc_id: np.asarray(vector, dtype=np.float32) for doc_id, vector in zip(batch["ids"], batch["embeddings"])}
+        # ids no longer in the collection get a NaN row of the index dimension, which search drops
+        missing = np.full(dim, np.nan, dtype=np.float32)
+        return np.asarray([by_id.get(doc_id, missing) for doc_id in ids], dtype=np.float32)
+    return fetch
+
+
+def open_chroma_collection(persist_dir: str, collection_name: str = DEFAULT_COLLECTION):
+    import chromadb
+
+    return chromadb.PersistentClient(path=persist_dir).get_collection(collection_name)
+
+
+def load_chroma_embeddings(persist_dir: str, collection_name: str = DEFAULT_COLLECTION, batch_size: int = 5000):
+    """Read every id and embedding of a persisted Chroma collection"""
+    collection = open_chroma_collection(persist_dir, collection_name)
+    total = collection.count()
+
+    ids: list[str] = []
+    vectors = []
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+        ids.extend(batch["ids"])
+        vectors.append(np.asarray(batch["embeddings"], dtype=np.float32))
+
+    if not vectors:
+        return ids, np.zeros((0, 0), dtype=np.float32)
+    return ids, np.vstack(vectors)
+
+
+def build_index_from_store(persist_dir: str, method: str = "int8", pq_subspaces: int = 384,
+                           search_dim: int | None = None,
+                           collection_name: str = DEFAULT_COLLECTION) -> QuantizedIndex:
+    """Re-encode an existing chroma_store into a quantized index saved inside it"""
+    print(f"INFO: Loading embeddings from {persist_dir}")
+    ids, vectors = load_chroma_embeddings(persist_dir, collection_name)
+    print(f"INFO: Building {method} index for {len(ids)} vectors (search dimensions: {search_dim or 'full'})")
+    index = QuantizedIndex.build(ids, vectors, method=method, pq_subspaces=pq_subspaces, search_dim=search_dim)
+    index.save(index_dir_for(persist_dir, collection_name))
+    print(f"INFO: Quantized index saved to {index_dir_for(persist_dir, collection_name)}: {index.memory_bytes()}")
+    return index
+
+
+def recall_report(index: QuantizedIndex, num_queries: int = 200, k: int = 10,
+                  rescore_factors: tuple[int, ...] = (0, 5, 10), seed: int = 42,
+                  vectors: np.ndarray | None = None) -> dict:
+    """
+    Compare the quantized index against exact float32 search.
+
+    Stored vectors are used as queries (leave-one-out): each query's own id is
+    removed from both result lists before computing recall@k. A loaded index does
+    not hold its vectors, so pass them (in the order of `index.ids`) as `vectors`.
+    """
+    if vectors is None:
+        vectors = index.full_vectors
+    if vectors is None:
+        raise ValueError("recall_report needs the full vectors of a loaded index")
+    full = normalize(vectors)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(index), min(num_queries, len(index)), replace=False)
+
+    baseline_times = []
+    truths = []
+    for i in picks:
+        start = time.perf_counter()
+        exact = full @ full[i]
+        top = np.argpartition(-exact, min(k + 1, len(exact) - 1))[:k + 1]
+        top = top[np.argsort(-exact[top])]
+        baseline_times.append(time.perf_counter() - start)
+        truths.append([index.ids[j] for j in top if j != i][:k])
+
+    report = {
+        "k": k,
+        "queries": len(picks),
+        "memory": index.memory_bytes(),
+        "float32_latency_ms": round(1000 * float(np.mean(baseline_times)), 3),
+        "runs": [],
+    }
+    for factor in rescore_factors:
+        times = []
+        hits = 0
+        for i, truth in zip(picks, truths):
+            start = time.perf_counter()
+            found = index.search(full[i], k=k + 1, rescore_factor=factor)
+            times.append(time.perf_counter() - start)
+            found_ids = [doc_id for doc_id, _ in found if doc_id != index.ids[i]][:k]
+            hits += len(set(found_ids) & set(truth))
+        report["runs"].append({
+            "rescore_factor": factor,
+            f"recall@{k}": round(hits / max(1, sum(len(t) for t in truths)), 4),
+            "latency_ms": round(1000 * float(np.mean(times)), 3),
+        })
+    return report
@@ -0,0 +1,191 @@
+# quantizer.py
+import math
+
+import numpy as np
+
+
+class Float32Quantizer:
+    """No compression: the coarse stage scores the (possibly truncated) float32 vectors directly"""
+    method = "float32"
+
+    def fit(self, vectors: np.ndarray):
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        return codes @ query.astype(np.float32)
+
+    def code_size(self, dim: int) -> int:
+        return dim * 4
+
+    def state(self) -> dict:
+        return {}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Float32Quantizer":
+        return cls()
+
+
+class ScalarQuantizer:
+    """
+    Int8 scalar quantization: each dimension is mapped linearly from [min, max] to [0, 255].
+    Uses 4x less memory than float32.
+    """
+    method = "int8"
+
+    def __init__(self):
+        self.offset: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+
+    def fit(self, vectors: np.ndarray):
+        """Learn the per-dimension min/max"""
+        lo = vectors.min(axis=0)
+        hi = vectors.max(axis=0)
+        self.offset = lo.astype(np.float32)
+        self.scale = np.maximum((hi - lo) / 255.0, 1e-12).astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def scores(self, query: np.ndarray, codes: np.ndarray, block_size: int = 8192) -> np.ndarray:
+        """Inner product between a float32 query and the codes, block by block so the index is never fully decoded"""
+        q_scaled = (query * self.scale).astype(np.float32)
+        bias = float(query @ self.offset)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = codes[start:start + block_size].astype(np.float32)
+            out[start:start + block_size] = block @ q_scaled + bias
+        return out
+
+    def code_size(self, dim: int) -> int:
+        return dim
+
+    def state(self) -> dict:
+        return {"offset": self.offset, "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ScalarQuantizer":
+        quantizer = cls()
+        quantizer.offset = state["offset"].astype(np.float32)
+        quantizer.scale = state["scale"].astype(np.float32)
+        return quantizer
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are split into `subspaces` parts and each part is replaced
+    by the id of its nearest centroid (1 byte). 1536 dims with 384 subspaces uses 16x less memory.
+    """
+    method = "pq"
+
+    def __init__(self, subspaces: int = 384, centroids: int = 256, iterations: int = 15,
+                 max_train_vectors: int = 20000, seed: int = 42):
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.iterations = iterations
+        self.max_train_vectors = max_train_vectors
+        self.seed = seed
+        self.codebooks: np.ndarray | None = None  # (subspaces, centroids, sub_dim)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        return vectors.reshape(n, self.subspaces, dim // self.subspaces)
+
+    def _assign(self, parts: np.ndarray, group: int = 32) -> np.ndarray:
+        """Find the nearest centroid of every part, a group of subspaces at a time to bound temporary memory"""
+        n = parts.shape[0]
+        codes = np.empty((n, self.subspaces), dtype=np.uint8)
+        c_norms = (self.codebooks ** 2).sum(axis=2)  # (m, k)
+        for s in range(0, self.subspaces, group):
+            x = parts[:, s:s + group, :].transpose(1, 0, 2)  # (g, n, d)
+            c = self.codebooks[s:s + group]  # (g, k, d)
+            dist = c_norms[s:s + group][:, None, :] - 2.0 * np.matmul(x, c.transpose(0, 2, 1))
+            codes[:, s:s + group] = dist.argmin(axis=2).T
+        return codes
+
+    def fit(self, vectors: np.ndarray):
+        """Train one k-means codebook per subspace"""
+        n, dim = vectors.shape
+        if dim % self.subspaces != 0:
+            raise ValueError(f"Dimension {dim} is not divisible by {self.subspaces} subspaces")
+
+        rng = np.random.default_rng(self.seed)
+        if n > self.max_train_vectors:
+            vectors = vectors[rng.choice(n, self.max_train_vectors, replace=False)]
+            n = self.max_train_vectors
+        self.centroids = min(self.centroids, 256, n)
+
+        parts = self._split(vectors.astype(np.float32))
+        self.codebooks = parts[rng.choice(n, self.centroids, replace=False)].transpose(1, 0, 2).copy()
+
+        for _ in range(self.iterations):
+            codes = self._assign(parts)
+            for s in range(self.subspaces):
+                counts = np.bincount(codes[:, s], minlength=self.centroids)
+                sums = np.zeros((self.centroids, parts.shape[2]), dtype=np.float32)
+                np.add.at(sums, codes[:, s], parts[:, s, :])
+                filled = counts > 0
+                self.codebooks[s][filled] = sums[filled] / counts[filled][:, None]
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return self._assign(self._split(vectors.astype(np.float32)))
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.subspaces)[None, :], codes]  # (n, m, d)
+        return parts.reshape(len(codes), -1)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """Asymmetric distance computation using a query-to-centroid inner product lookup table"""
+        q_parts = query.astype(np.float32).reshape(self.subspaces, -1)
+        table = np.einsum("md,mkd->mk", q_parts, self.codebooks)  # (m, k)
+        out = np.empty(len(codes), dtype=np.float32)
+        rows = np.arange(self.subspaces)[None, :]
+        for start in range(0, len(codes), block_size):
+            out[start:start + block_size] = table[rows, codes[start:start + block_size]].sum(axis=1)
+        return out
+
+    def code_size(self, dim: int) -> int:
+        return self.subspaces
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ProductQuantizer":
+        codebooks = state["codebooks"].astype(np.float32)
+        quantizer = cls(subspaces=codebooks.shape[0], centroids=codebooks.shape[1])
+        quantizer.codebooks = codebooks
+        return quantizer
+
+
+QUANTIZERS = {
+    Float32Quantizer.method: Float32Quantizer,
+    ScalarQuantizer.method: ScalarQuantizer,
+    ProductQuantizer.method: ProductQuantizer,
+}
+
+
+def create_quantizer(method: str, pq_subspaces: int = 384, dim: int | None = None):
+    """Create a quantizer from the method name used in config ("none" keeps float32)"""
+    if method in ("none", Float32Quantizer.method):
+        return Float32Quantizer()
+    if method == ScalarQuantizer.method:
+        return ScalarQuantizer()
+    if method == ProductQuantizer.method:
+        if dim and dim % pq_subspaces != 0:
+            # Truncated search vectors (e.g. 256/512 dims) need a subspace count that divides them
+            pq_subspaces = math.gcd(pq_subspaces, dim)
+            print(f"INFO: Using {pq_subspaces} PQ subspaces for {dim}-dimensional search vectors")
+        return ProductQuantizer(subspaces=pq_subspaces)
+    raise ValueError(f"Unsupported quantization method: {method}")
@@ -0,0 +1,71 @@
+# retriever.py
+import os
+from typing import Any
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from functions.vector_index.quantized_index import QuantizedIndex, chroma_vector_source
+
+
+class QuantizedRetriever(BaseRetriever):
+    """
+    Retriever that searches the quantized index instead of Chroma's HNSW segment
+    and loads the matching documents from Chroma by id.
+
+    The index is reloaded automatically when ingestion rewrites it.
+    """
+    vectorstore: Any
+    index_dir: str
+    k: int = 4
+    rescore_factor: int = 10
+
+    _index: QuantizedIndex | None = None
+    _index_mtime: float = 0.0
+
+    def get_index(self) -> QuantizedIndex:
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        mtime = os.path.getmtime(meta_path)
+        if self._index is None or mtime != self._index_mtime:
+            # Shortlisted candidates are rescored with the embeddings Chroma stores
+            self._index = QuantizedIndex.load(self.index_dir,
+                                              vector_source=chroma_vector_source(self.vectorstore._collection))
+            self._index_mtime = mtime
+            print(f"INFO: Loaded quantized index from {self.index_dir} ({len(self._index)} vectors)")
+        return self._index
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        query_vector = np.asarray(self.vectorstore.embeddings.embed_query(query), dtype=np.float32)
+        hits = self.get_index().search(query_vector, k=self.k, rescore_factor=self.rescore_factor)
+        ids = [doc_id for doc_id, _ in hits]
+        by_id = {doc.id: doc for doc in self.vectorstore.get_by_ids(ids)}
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+
+class SnapshotRetriever(BaseRetriever):
+    """Delegates to the retriever of the currently published index snapshot (see LiveIndex)"""
+    index: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.index.current().retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        return await self.index.current().retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+
+
+class KnowledgeBaseRetriever(BaseRetriever):
+    """Searches the collections of a KnowledgeBase selected for the request (explicit scope or router)"""
+    knowledge_base: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        query_vector = self.knowledge_base.embeddings.embed_query(query)
+        names = self.knowledge_base.select(query, query_vector)
+        return self.knowledge_base.search(query_vector, names, self.k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager) -> list[Document]:
+        query_vector = await self.knowledge_base.embeddings.aembed_query(query)
+        names = self.knowledge_base.select(query, query_vector)
+        return await self.knowledge_base.asearch(query_vector, names, self.k)
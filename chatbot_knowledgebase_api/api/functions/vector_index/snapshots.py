@@ -0,0 +1,258 @@
+# snapshots.py
+import asyncio
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, NamedTuple
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_DIR = "snapshots"
+LOCK_FILE = ".ingest.lock"
+LEGACY_SNAPSHOT = "legacy"
+
+# Root-level files that belong to the store itself, not to a snapshot
+_ROOT_ONLY = {CURRENT_FILE, SNAPSHOTS_DIR, LOCK_FILE, "index_version", "index_version.tmp", f"{CURRENT_FILE}.tmp"}
+
+
+def current_snapshot(root: str) -> str | None:
+    """Name of the published snapshot, or None for a store that has never been snapshotted"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    return name or None
+
+
+def snapshot_path(root: str, name: str | None = None) -> str:
+    """Directory of a snapshot (the published one by default); the root itself for the legacy layout"""
+    name = name or current_snapshot(root)
+    if name is None or name == LEGACY_SNAPSHOT:
+        return root
+    return os.path.join(root, SNAPSHOTS_DIR, name)
+
+
+def publish_snapshot(root: str, name: str):
+    """Atomically point CURRENT at a finished snapshot"""
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    print(f"INFO: Published index snapshot {name}")
+
+
+@contextmanager
+def _ingest_lock(root: str, timeout: float = 3600, stale_after: float = 6 * 3600):
+    """One snapshot build at a time, across processes (a lock file older than `stale_after` is taken over)"""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, LOCK_FILE)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    print(f"WARNING: Removing stale ingest lock {path}")
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Another ingestion holds {path}")
+            time.sleep(1)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def build_snapshot(root: str, keep: int = 2, copy: bool = True):
+    """
+    Build a new snapshot next to the serving one and publish it on success.
+
+    The published snapshot (or the legacy store in `root`) is copied into
+    snapshots/<name> (or it starts empty with copy=False), the caller adds documents and rebuilds indexes in the
+    yielded directory, and CURRENT is swapped only when the block exits without
+    error. A failed build is deleted and never touches the serving snapshot.
+
+    The lock wait and the store copy block for minutes, so this must not run on
+    an event loop thread (API callers use asyncio.to_thread).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError("build_snapshot blocks; run it in a worker thread (asyncio.to_thread)")
+    with _ingest_lock(root):
+        name = str(time.time_ns())
+        base = snapshot_path(root)
+        path = os.path.join(root, SNAPSHOTS_DIR, name)
+        if copy and os.path.exists(os.path.join(base, "chroma.sqlite3")):
+            print(f"INFO: Copying index snapshot {base} -> {path}")
+            shutil.copytree(base, path, ignore=lambda d, names: _ROOT_ONLY & set(names) if d == base else set())
+        else:
+            os.makedirs(path)
+        try:
+            yield path
+        except BaseException:
+            print(f"ERROR: Snapshot {name} failed - keeping {current_snapshot(root) or LEGACY_SNAPSHOT}")
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        publish_snapshot(root, name)
+        gc_snapshots(root, keep=keep)
+
+
+def gc_snapshots(root: str, keep: int = 2) -> list[str]:
+    """
+    Delete snapshots older than the `keep` most recent published ones.
+
+    Runs under the ingest lock, so directories newer than CURRENT are leftovers
+    of crashed builds. The previous snapshot is kept (keep >= 2) because the API
+    may still be answering queries from it right after a swap.
+    """
+    current = current_snapshot(root)
+    snapshots_dir = os.path.join(root, SNAPSHOTS_DIR)
+    if current is None or not os.path.isdir(snapshots_dir):
+        return []
+    names = sorted(os.listdir(snapshots_dir), key=lambda n: int(n) if n.isdigit() else -1)
+    published = [n for n in names if n.isdigit() and int(n) <= int(current)]
+    retained = set(published[-max(keep, 1):]) | {current}
+    removed = []
+    for name in names:
+        if name in retained:
+            continue
+        try:
+            shutil.rmtree(os.path.join(snapshots_dir, name))
+            removed.append(name)
+        except OSError as e:
+            print(f"WARNING: Could not remove snapshot {name} (still open?): {str(e)}")
+    if removed:
+        print(f"INFO: Removed {len(removed)} old index snapshot(s): {', '.join(removed)}")
+    return removed
+
+
+def release_chroma_clients(path: str) -> int:
+    """
+    Stop the Chroma systems this process caches for a snapshot directory.
+
+    chromadb keeps one system (sqlite connections, loaded HNSW segments) per
+    persist directory for the life of the process; stopping it frees them. Any
+    client or vector store still pointing at the directory stops working, so
+    only call this for snapshots nothing reads from any more.
+    """
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError:
+        return 0
+    target = os.path.abspath(path)
+    systems = SharedSystemClient._identifier_to_system
+    released = 0
+    for identifier in [identifier for identifier in list(systems) if os.path.abspath(identifier) == target]:
+        system = systems.pop(identifier, None)
+        if system is None:
+            continue
+        try:
+            system.stop()
+            released += 1
+        except Exception as e:
+            print(f"WARNING: Could not stop the Chroma client of {identifier}: {str(e)}")
+    return released
+
+
+class LoadedSnapshot(NamedTuple):
+    name: str
+    path: str
+    vectorstore: Any
+    retriever: Any
+
+
+class LiveIndex:
+    """
+    Query-side handle on the published snapshot, hot-reloaded when CURRENT changes.
+
+    The pointer is checked at most every `check_interval` seconds. The request that
+    notices a new snapshot loads it while concurrent requests keep using the one
+    they already hold, then the reference is swapped; reads never wait for a load
+    or for ingestion. Attribute access is delegated to the current vector store,
+    so the handle can be used wherever the Chroma instance was.
+
+    A replaced snapshot's Chroma clients are released `release_after` seconds
+    after the swap, once requests that started on it have finished; otherwise
+    every reload would keep the old store's memory and sqlite handles open.
+    """
+
+    def __init__(self, root: str, loader: Callable[[str], tuple[Any, Any]], check_interval: float = 1.0,
+                 release_after: float = 300):
+        self.root = root
+        self.loader = loader
+        self.check_interval = check_interval
+        self.release_after = release_after
+        self.reloads = 0
+        self.released = 0
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._retired: list[tuple[float, LoadedSnapshot]] = []
+        self._current = self._load(current_snapshot(root) or LEGACY_SNAPSHOT)
+
+    def _load(self, name: str) -> LoadedSnapshot:
+        path = snapshot_path(self.root, name)
+        vectorstore, retriever = self.loader(path)
+        print(f"INFO: Serving index snapshot {name} ({path})")
+        return LoadedSnapshot(name, path, vectorstore, retriever)
+
+    def current(self) -> LoadedSnapshot:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                name = current_snapshot(self.root) or LEGACY_SNAPSHOT
+                if name != self._current.name:
+                    try:
+                        previous, self._current = self._current, self._load(name)
+                        self._retired.append((now, previous))
+                        self.reloads += 1
+                    except Exception as e:
+                        print(f"ERROR: Could not load index snapshot {name} - still serving {self._current.name}: {str(e)}")
+                self._release_retired(now)
+            finally:
+                self._lock.release()
+        return self._current
+
+    def _release_retired(self, now: float):
+        """Free the Chroma clients of snapshots replaced more than `release_after` seconds ago"""
+        while self._retired and now - self._retired[0][0] >= self.release_after:
+            _, snapshot = self._retired.pop(0)
+            if snapshot.path == self._current.path or any(s.path == snapshot.path for _, s in self._retired):
+                continue
+            if release_chroma_clients(snapshot.path):
+                self.released += 1
+                print(f"INFO: Released the Chroma client of index snapshot {snapshot.name}")
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.current().vectorstore, name)
+
+    def stats(self) -> dict:
+        snapshots_dir = os.path.join(self.root, SNAPSHOTS_DIR)
+        return {
+            "serving": self._current.name,
+            "published": current_snapshot(self.root) or LEGACY_SNAPSHOT,
+            "reloads": self.reloads,
+            "released": self.released,
+            "retired": len(self._retired),
+            "snapshots_on_disk": len(os.listdir(snapshots_dir)) if os.path.isdir(snapshots_dir) else 0,
+        }
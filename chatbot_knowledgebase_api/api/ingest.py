@@ -2,7 +2,9 @@ import os
 import dotenv
 import ssl
 import gc
-from functions.utils.common import load_proxy_config, load_model_config
+import time
+import uuid
+from functions.utils.common import load_proxy_config, load_model_config, load_section_config
 
 from langchain_community.document_loaders import PyPDFLoader, UnstructuredWordDocumentLoader, UnstructuredPowerPointLoader, UnstructuredExcelLoader, TextLoader, UnstructuredFileLoader
 from langchain_community.document_loaders import DirectoryLoader
@@ -13,6 +15,13 @@ from pydantic import SecretStr
 
 from functions.ppt_analyzer import ppt_analyzer
 from functions.xlsx_analyzer import xlsx_analyzer
+from functions.vector_index.quantized_index import build_index_from_store
+from functions.vector_index.snapshots import build_snapshot
+from functions.vector_index.kb_collections import CONTENT_HASH_KEY, collection_name_for, document_metadata, folder_for_source, list_collections
+from functions.vector_index.maintenance import open_collections
+from functions.utils.index_version import bump_index_version
+from functions.utils.http_clients import get_sync_client
+from functions.utils.rate_limit import BACKGROUND, priority
 
 # Import img_analyzer with error handling
 try:
@@ -31,11 +40,17 @@ class DocumentIngestor:
                  output_data_dir: str = "data/raw_data/markdown", 
                  prompt_md_path: str = "instructions/analystic",
                  persist_dir: str = "chroma_store",
-                 batch_size: int = 50):
+                 batch_size: int = 50,
+                 content_hashes: dict[str, str] | None = None):
         
         # Load configurations
         self.proxy = load_proxy_config()
         self.model_config = load_model_config()
+        self.index_config = load_section_config('vector_index', {
+            'quantization': 'none',
+            'pq_subspaces': 384,
+            'keep_snapshots': 2,
+        })
         
         # Configuration
         self.data_dir = data_dir
@@ -43,6 +58,8 @@ class DocumentIngestor:
         self.prompt_md_path = prompt_md_path
         self.persist_dir = persist_dir
         self.batch_size = batch_size
+        # sha256 per raw_data file already computed by the upload (normalized path -> hash)
+        self.content_hashes = dict(content_hashes or {})
         
         # Prompt settings
         self.prompt_ppt_path = f"{prompt_md_path}/ppt_analyzer.md"
@@ -198,34 +215,125 @@ class DocumentIngestor:
         documents = splitter.split_documents(docs)
         print(f"INFO: Split into {len(documents)} chunks")
 
+        # Normalized metadata (course folder, extension, content hash, ingest time) for filtered queries
+        ingested_at = time.time()
+        hashes = dict(self.content_hashes)
+        for document in documents:
+            document.metadata.update(document_metadata(document.metadata.get('source', ''), ingested_at, hashes))
+
         # 3. Create embeddings and store in Chroma
         print("INFO: Creating embeddings and storing in ChromaDB")
         embedding = OpenAIEmbeddings(
             model=self.model_config['embedding_model'],
             api_key=self.model_config.get('embedding_api_key', self.model_config['openai_api_key']),
-            base_url=self.model_config.get('embedding_base_url', None) if self.model_config.get('embedding_base_url') else None
+            base_url=self.model_config.get('embedding_base_url', None) if self.model_config.get('embedding_base_url') else None,
+            http_client=get_sync_client()
         )
         
-        vectorstore = Chroma(embedding_function=embedding, persist_directory=self.persist_dir)
-        
-        # Process in batches
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i+self.batch_size]
-            print(f"INFO: Processing batch {i//self.batch_size + 1}/{(len(documents) + self.batch_size - 1)//self.batch_size}")
-            vectorstore.add_documents(batch)
-
-        vectorstore.persist()
-        print(f"✅ Successfully embedded {len(documents)} text chunks from {len(docs)} documents into ChromaDB.")
+        # Build into a new snapshot; the serving one is only replaced when everything below succeeded
+        with build_snapshot(self.persist_dir, keep=self.index_config['keep_snapshots']) as snapshot_dir:
+            # Vectors already in the snapshot, checked by content hash before anything is embedded
+            existing_collections = open_collections(snapshot_dir)
+            totals = {"skipped_files": 0, "replaced_vectors": 0, "reused_embeddings": 0, "embedded": 0}
+
+            # One collection per course / project folder under data/public_data/data/
+            partitions: dict[str, list] = {}
+            for document in documents:
+                partitions.setdefault(folder_for_source(document.metadata.get('source', '')), []).append(document)
+
+            for folder, folder_documents in sorted(partitions.items()):
+                collection_name = collection_name_for(folder)
+                print(f"INFO: Collection {collection_name} ({folder or 'unpartitioned'}): {len(folder_documents)} chunks")
+                vectorstore = Chroma(embedding_function=embedding, persist_directory=snapshot_dir,
+                                     collection_name=collection_name,
+                                     collection_metadata={"folder": folder} if folder else None)
+
+                to_embed = self._index_incrementally(vectorstore, folder_documents, existing_collections, totals)
+
+                # Process in batches
+                for i in range(0, len(to_embed), self.batch_size):
+                    batch = to_embed[i:i+self.batch_size]
+                    print(f"INFO: Processing batch {i//self.batch_size + 1}/{(len(to_embed) + self.batch_size - 1)//self.batch_size}")
+                    vectorstore.add_documents(batch)
+                totals["embedded"] += len(to_embed)
+
+                vectorstore.persist()
+            print(f"INFO: Incremental ingest: {totals['skipped_files']} unchanged files skipped, "
+                  f"{totals['replaced_vectors']} vectors of replaced files removed, "
+                  f"{totals['reused_embeddings']} embeddings reused, {totals['embedded']} chunks embedded")
+            print(f"✅ Successfully embedded {len(documents)} text chunks from {len(docs)} documents into ChromaDB.")
+
+            # 4. Re-encode the coarse search index of every collection so it matches the updated store.
+            # Chroma keeps the full-size vectors, which the index uses for exact rescoring.
+            search_dim = self.model_config.get('embedding_search_dimensions', 0)
+            if self.index_config['quantization'] != 'none' or search_dim > 0:
+                for collection_name, _ in list_collections(snapshot_dir):
+                    print(f"INFO: Rebuilding {self.index_config['quantization']} coarse index of {collection_name} ({search_dim or 'full'} dims)")
+                    build_index_from_store(snapshot_dir,
+                                           method=self.index_config['quantization'],
+                                           pq_subspaces=self.index_config['pq_subspaces'],
+                                           search_dim=search_dim or None,
+                                           collection_name=collection_name)
+
+        # 5. Publish the new index version so query-side caches drop stale entries
+        bump_index_version(self.persist_dir)
         return len(documents), len(docs)
     
+    def _index_incrementally(self, vectorstore, documents: list, existing_collections: list, totals: dict) -> list:
+        """
+        Use each file's content hash to avoid re-indexing: files already indexed
+        with the same source and hash are skipped, the vectors of an older version
+        of a file are removed, and chunks of content indexed elsewhere (a copy of
+        the file under another path) are added with their stored embeddings.
+        Returns the chunks that still need the embeddings API.
+        """
+        by_source: dict[str, list] = {}
+        for document in documents:
+            by_source.setdefault(document.metadata.get('source', ''), []).append(document)
+
+        to_embed = []
+        for source, chunks in by_source.items():
+            content_hash = chunks[0].metadata.get(CONTENT_HASH_KEY)
+            if content_hash:
+                where = {"$and": [{"source": source}, {CONTENT_HASH_KEY: content_hash}]}
+                if any(collection.get(where=where, limit=1, include=[])["ids"] for collection in existing_collections):
+                    print(f"INFO: Unchanged, skipped: {source}")
+                    totals["skipped_files"] += 1
+                    continue
+
+            for collection in existing_collections:
+                stale_ids = collection.get(where={"source": source}, include=[])["ids"]
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+                    totals["replaced_vectors"] += len(stale_ids)
+
+            stored = {}
+            if content_hash:
+                for collection in existing_collections:
+                    found = collection.get(where={CONTENT_HASH_KEY: content_hash}, include=["documents", "embeddings"])
+                    for text, vector in zip(found["documents"], found["embeddings"]):
+                        stored.setdefault(text, list(vector))
+            reused = [chunk for chunk in chunks if chunk.page_content in stored]
+            for i in range(0, len(reused), self.batch_size):
+                batch = reused[i:i + self.batch_size]
+                vectorstore._collection.add(ids=[str(uuid.uuid4()) for _ in batch],
+                                            embeddings=[stored[chunk.page_content] for chunk in batch],
+                                            documents=[chunk.page_content for chunk in batch],
+                                            metadatas=[chunk.metadata for chunk in batch])
+            totals["reused_embeddings"] += len(reused)
+            to_embed.extend(chunk for chunk in chunks if chunk.page_content not in stored)
+        return to_embed
+
     def run(self):
         """Main method to run the ingestion process"""
         print("INFO: Starting document ingestion process")
         try:
-            # Convert documents using specialized analyzers
-            self.convert_all_documents()
-            
-            result = self.process_documents()
+            # Analyzer and embedding calls share the API key with live queries, so they run in the background class
+            with priority(BACKGROUND):
+                # Convert documents using specialized analyzers
+                self.convert_all_documents()
+
+                result = self.process_documents()
             print("INFO: Document ingestion completed successfully")
             return result
         except Exception as e:
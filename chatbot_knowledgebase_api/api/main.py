@@ -1,19 +1,73 @@
 import asyncio
+import json
 import os
+import stat
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
-from agent import QueueCallbackHandler, agent_executor
-from upload import FileUploads
+from agent import PERSIST_DIR, QueueCallbackHandler, agent_config, agent_executor, cache_stats, llm_stats, session_memory, use_fast_path, vectordb
+from functions.utils.json_stream import IncrementalJSONStringField
+from functions.utils.http_clients import aclose_clients, http_client_stats
+from functions.utils.admission import AdmissionController, AdmissionRejected, AdmissionTicket
+from functions.utils.common import load_section_config
+from functions.utils.file_response import DownloadResponse, accel_redirect_response, etag_matches, load_download_config
+from functions.utils.file_tree import SORT_KEYS, load_file_index_config, public_files
+from functions.utils.metrics import cancellations, latency_stats, observe_latency
+from functions.utils.rate_limit import rate_limiter
+from functions.vector_index import maintenance
+from functions.vector_index.kb_collections import MetadataFilter
+from functions.vector_index.snapshots import snapshot_path
+from upload import FileUploads, UploadSizeLimit
 from settings import Settings
 from models.settings_models import SettingsUpdate
 
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Form, Request
+
+file_index_config = load_file_index_config()
+download_config = load_download_config()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # index public_data once; uploads, deletes and the watcher keep it current
+    await asyncio.to_thread(public_files.build)
+    watcher = asyncio.create_task(public_files.watch()) if file_index_config['watch'] else None
+    yield
+    if watcher:
+        watcher.cancel()
+        try:
+            await watcher
+        except asyncio.CancelledError:
+            pass
+    # let a running vector removal publish its snapshot (its worker thread cannot be interrupted)
+    await vector_removals.aclose()
+    # close the shared OpenAI connection pool
+    await aclose_clients()
 
 # initializing our application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
+# Vectors of deleted files are removed in the background, several deletes per snapshot
+vector_removals = maintenance.VectorRemovalQueue(PERSIST_DIR)
+
+# Concurrency limit and fair wait queue for /invoke streams
+admission_config = load_section_config('admission', {
+    'max_concurrent': 8,
+    'max_queue': 32,
+    'max_queue_per_client': 4,
+    'max_wait': 30,
+})
+admission = AdmissionController(max_concurrent=admission_config['max_concurrent'],
+                                max_queue=admission_config['max_queue'],
+                                max_queue_per_client=admission_config['max_queue_per_client'],
+                                max_wait=admission_config['max_wait'])
+
+# rejects oversized uploads while they are received, before Starlette spools them to disk
+# (registered first so that CORS, added after it, wraps its 413 responses)
+app.add_middleware(UploadSizeLimit)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -25,46 +79,221 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Session-ID"],
 )
 
+def start_agent_task(content: str, streamer: QueueCallbackHandler, mode: str,
+                     session_id: str | None = None, collections: list[str] | None = None,
+                     filters: MetadataFilter | None = None) -> tuple[str, asyncio.Task]:
+    """Route the question and start the executor in the background; tokens arrive through the streamer"""
+    route = "direct" if use_fast_path(content, mode) else "agent"
+    if route == "direct":
+        # ordinary questions: one retrieval and one grounded completion
+        task = asyncio.create_task(agent_executor.invoke_direct(
+            input=content,
+            streamer=streamer,
+            session_id=session_id,
+            collections=collections,
+            filters=filters
+        ))
+    else:
+        task = asyncio.create_task(agent_executor.invoke(
+            input=content,
+            streamer=streamer,
+            verbose=True,  # set to True to see verbose output in console
+            session_id=session_id,
+            collections=collections,
+            filters=filters
+        ))
+    return route, task
+
+async def watch_disconnect(request: Request, task: asyncio.Task, streamer: QueueCallbackHandler):
+    """Cancel the executor as soon as the client goes away, also while the agent is still thinking"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            break
+    if not task.done():
+        streamer.disconnected = True
+        # cancelling the task aborts the in-flight LLM and embedding HTTP requests it is awaiting
+        task.cancel()
+        streamer.finish()
+
+@asynccontextmanager
+async def agent_run(content: str, streamer: QueueCallbackHandler, mode: str, request: Request | None,
+                    session_id: str | None, ticket: AdmissionTicket | None, collections: list[str] | None = None,
+                    filters: MetadataFilter | None = None):
+    """Start the executor for one /invoke stream and make sure it never outlives the response"""
+    route, task = start_agent_task(content, streamer, mode, session_id, collections, filters)
+    watcher = asyncio.create_task(watch_disconnect(request, task, streamer)) if request else None
+    try:
+        yield route, task
+    finally:
+        if ticket:
+            ticket.release()
+        if watcher:
+            watcher.cancel()
+        if not task.done():
+            # the response was closed before the executor finished: the client went away
+            if not streamer.timed_out:
+                streamer.disconnected = True
+            task.cancel()
+        if streamer.cancelled:
+            reason = "timeout" if streamer.timed_out else "disconnect"
+            saved = cancellations.record_cancelled(route, reason, streamer.token_count)
+            streamer.discard()
+            print(f"INFO: Cancelled {route} request ({reason}) after {streamer.token_count} tokens, ~{saved} tokens saved")
+        else:
+            cancellations.record_completed(route, streamer.token_count)
+
+async def finish_agent_task(task: asyncio.Task, streamer: QueueCallbackHandler):
+    """Wait for the executor once the stream ended; cancel it if the stream was cancelled"""
+    if streamer.cancelled and not task.done():
+        task.cancel()
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not streamer.cancelled:
+            raise
+        return None
+
 # streaming function
-async def token_generator(content: str, streamer: QueueCallbackHandler):
-    task = asyncio.create_task(agent_executor.invoke(
-        input=content,
-        streamer=streamer,
-        verbose=True  # set to True to see verbose output in console
-    ))
-    # initialize various components to stream
-    async for token in streamer:
+async def token_generator(content: str, streamer: QueueCallbackHandler, mode: str = "auto",
+                          request: Request | None = None, session_id: str | None = None,
+                          ticket: AdmissionTicket | None = None, collections: list[str] | None = None,
+                          filters: MetadataFilter | None = None):
+    started = time.perf_counter()
+    async with agent_run(content, streamer, mode, request, session_id, ticket, collections, filters) as (route, task):
+        # initialize various components to stream
+        current_step = None
+        first_answer_token = False
+        async for token in streamer:
+            try:
+                if token == "<<STEP_END>>":
+                    # send end of step token
+                    yield "</step>"
+                elif isinstance(token, dict):
+                    # out-of-band events (sources) are only sent in the "events" stream format
+                    continue
+                elif tool_calls := token.message.additional_kwargs.get("tool_calls"):
+                    if tool_name := tool_calls[0]["function"]["name"]:
+                        current_step = tool_name
+                        # send start of step token followed by step name tokens
+                        yield f"<step><step_name>{tool_name}</step_name>"
+                    if tool_args := tool_calls[0]["function"]["arguments"]:
+                        if current_step == "final_answer" and not first_answer_token:
+                            first_answer_token = True
+                            observe_latency(f"invoke_{route}_ttft", time.perf_counter() - started)
+                        # tool args are streamed directly, ensure it's properly encoded
+                        yield tool_args
+            except Exception as e:
+                print(f"Error streaming token: {e}")
+                continue
+        await finish_agent_task(task, streamer)
+        if not streamer.cancelled:
+            observe_latency(f"invoke_{route}_total", time.perf_counter() - started)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# streaming function for stream_format=events
+async def event_generator(content: str, streamer: QueueCallbackHandler, mode: str = "auto",
+                          request: Request | None = None, session_id: str | None = None,
+                          ticket: AdmissionTicket | None = None, collections: list[str] | None = None,
+                          filters: MetadataFilter | None = None):
+    """
+    Server-sent events instead of raw tool-call JSON: `step`, `sources` (as soon as
+    retrieval finishes), `answer` with plain-text deltas of final_answer.answer,
+    `step_end` and a closing `done` with the tools used.
+    """
+    started = time.perf_counter()
+    async with agent_run(content, streamer, mode, request, session_id, ticket, collections, filters) as (route, task):
+        current_step = None
+        answer_field = None
+        first_answer_token = False
+        async for token in streamer:
+            try:
+                if token == "<<STEP_END>>":
+                    yield sse_event("step_end", {"name": current_step})
+                elif isinstance(token, dict):
+                    yield sse_event(token["event"], token["data"])
+                elif tool_calls := token.message.additional_kwargs.get("tool_calls"):
+                    if tool_name := tool_calls[0]["function"]["name"]:
+                        current_step = tool_name
+                        answer_field = IncrementalJSONStringField("answer") if tool_name == "final_answer" else None
+                        yield sse_event("step", {"name": tool_name})
+                    tool_args = tool_calls[0]["function"]["arguments"]
+                    if tool_args and answer_field:
+                        if delta := answer_field.feed(tool_args):
+                            if not first_answer_token:
+                                first_answer_token = True
+                                observe_latency(f"invoke_{route}_ttft", time.perf_counter() - started)
+                            yield sse_event("answer", {"delta": delta})
+            except Exception as e:
+                print(f"Error streaming token: {e}")
+                continue
         try:
-            if token == "<<STEP_END>>":
-                # send end of step token
-                yield "</step>"
-            elif tool_calls := token.message.additional_kwargs.get("tool_calls"):
-                if tool_name := tool_calls[0]["function"]["name"]:
-                    # send start of step token followed by step name tokens
-                    yield f"<step><step_name>{tool_name}</step_name>"
-                if tool_args := tool_calls[0]["function"]["arguments"]:
-                    # tool args are streamed directly, ensure it's properly encoded
-                    yield tool_args
+            result = await finish_agent_task(task, streamer)
+            if streamer.timed_out:
+                yield sse_event("error", {"detail": "stream idle timeout"})
+            elif not streamer.disconnected:
+                tools_used = result.get("tools_used", []) if isinstance(result, dict) else []
+                yield sse_event("done", {"tools_used": tools_used})
         except Exception as e:
-            print(f"Error streaming token: {e}")
-            continue
-    await task
+            print(f"ERROR: Agent task failed: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+        if not streamer.cancelled:
+            observe_latency(f"invoke_{route}_total", time.perf_counter() - started)
+
+def parse_metadata_filter(filters: str | None) -> MetadataFilter | None:
+    """The /invoke `filters` form field (a JSON object) as a MetadataFilter; 400 when it is malformed"""
+    if not filters or not filters.strip():
+        return None
+    try:
+        values = json.loads(filters)
+        if not isinstance(values, dict):
+            raise ValueError("filters must be a JSON object")
+        return MetadataFilter.from_dict(values) or None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
 
 # invoke function
 @app.post("/invoke")
-async def invoke(content: str = Form(...)):
+async def invoke(request: Request,
+                 content: str = Form(...),
+                 mode: str = Form("auto", description="auto, direct (fast RAG path) or agent (full tool loop)"),
+                 stream_format: str = Form("steps", description="steps (raw tool-call JSON) or events (SSE with answer text deltas)"),
+                 session_id: str | None = Form(None, description="Conversation ID issued in the X-Session-ID response header (also accepted as that request header); unknown or expired IDs start a new conversation"),
+                 collections: str | None = Form(None, description="Comma-separated folders, collection names or course codes to search; routed automatically when empty"),
+                 filters: str | None = Form(None, description='JSON metadata filter applied inside the vector search, e.g. {"course": "CT188", "extension": ["pdf", "docx"], "ingested_after": "2026-01-01"}')):
+    metadata_filter = parse_metadata_filter(filters)
+    # history is kept per session so concurrent users never share a conversation;
+    # only ids issued by this server are honoured, anything else gets a new conversation
+    session_id = session_memory.resolve(session_id or request.headers.get("X-Session-ID"))
+    # wait for a slot; fairness is keyed on the client address, never on an id the client can mint
+    # (a new session per request would otherwise bypass max_queue_per_client and the round-robin)
+    client_key = request.client.host if request.client else "unknown"
+    try:
+        ticket = await admission.acquire(client_key)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=f"Server busy ({e.reason}), please retry",
+                            headers={"Retry-After": str(e.retry_after)})
     queue: asyncio.Queue = asyncio.Queue()
-    streamer = QueueCallbackHandler(queue)
+    streamer = QueueCallbackHandler(queue, idle_timeout=agent_config['stream_idle_timeout'])
+    generator = event_generator if stream_format == "events" else token_generator
     # return the streaming response
     return StreamingResponse(
-        token_generator(content, streamer),
+        generator(content, streamer, mode, request, session_id, ticket,
+                  [item for item in collections.split(",") if item.strip()] if collections else None,
+                  metadata_filter),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
+            "X-Session-ID": session_id,
+        },
+        # also frees the slot when the stream never started
+        background=BackgroundTask(ticket.release)
     )
 
 @app.post("/admin/files-upload")
@@ -87,8 +316,9 @@ async def update_settings(settings_data: SettingsUpdate):
     result = settings.update_config(config_dict)
     return result
 
-@app.get("/download")
-async def download_file(filename: str = Query(..., description="Name of the file to download")):
+@app.api_route("/download", methods=["GET", "HEAD"])
+async def download_file(filename: str = Query(..., description="Name of the file to download"),
+                        inline: bool = Query(False, description="Display in the browser (PDF, PNG, JPEG and plain text only) instead of downloading")):
     """Download files from data/public directory"""
     try:
         # Define the public data directory
@@ -108,19 +338,32 @@ async def download_file(filename: str = Query(..., description="Name of the file
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid file path")
         
-        # Check if the file exists
-        if not file_path.exists():
+        # Check if the file exists (one stat, reused for the validators and Content-Length)
+        try:
+            stat_result = await asyncio.to_thread(os.stat, file_path)
+        except (FileNotFoundError, NotADirectoryError):
             raise HTTPException(status_code=404, detail=f"File '{clean_filename}' not found")
         
         # Check if it's actually a file (not a directory)
-        if not file_path.is_file():
+        if not stat.S_ISREG(stat_result.st_mode):
             raise HTTPException(status_code=400, detail=f"'{clean_filename}' is not a valid file")
         
-        # Return the file
-        return FileResponse(
+        download_name = os.path.basename(clean_filename)  # Use just the filename for download
+        if download_config['accel_redirect_header']:
+            # The reverse proxy sends the file (sendfile, ranges, 304) from an internal location
+            return accel_redirect_response(download_config['accel_redirect_header'],
+                                           download_config['accel_redirect_prefix'], str(file_path),
+                                           clean_filename, stat_result, download_name, inline=inline,
+                                           cache_max_age=download_config['cache_max_age'])
+        
+        # Return the file: ETag / Last-Modified with 304 revalidation, Range requests and the real MIME type
+        return DownloadResponse(
             path=str(file_path),
-            filename=os.path.basename(clean_filename),  # Use just the filename for download
-            media_type='application/octet-stream'  # Generic binary file type
+            stat_result=stat_result,
+            filename=download_name,
+            inline=inline,
+            cache_max_age=download_config['cache_max_age'],
+            chunk_size=download_config['chunk_size']
         )
         
     except HTTPException:
@@ -130,8 +373,30 @@ async def download_file(filename: str = Query(..., description="Name of the file
         # Handle any other unexpected errors
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
+def listing_page(page: int | None, page_size: int | None, sort: str, order: str) -> tuple[int, int | None]:
+    """
+    Offset and limit of a listing page (1-based `page`; `page_size` defaults to [file_index] page_size).
+    Without `page` and `page_size` the whole listing is returned (limit None), as clients that never page expect.
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort: {sort} (supported: {', '.join(SORT_KEYS)})")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Invalid order: {order} (asc or desc)")
+    if page is None and page_size is None:
+        return 0, None
+    page_size = min(max(page_size or file_index_config['page_size'], 1), file_index_config['max_page_size'])
+    return (max(page or 1, 1) - 1) * page_size, page_size
+
+def not_modified(request: Request, etag: str) -> bool:
+    return etag_matches(request.headers.get("if-none-match"), etag)
+
 @app.get("/download/list")
-async def list_downloadable_files():
+async def list_downloadable_files(request: Request, response: Response,
+                                  recursive: bool = Query(False, description="Include files in subdirectories"),
+                                  page: int | None = Query(None, ge=1, description="1-based page; every file when page and page_size are omitted"),
+                                  page_size: int | None = Query(None, ge=1),
+                                  sort: str = Query("name", description="name, size, modified or type"),
+                                  order: str = Query("asc", description="asc or desc")):
     """List all files available for download in data/public directory"""
     try:
         public_data_dir = Path("data/public_data")
@@ -140,28 +405,38 @@ async def list_downloadable_files():
         if not public_data_dir.exists():
             return {"files": [], "message": "Public data directory not found"}
         
-        # Get all files in the directory
-        files = []
-        for file_path in public_data_dir.iterdir():
-            if file_path.is_file():
-                file_info = {
-                    "filename": file_path.name,
-                    "size": file_path.stat().st_size,
-                    "modified": file_path.stat().st_mtime
-                }
-                files.append(file_info)
+        offset, limit = listing_page(page, page_size, sort, order)
+        listing = public_files.list_files("", recursive=recursive, sort=sort, order=order, offset=offset, limit=limit)
+        if listing is None:
+            return {"files": [], "message": "Public data directory not found"}
+        if not_modified(request, listing.etag):
+            return Response(status_code=304, headers={"ETag": listing.etag})
+        response.headers["ETag"] = listing.etag
+        
+        files = [{"filename": item["path"] if recursive else item["name"], "size": item["size"],
+                  "modified": item["modified"]} for item in listing.items]
         
         return {
             "files": files,
-            "count": len(files),
+            "count": listing.total,
+            "page": page or 1,
+            "page_size": limit,
+            "has_more": offset + len(files) < listing.total,
             "directory": str(public_data_dir)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
 
 @app.get("/admin/files")
-async def list_admin_files(path: str = Query("", description="Relative path within public_data directory")):
+async def list_admin_files(request: Request, response: Response,
+                           path: str = Query("", description="Relative path within public_data directory"),
+                           page: int | None = Query(None, ge=1, description="1-based page; every entry when page and page_size are omitted"),
+                           page_size: int | None = Query(None, ge=1),
+                           sort: str = Query("name", description="name, size, modified or type"),
+                           order: str = Query("asc", description="asc or desc")):
     """List all files and directories in data/public_data with full directory structure"""
     try:
         # Base directory
@@ -183,57 +458,27 @@ async def list_admin_files(path: str = Query("", description="Relative path with
         try:
             target_dir = target_dir.resolve()
             base_dir = base_dir.resolve()
-            target_dir.relative_to(base_dir)
+            relative_dir = target_dir.relative_to(base_dir).as_posix()
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid path: access denied")
+        relative_dir = "" if relative_dir == "." else relative_dir
+        
+        # Served from the in-memory tree index; a directory it does not know yet is re-read once
+        offset, limit = listing_page(page, page_size, sort, order)
+        listing = public_files.list_dir(relative_dir, sort=sort, order=order, offset=offset, limit=limit)
+        if listing is None and target_dir.exists():
+            await asyncio.to_thread(public_files.notify, str(target_dir))
+            listing = public_files.list_dir(relative_dir, sort=sort, order=order, offset=offset, limit=limit)
         
         # Check if target directory exists
-        if not target_dir.exists():
+        if listing is None:
+            if target_dir.exists() and not target_dir.is_dir():
+                raise HTTPException(status_code=400, detail=f"Path is not a directory: {path}")
             raise HTTPException(status_code=404, detail=f"Directory not found: {path}")
         
-        if not target_dir.is_dir():
-            raise HTTPException(status_code=400, detail=f"Path is not a directory: {path}")
-        
-        # Get directory contents
-        items = []
-        try:
-            for item_path in sorted(target_dir.iterdir()):
-                item_info = {
-                    "name": item_path.name,
-                    "type": "directory" if item_path.is_dir() else "file",
-                    "path": str(item_path.relative_to(base_dir)),
-                    "size": None,
-                    "modified": None,
-                    "extension": None
-                }
-                
-                if item_path.is_file():
-                    try:
-                        stat = item_path.stat()
-                        item_info.update({
-                            "size": stat.st_size,
-                            "modified": stat.st_mtime,
-                            "extension": item_path.suffix.lower()
-                        })
-                    except (OSError, PermissionError):
-                        # If we can't get file stats, just mark as unknown
-                        item_info.update({
-                            "size": 0,
-                            "modified": 0,
-                            "extension": item_path.suffix.lower() if item_path.suffix else None
-                        })
-                elif item_path.is_dir():
-                    # Count items in directory
-                    try:
-                        dir_count = len(list(item_path.iterdir()))
-                        item_info["children_count"] = dir_count
-                    except (OSError, PermissionError):
-                        item_info["children_count"] = 0
-                
-                items.append(item_info)
-        
-        except PermissionError:
-            raise HTTPException(status_code=403, detail=f"Permission denied accessing directory: {path}")
+        if not_modified(request, listing.etag):
+            return Response(status_code=304, headers={"ETag": listing.etag})
+        response.headers["ETag"] = listing.etag
         
         # Build breadcrumb path
         breadcrumb = []
@@ -249,12 +494,15 @@ async def list_admin_files(path: str = Query("", description="Relative path with
                     })
         
         return {
-            "items": items,
+            "items": listing.items,
             "current_path": path if path else "",
             "breadcrumb": breadcrumb,
-            "total_items": len(items),
-            "directories": len([item for item in items if item["type"] == "directory"]),
-            "files": len([item for item in items if item["type"] == "file"]),
+            "total_items": listing.total,
+            "directories": listing.directories,
+            "files": listing.files,
+            "page": page or 1,
+            "page_size": limit,
+            "has_more": offset + len(listing.items) < listing.total,
             "base_directory": str(base_dir)
         }
         
@@ -301,8 +549,13 @@ async def delete_file(filename: str = Query(..., description="Relative path of t
         
         # Delete the file
         file_path.unlink()
+        public_files.remove(str(file_path))
         
         print(f"Successfully deleted file: {clean_filename} (size: {file_size} bytes)")
+
+        # Drop the file's chunks from the index so they stop taking top-k slots; this copies the store
+        # and waits for a running ingestion, so it is queued instead of holding the request
+        vector_removals.submit(clean_filename)
         
         return {
             "success": True,
@@ -310,7 +563,8 @@ async def delete_file(filename: str = Query(..., description="Relative path of t
             "deleted_file": {
                 "filename": clean_filename,
                 "size": file_size,
-                "deleted_at": datetime.now().isoformat()
+                "deleted_at": datetime.now().isoformat(),
+                "vector_removal": "queued"
             }
         }
         
@@ -326,6 +580,42 @@ async def delete_file(filename: str = Query(..., description="Relative path of t
         print(f"Error deleting file {filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
 
+@app.get("/collections")
+async def list_collections():
+    """Knowledge-base collections of the serving index (one per course / project folder)"""
+    return {"collections": vectordb.current().vectorstore.stats()}
+
+@app.get("/admin/index/maintenance")
+async def index_maintenance_report():
+    """Orphaned, duplicate and stale vectors of the serving index, with its size and query latency"""
+    def report():
+        path = snapshot_path(PERSIST_DIR)
+        summary = maintenance.summarize(maintenance.analyze(path))
+        summary["latency"] = maintenance.query_latency(maintenance.open_collections(path))
+        return summary
+    try:
+        return await asyncio.to_thread(report)
+    except Exception as e:
+        print(f"Error analyzing index: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error analyzing index: {str(e)}")
+
+@app.post("/admin/index/compact")
+async def index_compact(remove_orphaned: bool = Query(True), remove_duplicate: bool = Query(True),
+                        remove_stale: bool = Query(True)):
+    """Publish a compacted snapshot without the selected vectors; returns before/after size and latency"""
+    try:
+        return await asyncio.to_thread(maintenance.compact, PERSIST_DIR, remove_orphaned, remove_duplicate, remove_stale)
+    except TimeoutError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error compacting index: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error compacting index: {str(e)}")
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics (cache hit ratios, request latency, cancelled requests, admission queue, LLM hedging, file index)"""
+    return {"cache": cache_stats(), "latency": latency_stats(), "cancellation": cancellations.stats(), "admission": admission.stats(), "http": http_client_stats(), "llm": llm_stats(), "rate_limit": rate_limiter.stats(), "file_index": public_files.stats(), "vector_removal": vector_removals.stats()}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -20,6 +20,7 @@ class ModelsConfig(BaseModel):
     llm_base_url: Optional[str] = None
     embedding_base_url: Optional[str] = None
     embedding_api_key: Optional[str] = None
+    embedding_search_dimensions: Optional[int] = None
 
 class SettingsUpdate(BaseModel):
     proxy: Optional[ProxyConfig] = None
@@ -2,6 +2,8 @@ import configparser
 import os
 from typing import Dict, Any
 
+from functions.utils.common import get_int_option
+
 class Settings:
     def __init__(self, config_path: str = None):
         # Use multiple possible paths if no specific path provided
@@ -61,7 +63,8 @@ class Settings:
                 "embedding_model": config.get('embedding_model', 'model', fallback='text-embedding-3-small'),
                 "base_url": config.get('embedding_model', 'base_url', fallback=''),
                 "temperature": config.getfloat('embedding_model', 'temperature', fallback=0.0),
-                "openai_api_key": config.get('embedding_model', 'openai_api_key', fallback='')
+                "openai_api_key": config.get('embedding_model', 'openai_api_key', fallback=''),
+                "search_dimensions": get_int_option(config, 'embedding_model', 'search_dimensions', 0)
             }
             
             # Combine model settings for backward compatibility
@@ -72,7 +75,8 @@ class Settings:
                 "openai_api_key": llm_config["openai_api_key"],
                 "llm_base_url": llm_config["base_url"],
                 "embedding_base_url": embedding_config["base_url"],
-                "embedding_api_key": embedding_config["openai_api_key"]
+                "embedding_api_key": embedding_config["openai_api_key"],
+                "embedding_search_dimensions": embedding_config["search_dimensions"]
             }
             
             return {
@@ -92,7 +96,8 @@ class Settings:
                     "openai_api_key": "",
                     "llm_base_url": "",
                     "embedding_base_url": "",
-                    "embedding_api_key": ""
+                    "embedding_api_key": "",
+                    "embedding_search_dimensions": 0
                 }
             }
     
@@ -167,6 +172,8 @@ class Settings:
                     config.set('embedding_model', 'base_url', models_data['embedding_base_url'])
                 if 'embedding_api_key' in models_data:
                     config.set('embedding_model', 'openai_api_key', models_data['embedding_api_key'])
+                if 'embedding_search_dimensions' in models_data:
+                    config.set('embedding_model', 'search_dimensions', str(models_data['embedding_search_dimensions']))
                 # Note: Don't automatically overwrite embedding API key with LLM API key during updates
                 # This preserves the existing embedding API key unless explicitly updated
             
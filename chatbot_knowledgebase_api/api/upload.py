@@ -1,45 +1,173 @@
 import asyncio
+import hashlib
 import subprocess
 import shutil
 import os
 import time
+import uuid
 import concurrent.futures
 from datetime import datetime
-from fastapi import UploadFile, File
+from fastapi import UploadFile, File, HTTPException
 from typing import List, Dict, Any
 
+import aiofiles
+import aiofiles.os
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from functions.utils.common import load_section_config
+from functions.utils.file_tree import public_files
+from functions.vector_index import maintenance
+from functions.vector_index.kb_collections import normalize_path
+
+
+def load_upload_config() -> dict:
+    return load_section_config('upload', {
+        'max_file_bytes': 104857600,
+        'max_request_bytes': 524288000,
+        'chunk_size': 1048576,
+        'temp_dir': 'data/.upload_tmp',
+        'deduplicate': True,
+        # multipart boundaries and part headers on top of the file bytes
+        'multipart_overhead_bytes': 1048576,
+    })
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware bounding the request body of the upload endpoints.
+
+    Starlette spools the whole multipart body to temporary files before the
+    endpoint runs, so `max_request_bytes` is enforced while the body is
+    received: a Content-Length above the limit is answered with 413 before
+    anything is read, and a body without one (chunked) fails with 413 as soon
+    as it grows past the limit.
+    """
+
+    def __init__(self, app: ASGIApp, paths: tuple[str, ...] = ("/admin/files-upload",)):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        config = load_upload_config()
+        limit = config['max_request_bytes'] + config['multipart_overhead_bytes']
+        detail = f"Upload exceeds the limit of {config['max_request_bytes']} bytes per request"
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > limit:
+            print(f"WARNING: Rejected upload of {content_length} bytes before reading it")
+            response = JSONResponse({"detail": detail}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI passes HTTPExceptions raised while parsing the form through unchanged
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
 class FileUploads:
     def __init__(self, raw_data_dir: str = "./data/raw_data", 
                  public_data_dir: str = "./data/public_data", 
-                 logs_dir: str = "./logs"):
+                 logs_dir: str = "./logs",
+                 persist_dir: str = "chroma_store"):
         self.raw_data_dir = raw_data_dir
         self.public_data_dir = public_data_dir
         self.logs_dir = logs_dir
+        self.persist_dir = persist_dir
+        self.config = load_upload_config()
+        # sha256 of the files saved by this request, reused by ingestion instead of re-reading them
+        self.content_hashes: Dict[str, str] = {}
         
     def _create_directories(self):
         """Create necessary directories if they don't exist"""
         os.makedirs(self.raw_data_dir, exist_ok=True)
         os.makedirs(self.public_data_dir, exist_ok=True)
         os.makedirs(self.logs_dir, exist_ok=True)
+        # Same filesystem as raw_data (atomic rename), outside it (never moved or ingested half-written)
+        os.makedirs(self.config['temp_dir'], exist_ok=True)
     
-    async def _save_files(self, files: List[UploadFile]) -> List[Dict[str, str]]:
-        """Save uploaded files to raw_data directory"""
+    async def _save_file(self, file: UploadFile, request_budget: int) -> Dict[str, Any]:
+        """Stream one upload to a temp file in fixed-size chunks, hashing on the fly, then rename it into raw_data"""
+        clean_filename = file.filename.replace('..', '').lstrip('/\\')
+        file_path = os.path.join(self.raw_data_dir, clean_filename)
+        tmp_path = os.path.join(self.config['temp_dir'], f"{uuid.uuid4().hex}.upload")
+        limit = min(self.config['max_file_bytes'], request_budget)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as out:
+                while chunk := await file.read(self.config['chunk_size']):
+                    size += len(chunk)
+                    if size > self.config['max_file_bytes']:
+                        raise HTTPException(status_code=413, detail=f"'{clean_filename}' exceeds the upload limit of "
+                                                                    f"{self.config['max_file_bytes']} bytes per file")
+                    if size > limit:
+                        raise HTTPException(status_code=413, detail=f"Upload exceeds the limit of "
+                                                                    f"{self.config['max_request_bytes']} bytes per request")
+                    # hashlib releases the GIL for large buffers, so hashing runs beside the write
+                    await asyncio.gather(asyncio.to_thread(digest.update, chunk), out.write(chunk))
+        except BaseException:
+            try:
+                await aiofiles.os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        content_hash = digest.hexdigest()
+
+        # Same path and same content as what the index already holds: nothing to store or ingest
+        if self.config['deduplicate'] and os.path.exists(os.path.join(self.public_data_dir, clean_filename)):
+            try:
+                duplicate = await asyncio.to_thread(maintenance.has_indexed_content, self.persist_dir,
+                                                    clean_filename, content_hash)
+            except Exception as e:
+                print(f"WARNING: Could not check {clean_filename} against the index: {str(e)}")
+                duplicate = False
+            if duplicate:
+                await aiofiles.os.remove(tmp_path)
+                print(f"INFO: {clean_filename} is unchanged (sha256 {content_hash[:12]}), skipped")
+                return {"filename": clean_filename, "size": size, "sha256": content_hash, "duplicate": True}
+
+        await aiofiles.os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        await aiofiles.os.replace(tmp_path, file_path)
+        self.content_hashes[normalize_path(file_path)] = content_hash
+        print(f"INFO: File saved to {file_path} ({size} bytes, sha256 {content_hash[:12]})")
+        return {"filename": clean_filename, "saved_to": file_path, "size": size, "sha256": content_hash,
+                "duplicate": False}
+
+    async def _save_files(self, files: List[UploadFile]) -> List[Dict[str, Any]]:
+        """Save uploaded files to raw_data directory (all or none: any failure removes the files already saved)"""
         print("INFO: Starting file save process")
         results = []
-        for file in files:
-            print(f"INFO: Processing file {file.filename}")
-            contents = await file.read()
-            file_path = os.path.join(self.raw_data_dir, file.filename)
-            
-            # Create directory structure if it doesn't exist
-            file_dir = os.path.dirname(file_path)
-            os.makedirs(file_dir, exist_ok=True)
-            print(f"INFO: Created directory structure for {file_path}")
-            
-            with open(file_path, "wb") as f:
-                f.write(contents)
-            print(f"INFO: File saved to {file_path}")
-            results.append({"filename": file.filename, "saved_to": file_path})
+        remaining = self.config['max_request_bytes']
+        try:
+            for file in files:
+                print(f"INFO: Processing file {file.filename}")
+                result = await self._save_file(file, remaining)
+                remaining -= result["size"]
+                results.append(result)
+        except BaseException:
+            # a size limit, a client disconnect, a cancelled request or a write error all leave no files behind
+            for result in results:
+                if "saved_to" in result:
+                    try:
+                        await aiofiles.os.remove(result["saved_to"])
+                    except OSError:
+                        pass
+            raise
         print("INFO: File save process completed")
         return results
     
@@ -118,8 +246,9 @@ class FileUploads:
                 try:
                     from ingest import DocumentIngestor
                     print("INFO: Using DocumentIngestor class directly")
-                    ingestor = DocumentIngestor()
-                    result_tuple = ingestor.run()
+                    ingestor = DocumentIngestor(content_hashes=self.content_hashes)
+                    # In a worker thread: rate-limit waits, embedding calls and the snapshot copy must not block the event loop
+                    result_tuple = await asyncio.to_thread(ingestor.run)
                     
                     if result_tuple:
                         chunks, docs = result_tuple
@@ -199,6 +328,7 @@ class FileUploads:
                     
                     # Move file with retry mechanism for Windows file locks
                     await self._move_file_with_retry(src_path, dest_path)
+                    public_files.notify(dest_path)
             
             # Remove empty raw_data directory structure with retry
             print("INFO: Cleaning up raw_data directory")
@@ -259,6 +389,10 @@ class FileUploads:
         file_results = await self._save_files(files)
         results.extend(file_results)
         
+        if all(result["duplicate"] for result in file_results):
+            print("INFO: All files are already indexed, ingestion skipped")
+            return {"files": results}
+        
         # Run ingest.py in background and move files after success
         print("INFO: Starting ingest and move process")
         ingest_results = await self._run_ingest_process_and_move_files()
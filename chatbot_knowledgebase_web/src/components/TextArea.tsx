@@ -5,6 +5,15 @@ import { IncompleteJsonParser } from "incomplete-json-parser";
 import { ChatOutput } from "@/types";
 import API_CONFIG from "../config/api";
 
+// Conversation ID for this browser tab, so the API keeps a separate chat history per user.
+// The API issues it (X-Session-ID response header); an unknown or expired ID gets a new one.
+const getSessionId = () => sessionStorage.getItem("chat_session_id");
+
+const storeSessionId = (res: Response) => {
+  const sessionId = res.headers.get("X-Session-ID");
+  if (sessionId) sessionStorage.setItem("chat_session_id", sessionId);
+};
+
 const TextArea = ({
   setIsGenerating,
   isGenerating,
@@ -49,6 +58,8 @@ const TextArea = ({
     try {
       const formData = new FormData();
       formData.append('content', text);
+      const sessionId = getSessionId();
+      if (sessionId) formData.append('session_id', sessionId);
       
       const res = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.INVOKE}`, {
         method: "POST",
@@ -58,6 +69,7 @@ const TextArea = ({
       if (!res.ok) {
         throw new Error("Error");
       }
+      storeSessionId(res);
 
       const data = res.body;
       if (!data) {